@@ -0,0 +1,201 @@
+# alert_engine.py
+"""Motor de alertas con agrupación y cooldown.
+
+Durante una caída de Make.com cada lead fallido generaba varias líneas
+ERROR idénticas. En su lugar, el código reporta la falla con
+AlertEngine.reportar(clave, ...): una operación en memoria, sin E/S, que
+suma la ocurrencia al grupo de su clave. Cada ALERT_WINDOW_S segundos el motor
+evalúa los grupos y emite UNA alerta resumida por clave (ocurrencias, primera
+y última vez, algunos ejemplos) al sink configurado, respetando un cooldown de
+ALERT_COOLDOWN_S por clave:
+
+- caché en memoria del último envío por clave: mientras el cooldown está
+  vigente ni siquiera se consulta SQLite, las ocurrencias solo se acumulan;
+- tabla alert_cooldowns de analytics.db: al vencer el cooldown, el envío se
+  reclama con un UPSERT condicional, así que entre todos los workers sale una
+  sola alerta por clave y cooldown.
+
+El sink es cualquier async fn(Alerta): sink_log (por defecto, una línea en
+el log, que llega a system_logs), sink_webhook (POST JSON a
+ALERT_WEBHOOK_URL) o SinkMemoria para pruebas locales (verificar_alertas.py).
+"""
+import asyncio
+import logging
+import os
+import sqlite3
+import time
+from typing import Awaitable, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+import httpx
+
+from analytics_db import AnalyticsDB
+
+ALERT_WINDOW_S = float(os.environ.get("ALERT_WINDOW_S", "60"))
+ALERT_COOLDOWN_S = float(os.environ.get("ALERT_COOLDOWN_S", "900"))
+ALERT_WEBHOOK_URL = os.environ.get("ALERT_WEBHOOK_URL", "")
+# Ejemplos distintos (p. ej. empresas afectadas) que se conservan por alerta
+ALERT_MAX_EJEMPLOS = 5
+
+
+class Alerta(NamedTuple):
+    clave: str
+    nivel: str
+    mensaje: str
+    ocurrencias: int
+    primera: float
+    ultima: float
+    ejemplos: Tuple[str, ...]
+
+    def resumen(self) -> str:
+        duracion = self.ultima - self.primera
+        texto = f"{self.mensaje} ×{self.ocurrencias} en {duracion:.0f}s"
+        if self.ejemplos:
+            texto += f" (ej.: {', '.join(self.ejemplos)})"
+        return texto
+
+
+EnviarAlerta = Callable[[Alerta], Awaitable[None]]
+
+
+async def sink_log(alerta: Alerta):
+    logging.log(logging.getLevelName(alerta.nivel), f"🚨 [Alerta] {alerta.clave}: {alerta.resumen()}")
+
+
+def sink_webhook(http_client: httpx.AsyncClient, url: str, timeout: float = 10.0) -> EnviarAlerta:
+    async def enviar(alerta: Alerta):
+        response = await http_client.post(
+            url,
+            json={**alerta._asdict(), "ejemplos": list(alerta.ejemplos), "texto": alerta.resumen()},
+            timeout=timeout,
+        )
+        response.raise_for_status()
+    return enviar
+
+
+class SinkMemoria:
+    """Sink local para pruebas: guarda las alertas emitidas."""
+
+    def __init__(self):
+        self.alertas: List[Alerta] = []
+
+    async def __call__(self, alerta: Alerta):
+        self.alertas.append(alerta)
+
+
+def reclamar_cooldowns(conn: sqlite3.Connection, claves: List[str], ahora: float,
+                       cooldown: float) -> Dict[str, Optional[float]]:
+    """clave -> None si este worker reclamó el envío, o el last_sent vigente de otro worker."""
+    resultado = {}
+    for clave in claves:
+        cursor = conn.execute(
+            "INSERT INTO alert_cooldowns (alert_key, last_sent) VALUES (?, ?) "
+            "ON CONFLICT (alert_key) DO UPDATE SET last_sent = excluded.last_sent WHERE last_sent <= ?",
+            (clave, ahora, ahora - cooldown),
+        )
+        if cursor.rowcount:
+            resultado[clave] = None
+        else:
+            resultado[clave] = conn.execute(
+                "SELECT last_sent FROM alert_cooldowns WHERE alert_key = ?", (clave,)
+            ).fetchone()[0]
+    return resultado
+
+
+class _Grupo:
+    __slots__ = ("nivel", "mensaje", "ocurrencias", "primera", "ultima", "ejemplos")
+
+    def __init__(self, nivel: str, mensaje: str, ahora: float):
+        self.nivel = nivel
+        self.mensaje = mensaje
+        self.ocurrencias = 0
+        self.primera = ahora
+        self.ultima = ahora
+        self.ejemplos: Dict[str, None] = {}
+
+
+class AlertEngine:
+    """Agrupa fallas repetidas por clave y emite una alerta resumida por ventana y cooldown."""
+
+    def __init__(
+        self,
+        db: AnalyticsDB,
+        sink: EnviarAlerta = sink_log,
+        ventana: float = ALERT_WINDOW_S,
+        cooldown: float = ALERT_COOLDOWN_S,
+    ):
+        self.db = db
+        self.sink = sink
+        self.ventana = ventana
+        self.cooldown = cooldown
+        self._grupos: Dict[str, _Grupo] = {}
+        # Caché del último envío por clave (propio o de otro worker, leído de alert_cooldowns)
+        self._enviadas: Dict[str, float] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def reportar(self, clave: str, mensaje: str, ejemplo: Optional[str] = None, nivel: str = "ERROR"):
+        """Registra una ocurrencia; no hace E/S (se puede llamar en cada falla)."""
+        ahora = time.time()
+        grupo = self._grupos.get(clave)
+        if grupo is None:
+            grupo = self._grupos[clave] = _Grupo(nivel, mensaje, ahora)
+        grupo.ocurrencias += 1
+        grupo.ultima = ahora
+        if ejemplo is not None and len(grupo.ejemplos) < ALERT_MAX_EJEMPLOS:
+            grupo.ejemplos[ejemplo] = None
+
+    async def evaluar(self) -> int:
+        """Emite las alertas cuyo cooldown venció; devuelve cuántas se enviaron."""
+        ahora = time.time()
+        listas = [c for c in self._grupos if ahora - self._enviadas.get(c, 0) >= self.cooldown]
+        if not listas:
+            return 0
+        try:
+            vigentes = await self.db.write(reclamar_cooldowns, listas, ahora, self.cooldown)
+        except Exception as e:
+            logging.error(f"❌ [Alertas] Error al reclamar cooldowns: {e}")
+            return 0
+
+        enviadas = 0
+        for clave in listas:
+            if vigentes[clave] is not None:
+                # Otro worker ya la envió: seguir acumulando hasta que venza su cooldown
+                self._enviadas[clave] = vigentes[clave]
+                continue
+            self._enviadas[clave] = ahora
+            grupo = self._grupos.pop(clave)
+            alerta = Alerta(clave, grupo.nivel, grupo.mensaje, grupo.ocurrencias, grupo.primera, grupo.ultima,
+                            tuple(grupo.ejemplos))
+            try:
+                await self.sink(alerta)
+                enviadas += 1
+            except Exception as e:
+                logging.error(f"❌ [Alertas] No se pudo emitir {clave}: {e}")
+        return enviadas
+
+    def start(self):
+        if self.ventana <= 0:
+            return
+        self._task = asyncio.create_task(self._run(), name="alert-engine")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.evaluar()
+        if self._grupos:
+            pendientes = sum(g.ocurrencias for g in self._grupos.values())
+            logging.warning(
+                f"⚠️ [Alertas] {pendientes} ocurrencias en cooldown sin emitir al apagar: {', '.join(self._grupos)}"
+            )
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.ventana)
+            try:
+                await self.evaluar()
+            except Exception as e:
+                logging.error(f"❌ [Alertas] Error al evaluar alertas: {e}")
@@ -1,13 +1,26 @@
+import asyncio
+import json
 import os
 import sqlite3
 import secrets
 import uuid
-from datetime import datetime, timedelta
-from typing import List, Optional
-from fastapi import APIRouter, Depends, HTTPException, status, Query, Request
+from datetime import date, datetime
+from typing import Dict, List, Optional, Tuple
+from fastapi import APIRouter, Depends, HTTPException, status, Query, Request, Response
+from fastapi.responses import StreamingResponse
 from fastapi.security import HTTPBasic, HTTPBasicCredentials
 from pydantic import BaseModel
 
+from analytics_cache import ResponseCache, respuesta_condicional
+from analytics_db import AnalyticsDB, epoch_ahora, generacion_reinicio, hoy_utc
+from analytics_export import COLUMNAS as COLUMNAS_EXPORT, FORMATOS as FORMATOS_EXPORT, generar_export, importar_pyarrow, parsear_columnas
+from analytics_ingest import EventBuffer
+from analytics_logs import NIVELES, LogRing, consultar_logs, estado_salud, leer_salud, sumar_contador
+from analytics_partitions import PartitionMaintainer, borrar_particiones, insertar_eventos, ultimo_evento
+from analytics_presence import ConteoActivos, PresenceMap, contar_activos
+from analytics_rollup import PASOS_FUNNEL, RollupCompactor, borrar_rollups, fuente_eventos, fuente_funnel, fuente_sesiones
+from constants import PREGUNTAS_ORDENADAS
+
 # Configuración
 ANALYTICS_DB = "analytics.db"
 start_time = datetime.now()
@@ -84,43 +97,96 @@ def get_current_username(credentials: HTTPBasicCredentials = Depends(security)):
     return credentials.username
 
 # --- DATABASE ---
-def get_db():
-    conn = sqlite3.connect(ANALYTICS_DB)
-    conn.row_factory = sqlite3.Row
-    return conn
+# Pools de lectura/escritura con conexiones de larga vida por worker (abiertos
+# y cerrados en el lifespan de main.py). Las consultas son funciones síncronas
+# fn(conn, ...) que se ejecutan fuera del event loop.
+analytics_db = AnalyticsDB(ANALYTICS_DB)
+
+# Buffer write-behind de eventos de tracking (ver analytics_ingest.py)
+event_buffer = EventBuffer(analytics_db)
+
+# Heartbeats en memoria con checkpoint periódico; activos desde las cubetas compartidas (ver analytics_presence.py)
+presencia = PresenceMap(analytics_db)
+
+# Compactor de rollups diarios del dashboard (ver analytics_rollup.py)
+rollups = RollupCompactor(analytics_db)
+
+# Rollover, retención y archivo de las particiones mensuales de events (ver analytics_partitions.py)
+particiones_eventos = PartitionMaintainer(analytics_db)
+
+# Caché de respuestas de los GET del dashboard (ver analytics_cache.py)
+respuestas_cache = ResponseCache()
+
+# Logs WARNING+ del proceso hacia system_logs, por lotes (ver analytics_logs.py)
+registro_logs = LogRing(analytics_db)
+
+async def iniciar_analytics():
+    """Abre la base y arranca los procesos en segundo plano (lifespan)."""
+    analytics_db.open()
+    registro_logs.start()
+    event_buffer.start()
+    presencia.start()
+    rollups.start()
+    particiones_eventos.start()
+
+async def detener_analytics():
+    """Vacía los buffers pendientes y cierra la base (lifespan)."""
+    await particiones_eventos.stop()
+    await rollups.stop()
+    await event_buffer.stop()
+    await presencia.stop()
+    # Último: recoge también los avisos del apagado de los demás componentes
+    await registro_logs.stop()
+    analytics_db.close()
 
 # --- ENDPOINTS ---
 
-@router.get("/kpis", response_model=KPIsData)
-async def get_kpis(start_date: str, end_date: str, username: str = Depends(get_current_username)):
-    conn = get_db()
-    cursor = conn.cursor()
-    
-    # Filtro de fecha para SQL
-    date_filter = f"created_at BETWEEN '{start_date}T00:00:00' AND '{end_date}T23:59:59'"
-    
-    # 1. Total Leads (Sesiones)
-    cursor.execute(f"SELECT COUNT(*) FROM sessions WHERE {date_filter}")
-    total_leads = cursor.fetchone()[0]
-    
-    # 2. Conversiones
-    cursor.execute(f"SELECT COUNT(*) FROM sessions WHERE {date_filter} AND is_converted = 1")
-    total_conversions = cursor.fetchone()[0]
-    
+def validar_rango(start_date: str, end_date: str):
+    """Las consultas comparan fechas como texto: exigir YYYY-MM-DD estricto."""
+    for valor in (start_date, end_date):
+        try:
+            valido = date.fromisoformat(valor).isoformat() == valor
+        except ValueError:
+            valido = False
+        if not valido:
+            raise HTTPException(status_code=422, detail=f"Fecha inválida '{valor}': se espera YYYY-MM-DD")
+
+def version_datos(conn: sqlite3.Connection, con_activos: bool):
+    """Generación de reinicio, generación de ingesta (último event_id) y activos actuales."""
+    activos = contar_activos(conn) if con_activos else None
+    return generacion_reinicio(conn), ultimo_evento(conn), activos
+
+async def responder_cacheado(request: Request, endpoint: str, start_date: str, end_date: str,
+                             modelo, consulta, con_activos: bool = False, extra: tuple = ()):
+    """Sirve consulta(conn, start_date, end_date[, activos], *extra) desde la caché de respuestas, con ETag."""
+    reinicio, generacion, activos = await analytics_db.read(version_datos, con_activos)
+    cerrado = end_date < hoy_utc()
+    # Tras un /reset (en cualquier worker) ninguna entrada anterior coincide, aunque
+    # los event_id vuelvan a empezar desde 1
+    version = (reinicio, activos) if cerrado else (reinicio, generacion, activos)
+    clave = (endpoint, start_date, end_date) + extra
+    
+    entrada = respuestas_cache.obtener(clave, version)
+    if entrada is None:
+        # Los activos ya contados se pasan tal cual: la respuesta coincide con su versión
+        args = (start_date, end_date, activos) if con_activos else (start_date, end_date)
+        resultado = await analytics_db.read(consulta, *args, *extra)
+        if modelo is not None:
+            cuerpo = modelo.model_validate(resultado).model_dump_json().encode()
+        else:
+            cuerpo = json.dumps(resultado, ensure_ascii=False, separators=(",", ":")).encode()
+        entrada = respuestas_cache.guardar(clave, cuerpo, version, cerrado)
+    return respuesta_condicional(request, entrada)
+
+def armar_kpis(total_leads: int, total_conversions: int, amount, active_users: int):
     # 3. Tasa de conversión
     conversion_rate = round((total_conversions / total_leads * 100), 2) if total_leads > 0 else 0
     
     # 4. Abandono (100 - conversión, simplificado)
     abandonment_rate = round(100 - conversion_rate, 2)
     
-    # 5. Multa promedio
-    cursor.execute(f"SELECT AVG(conversion_amount) FROM sessions WHERE {date_filter} AND is_converted = 1")
-    avg_penalty = cursor.fetchone()[0] or 0
-    
-    # 6. Usuarios activos (últimos 5 min)
-    five_min_ago = (datetime.now() - timedelta(minutes=5)).isoformat()
-    cursor.execute(f"SELECT COUNT(*) FROM sessions WHERE last_activity > '{five_min_ago}'")
-    active_users = cursor.fetchone()[0]
+    # 5. Multa promedio (de las sesiones convertidas)
+    avg_penalty = amount / total_conversions if total_conversions else 0
     
     return {
         "total_leads": total_leads,
@@ -131,56 +197,71 @@ async def get_kpis(start_date: str, end_date: str, username: str = Depends(get_c
         "total_conversions": total_conversions
     }
 
-@router.get("/geo", response_model=GeoResponse)
-async def get_geo(start_date: str, end_date: str, username: str = Depends(get_current_username)):
-    conn = get_db()
-    cursor = conn.cursor()
-    date_filter = f"created_at BETWEEN '{start_date}T00:00:00' AND '{end_date}T23:59:59'"
+def consultar_kpis(conn: sqlite3.Connection, start_date: str, end_date: str, activos: ConteoActivos):
+    # Agregados de sesiones del rango (rollups diarios + sesiones de hoy)
+    sesiones, params = fuente_sesiones(conn, start_date, end_date)
+    
+    # 1. Total Leads (Sesiones), 2. Conversiones y monto convertido
+    fila = conn.execute(f"""
+        {sesiones}
+        SELECT COALESCE(SUM(sessions), 0), COALESCE(SUM(conversions), 0), SUM(conversion_amount) FROM s
+    """, params).fetchone()
+    
+    # 6. Usuarios activos (últimos 5 min)
+    active_users = activos.total
     
-    cursor.execute(f"""
-        SELECT country, country_code, COUNT(*) as total, 
-               SUM(CASE WHEN is_converted = 1 THEN 1 ELSE 0 END) as conversions
-        FROM sessions 
-        WHERE {date_filter} AND country_code IS NOT NULL
+    return armar_kpis(fila[0], fila[1], fila[2], active_users)
+
+@router.get("/kpis", response_model=KPIsData, dependencies=[Depends(validar_rango)])
+async def get_kpis(request: Request, start_date: str, end_date: str, username: str = Depends(get_current_username)):
+    return await responder_cacheado(request, "kpis", start_date, end_date, KPIsData, consultar_kpis, con_activos=True)
+
+def consultar_geo(conn: sqlite3.Connection, start_date: str, end_date: str, activos: ConteoActivos):
+    sesiones, params = fuente_sesiones(conn, start_date, end_date)
+    
+    rows = conn.execute(f"""
+        {sesiones}
+        SELECT MAX(country) as country, country_code, SUM(sessions) as total, 
+               SUM(conversions) as conversions
+        FROM s 
+        WHERE country_code IS NOT NULL
         GROUP BY country_code
         ORDER BY total DESC
-    """)
-    rows = cursor.fetchall()
+    """, params).fetchall()
     
+    # Activos por país
+    return armar_geo(rows, activos.por_pais)
+
+def armar_geo(rows, active_by_country: Dict[str, int]):
     countries = [
         {"country": r["country"], "country_code": r["country_code"], "total": r["total"], "conversions": r["conversions"]}
         for r in rows
     ]
     
-    # Activos por país
-    five_min_ago = (datetime.now() - timedelta(minutes=5)).isoformat()
-    cursor.execute(f"SELECT country_code, COUNT(*) FROM sessions WHERE last_activity > '{five_min_ago}' GROUP BY country_code")
-    active_rows = cursor.fetchall()
-    active_by_country = {r[0]: r[1] for r in active_rows if r[0]}
-    
     return {
         "countries": countries,
         "active_by_country": active_by_country,
         "total_countries": len(countries)
     }
 
-@router.get("/devices", response_model=DevicesResponse)
-async def get_devices(start_date: str, end_date: str, username: str = Depends(get_current_username)):
-    conn = get_db()
-    cursor = conn.cursor()
-    date_filter = f"created_at BETWEEN '{start_date}T00:00:00' AND '{end_date}T23:59:59'"
-    
-    cursor.execute(f"SELECT COUNT(*) FROM sessions WHERE {date_filter}")
-    total_sessions = cursor.fetchone()[0] or 1
-    
-    cursor.execute(f"""
-        SELECT device_type, COUNT(*) as total, 
-               SUM(CASE WHEN is_converted = 1 THEN 1 ELSE 0 END) as conversions
-        FROM sessions 
-        WHERE {date_filter}
+@router.get("/geo", response_model=GeoResponse, dependencies=[Depends(validar_rango)])
+async def get_geo(request: Request, start_date: str, end_date: str, username: str = Depends(get_current_username)):
+    return await responder_cacheado(request, "geo", start_date, end_date, GeoResponse, consultar_geo, con_activos=True)
+
+def consultar_devices(conn: sqlite3.Connection, start_date: str, end_date: str):
+    sesiones, params = fuente_sesiones(conn, start_date, end_date)
+    
+    rows = conn.execute(f"""
+        {sesiones}
+        SELECT device_type, SUM(sessions) as total, 
+               SUM(conversions) as conversions
+        FROM s 
         GROUP BY device_type
-    """)
-    rows = cursor.fetchall()
+    """, params).fetchall()
+    return armar_devices(rows)
+
+def armar_devices(rows):
+    total_sessions = sum(r["total"] for r in rows) or 1
     
     devices = []
     for r in rows:
@@ -195,23 +276,24 @@ async def get_devices(start_date: str, end_date: str, username: str = Depends(ge
     
     return {"devices": devices, "total_sessions": total_sessions}
 
-@router.get("/channels", response_model=ChannelsResponse)
-async def get_channels(start_date: str, end_date: str, username: str = Depends(get_current_username)):
-    conn = get_db()
-    cursor = conn.cursor()
-    date_filter = f"created_at BETWEEN '{start_date}T00:00:00' AND '{end_date}T23:59:59'"
-    
-    cursor.execute(f"SELECT COUNT(*) FROM sessions WHERE {date_filter}")
-    total_sessions = cursor.fetchone()[0] or 1
-    
-    cursor.execute(f"""
-        SELECT utm_source, COUNT(*) as total, 
-               SUM(CASE WHEN is_converted = 1 THEN 1 ELSE 0 END) as conversions
-        FROM sessions 
-        WHERE {date_filter}
+@router.get("/devices", response_model=DevicesResponse, dependencies=[Depends(validar_rango)])
+async def get_devices(request: Request, start_date: str, end_date: str, username: str = Depends(get_current_username)):
+    return await responder_cacheado(request, "devices", start_date, end_date, DevicesResponse, consultar_devices)
+
+def consultar_channels(conn: sqlite3.Connection, start_date: str, end_date: str):
+    sesiones, params = fuente_sesiones(conn, start_date, end_date)
+    
+    rows = conn.execute(f"""
+        {sesiones}
+        SELECT utm_source, SUM(sessions) as total, 
+               SUM(conversions) as conversions
+        FROM s 
         GROUP BY utm_source
-    """)
-    rows = cursor.fetchall()
+    """, params).fetchall()
+    return armar_channels(rows)
+
+def armar_channels(rows):
+    total_sessions = sum(r["total"] for r in rows) or 1
     
     channels = []
     for r in rows:
@@ -227,53 +309,49 @@ async def get_channels(start_date: str, end_date: str, username: str = Depends(g
         })
     
     return {"channels": channels, "total_sessions": total_sessions}
+
+@router.get("/channels", response_model=ChannelsResponse, dependencies=[Depends(validar_rango)])
+async def get_channels(request: Request, start_date: str, end_date: str, username: str = Depends(get_current_username)):
+    return await responder_cacheado(request, "channels", start_date, end_date, ChannelsResponse, consultar_channels)
+
 # --- DASHBOARD ENDPOINT ---
-@router.get("/dashboard", response_model=dict)
-async def get_dashboard_data(start_date: str, end_date: str, username: str = Depends(get_current_username)):
-    conn = get_db()
-    cursor = conn.cursor()
-    
-    # Filtros
-    date_filter = f"created_at BETWEEN '{start_date}T00:00:00' AND '{end_date}T23:59:59'"
-    
-    # 1. KPIs (Reutilizando lógica)
-    cursor.execute(f"SELECT COUNT(*) FROM sessions WHERE {date_filter}")
-    total_leads = cursor.fetchone()[0]
-    
-    cursor.execute(f"SELECT COUNT(*) FROM sessions WHERE {date_filter} AND is_converted = 1")
-    total_conversions = cursor.fetchone()[0]
-    
-    conversion_rate = round((total_conversions / total_leads * 100), 2) if total_leads > 0 else 0
-    abandonment_rate = round(100 - conversion_rate, 2)
-    
-    cursor.execute(f"SELECT AVG(conversion_amount) FROM sessions WHERE {date_filter} AND is_converted = 1")
-    avg_multa = cursor.fetchone()[0] or 0
-    
-    five_min_ago = (datetime.now() - timedelta(minutes=5)).isoformat()
-    cursor.execute(f"SELECT COUNT(*) FROM sessions WHERE last_activity > '{five_min_ago}'")
-    active_users = cursor.fetchone()[0]
-    
-    kpis = {
-        "total_leads": total_leads,
-        "conversion_rate": conversion_rate,
-        "avg_penalty_amount": float(avg_multa),
-        "active_users": active_users,
-        "abandonment_rate": abandonment_rate,
-        "total_conversions": total_conversions
-    }
-    
-    # 2. Funnel (Aproximación por eventos)
-    # Definir pasos: form_start -> form_submit -> questionnaire_start -> confirmation_page_viewed
-    steps = ["form_start", "form_submit", "questionnaire_start", "confirmation_page_viewed"]
-    funnel_counts = {}
-    
-    for step in steps:
-        cursor.execute(f"""
-            SELECT COUNT(DISTINCT session_id) 
-            FROM events 
-            WHERE event_type = '{step}' AND {date_filter}
-        """)
-        funnel_counts[step] = cursor.fetchone()[0]
+# Pasos del funnel (PASOS_FUNNEL, de init_db): form_start -> form_submit -> questionnaire_start -> confirmation_page_viewed
+EVENTOS_PREGUNTAS = tuple(
+    f"question_{accion}_{qid}" for qid in PREGUNTAS_ORDENADAS for accion in ("viewed", "answered")
+)
+EVENTOS_DASHBOARD = PASOS_FUNNEL + EVENTOS_PREGUNTAS
+
+def contar_eventos_dashboard(conn: sqlite3.Connection, start_date: str, end_date: str):
+    """event_type -> (eventos, sesiones distintas) para el funnel y las preguntas.
+
+    Lee los rollups diarios (más los eventos crudos de hoy). Las sesiones
+    distintas solo se calculan para los pasos del funnel, y sobre todo el
+    rango: una sesión que vuelve otro día no cuenta dos veces.
+    """
+    eventos, params = fuente_eventos(conn, start_date, end_date)
+    marcadores = ",".join("?" * len(EVENTOS_DASHBOARD))
+    filas = conn.execute(f"""
+        {eventos}
+        SELECT event_type, SUM(events) AS total
+        FROM e
+        WHERE event_type IN ({marcadores})
+        GROUP BY event_type
+    """, params + EVENTOS_DASHBOARD)
+    conteos = {r["event_type"]: (r["total"], 0) for r in filas}
+    
+    funnel, params = fuente_funnel(conn, start_date, end_date)
+    for r in conn.execute(f"""
+        {funnel}
+        SELECT event_type, COUNT(DISTINCT session_id) AS sesiones
+        FROM f
+        GROUP BY event_type
+    """, params):
+        conteos[r["event_type"]] = (conteos.get(r["event_type"], (0, 0))[0], r["sesiones"])
+    return conteos
+
+def armar_funnel(conteos: Dict[str, Tuple[int, int]]):
+    """Paneles de funnel y drop-off por pregunta a partir de contar_eventos_dashboard."""
+    funnel_counts = {step: conteos.get(step, (0, 0))[1] for step in PASOS_FUNNEL}
     
     # Asegurar orden lógico (descendente) para visualización
     funnel_data = {
@@ -290,35 +368,12 @@ async def get_dashboard_data(start_date: str, end_date: str, username: str = Dep
         {"step": "Confirmación Vista", "count": funnel_counts["confirmation_page_viewed"], "color": "#6366F1"},
     ]
     
-    # 3. Daily Traffic (Últimos N días en el rango)
-    # Agrupar por fecha (substr created_at, 0, 10)
-    cursor.execute(f"""
-        SELECT substr(created_at, 1, 10) as day, 
-               COUNT(*) as visits,
-               SUM(CASE WHEN is_converted = 1 THEN 1 ELSE 0 END) as completions,
-               SUM(CASE WHEN is_converted = 1 THEN conversion_amount ELSE 0 END) as amount
-        FROM sessions
-        WHERE {date_filter}
-        GROUP BY day
-        ORDER BY day ASC
-    """)
-    traffic_rows = cursor.fetchall()
-    daily_traffic = [
-        {"date": r["day"], "visits": r["visits"], "completions": r["completions"], "total_amount": r["amount"]}
-        for r in traffic_rows
-    ]
-    
-    # 4. Preguntas (Dropoff)
-    # Buscar eventos question_viewed_X y question_answered_X
-    # Asumimos IDs q1..q20
+    # Preguntas (Dropoff)
+    # Eventos question_viewed_X y question_answered_X para cada pregunta del cuestionario
     question_stats = {}
-    for i in range(1, 21):
-        qid = f"q{i}"
-        cursor.execute(f"SELECT COUNT(*) FROM events WHERE event_type = 'question_viewed_{qid}' AND {date_filter}")
-        viewed = cursor.fetchone()[0]
-        
-        cursor.execute(f"SELECT COUNT(*) FROM events WHERE event_type = 'question_answered_{qid}' AND {date_filter}")
-        answered = cursor.fetchone()[0]
+    for qid in PREGUNTAS_ORDENADAS:
+        viewed = conteos.get(f"question_viewed_{qid}", (0, 0))[0]
+        answered = conteos.get(f"question_answered_{qid}", (0, 0))[0]
         
         if viewed > 0:
             dropoff = round(((viewed - answered) / viewed) * 100, 1)
@@ -337,16 +392,199 @@ async def get_dashboard_data(start_date: str, end_date: str, username: str = Dep
         }
 
     return {
-        "kpis": kpis,
         "funnel": funnel_data,
         "detailed_funnel": detailed_funnel,
         "killer_question": killer_q,
         "question_dropoff": question_stats,
         "step_dropoff": {}, # Placeholder
-        "daily_traffic": daily_traffic,
-        "generated_at": datetime.now().isoformat()
     }
 
+def armar_traffic(rows):
+    return [
+        {"date": r["day"], "visits": r["visits"], "completions": r["completions"], "total_amount": r["amount"]}
+        for r in rows
+    ]
+
+# Paneles que /dashboard puede devolver con fields=; sin fields, los del dashboard original
+CAMPOS_DASHBOARD = ("kpis", "funnel", "traffic", "geo", "devices", "channels")
+CAMPOS_POR_DEFECTO = ("kpis", "funnel", "traffic")
+
+def parsear_campos(fields: Optional[str]) -> Tuple[str, ...]:
+    """fields=kpis,geo,... -> tupla en orden canónico (la clave de caché no depende del orden pedido)."""
+    if fields is None:
+        return CAMPOS_POR_DEFECTO
+    pedidos = {campo.strip() for campo in fields.split(",") if campo.strip()}
+    desconocidos = pedidos - set(CAMPOS_DASHBOARD)
+    if desconocidos or not pedidos:
+        raise HTTPException(
+            status_code=422,
+            detail=f"fields inválido: se admiten {', '.join(CAMPOS_DASHBOARD)}",
+        )
+    return tuple(campo for campo in CAMPOS_DASHBOARD if campo in pedidos)
+
+def filas_sesiones(conn: sqlite3.Connection, start_date: str, end_date: str):
+    """Agregados de sesiones del rango al grano de los rollups (día × país × dispositivo × canal).
+
+    Es la pasada compartida del dashboard combinado: KPIs, geo, devices,
+    channels y tráfico diario se suman en Python a partir de estas filas.
+    """
+    sesiones, params = fuente_sesiones(conn, start_date, end_date)
+    return conn.execute(f"""
+        {sesiones}
+        SELECT day, country_code, country, device_type, utm_source, sessions, conversions, conversion_amount
+        FROM s
+    """, params).fetchall()
+
+def sumar_por(filas, columna: str) -> Dict:
+    """GROUP BY columna sobre las filas compartidas, ordenado como lo haría SQLite (NULL primero)."""
+    grupos = {}
+    for f in filas:
+        g = grupos.get(f[columna])
+        if g is None:
+            g = grupos[f[columna]] = {"total": 0, "conversions": 0, "amount": 0}
+        g["total"] += f["sessions"]
+        g["conversions"] += f["conversions"]
+        g["amount"] += f["conversion_amount"]
+    return dict(sorted(grupos.items(), key=lambda kv: (kv[0] is not None, kv[0] or "")))
+
+def consultar_dashboard(conn: sqlite3.Connection, start_date: str, end_date: str,
+                        activos: ConteoActivos, campos: Tuple[str, ...] = CAMPOS_POR_DEFECTO):
+    resultado = {}
+    
+    # 1. Una sola pasada sobre las sesiones del rango para todos los paneles que la usan
+    filas = filas_sesiones(conn, start_date, end_date) if set(campos) - {"funnel"} else []
+    
+    # 2. KPIs
+    if "kpis" in campos:
+        amount = sum(f["conversion_amount"] for f in filas) if filas else None
+        resultado["kpis"] = armar_kpis(
+            sum(f["sessions"] for f in filas), sum(f["conversions"] for f in filas), amount, activos.total
+        )
+    
+    # 3. Funnel (Aproximación por eventos)
+    # Una única consulta para el funnel y todas las preguntas
+    if "funnel" in campos:
+        resultado.update(armar_funnel(contar_eventos_dashboard(conn, start_date, end_date)))
+    
+    # 4. Daily Traffic (Últimos N días en el rango)
+    if "traffic" in campos:
+        resultado["daily_traffic"] = armar_traffic(
+            {"day": dia, "visits": g["total"], "completions": g["conversions"], "amount": g["amount"]}
+            for dia, g in sumar_por(filas, "day").items()
+        )
+    
+    # 5. Geo, devices y channels con la misma forma que sus endpoints
+    if "geo" in campos:
+        paises = {}
+        for f in filas:
+            if f["country"] is not None and f["country_code"] is not None:
+                paises[f["country_code"]] = max(paises.get(f["country_code"], f["country"]), f["country"])
+        por_pais = sumar_por([f for f in filas if f["country_code"] is not None], "country_code")
+        resultado["geo"] = armar_geo(
+            sorted(
+                ({"country": paises.get(codigo), "country_code": codigo, **g} for codigo, g in por_pais.items()),
+                key=lambda r: r["total"], reverse=True,
+            ),
+            activos.por_pais,
+        )
+    if "devices" in campos:
+        resultado["devices"] = armar_devices(
+            [{"device_type": k, **g} for k, g in sumar_por(filas, "device_type").items()]
+        )
+    if "channels" in campos:
+        resultado["channels"] = armar_channels(
+            [{"utm_source": k, **g} for k, g in sumar_por(filas, "utm_source").items()]
+        )
+    
+    resultado["generated_at"] = datetime.now().isoformat()
+    return resultado
+
+@router.get("/dashboard", response_model=dict, dependencies=[Depends(validar_rango)])
+async def get_dashboard_data(request: Request, start_date: str, end_date: str, fields: Optional[str] = None,
+                             username: str = Depends(get_current_username)):
+    """KPIs, funnel y tráfico diario; con fields= también geo, devices y channels en una sola respuesta."""
+    campos = parsear_campos(fields)
+    return await responder_cacheado(
+        request, "dashboard", start_date, end_date, None, consultar_dashboard, con_activos=True, extra=(campos,)
+    )
+
+# --- USUARIOS ACTIVOS EN VIVO (SSE) ---
+LIVE_INTERVAL_S = float(os.environ.get("ANALYTICS_LIVE_INTERVAL_S", "5"))
+
+@router.get("/live")
+async def live_active_users(request: Request, username: str = Depends(get_current_username)):
+    """Server-Sent Events con los usuarios activos; solo emite cuando cambian."""
+    async def eventos():
+        anterior = None
+        while not await request.is_disconnected():
+            conteo = await analytics_db.read(contar_activos)
+            actual = {"active_users": conteo.total, "active_by_country": conteo.por_pais}
+            if actual != anterior:
+                yield f"data: {json.dumps(actual)}\n\n"
+                anterior = actual
+            else:
+                # Comentario SSE: mantiene viva la conexión a través de proxies
+                yield ": ping\n\n"
+            await asyncio.sleep(LIVE_INTERVAL_S)
+
+    return StreamingResponse(
+        eventos(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+# --- LOGS Y SALUD DEL SISTEMA (ver analytics_logs.py) ---
+
+@router.get("/logs", response_model=List[SystemLog])
+async def get_logs(response: Response, limit: int = Query(50, ge=1, le=500), level: Optional[str] = None,
+                   module: Optional[str] = None, before_id: Optional[int] = None,
+                   username: str = Depends(get_current_username)):
+    """Logs más recientes primero; level es severidad mínima. X-Next-Before-Id apunta a la página siguiente."""
+    if level is not None:
+        level = level.upper()
+        if level not in NIVELES:
+            raise HTTPException(status_code=422, detail=f"level inválido: se admiten {', '.join(NIVELES)}")
+    logs = await analytics_db.read(consultar_logs, limit, level, module, before_id)
+    if len(logs) == limit:
+        response.headers["X-Next-Before-Id"] = str(logs[-1]["id"])
+    return logs
+
+@router.get("/health", response_model=HealthStatus)
+async def get_health(username: str = Depends(get_current_username)):
+    errors_24h, sessions_today = await analytics_db.read(leer_salud, epoch_ahora())
+    return {
+        "status": estado_salud(errors_24h),
+        "errors_24h": errors_24h,
+        "sessions_today": sessions_today,
+        "timestamp": datetime.now().isoformat(),
+    }
+
+# --- EXPORT COLUMNAR PARA BI (ver analytics_export.py) ---
+
+@router.get("/export/{tabla}", dependencies=[Depends(validar_rango)])
+async def export_data(tabla: str, start_date: str, end_date: str, format: str = "parquet",
+                      columns: Optional[str] = None, username: str = Depends(get_current_username)):
+    """sessions/events del rango como Parquet o Arrow IPC, en streaming por lotes."""
+    if tabla not in COLUMNAS_EXPORT:
+        raise HTTPException(status_code=404, detail=f"Tabla no exportable: se admiten {', '.join(COLUMNAS_EXPORT)}")
+    if format not in FORMATOS_EXPORT:
+        raise HTTPException(status_code=422, detail=f"format inválido: se admiten {', '.join(FORMATOS_EXPORT)}")
+    try:
+        columnas = parsear_columnas(tabla, columns)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    try:
+        # Antes de empezar el stream: sin pyarrow no debe enviarse un 200 vacío
+        importar_pyarrow()
+    except RuntimeError as e:
+        raise HTTPException(status_code=501, detail=str(e))
+
+    media_type, extension = FORMATOS_EXPORT[format]
+    return StreamingResponse(
+        generar_export(analytics_db.db_path, tabla, start_date, end_date, columnas, format),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{tabla}_{start_date}_{end_date}.{extension}"'},
+    )
 
 # --- MODELOS DE INPUT PARA TRACKING ---
 class SessionInput(BaseModel):
@@ -365,13 +603,37 @@ class HeartbeatInput(BaseModel):
 # --- ENDPOINTS DE TRACKING (PÚBLICOS - SIN AUTH BÁSICA) ---
 # Estos endpoints son llamados por el frontend del usuario, no requieren usuario/pass del dashboard
 
-@router.post("/session", status_code=201)
-async def create_session(data: SessionInput, request: Request):
-    conn = get_db()
+def registrar_sesion(conn: sqlite3.Connection, session: dict):
     cursor = conn.cursor()
+    cursor.execute('''
+        INSERT INTO sessions 
+        (session_id, created_at, device_info, user_agent, is_converted, 
+         conversion_amount, last_activity, country, country_code, 
+         device_type, utm_source)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', (
+        session["session_id"],
+        session["created_at"],
+        session["device_info"],
+        session["user_agent"],
+        0, # Not converted yet
+        0,
+        session["created_at"], # Last activity = now
+        session["country"],
+        session["country_code"],
+        session["device_type"],
+        session["utm_source"]
+    ))
     
+    # Registrar evento inicial
+    insertar_eventos(conn, [(session["session_id"], 'session_start', None, session["created_at"])])
+    # sessions_today de /health
+    sumar_contador(conn, "sesiones", session["created_at"] // 86400)
+
+@router.post("/session", status_code=201)
+async def create_session(data: SessionInput, request: Request):
     session_id = str(uuid.uuid4())
-    created_at = datetime.now().isoformat()
+    created_at = epoch_ahora()
     
     # Intentar inferir GeoIP (Simulado o headers)
     # En producción real usaríamos una DB de GeoIP o servicio externo
@@ -387,87 +649,52 @@ async def create_session(data: SessionInput, request: Request):
     if "mobile" in ua_lower: device_type = "mobile"
     elif "tablet" in ua_lower or "ipad" in ua_lower: device_type = "tablet"
     
-    cursor.execute('''
-        INSERT INTO sessions 
-        (session_id, created_at, device_info, user_agent, is_converted, 
-         conversion_amount, last_activity, country, country_code, 
-         device_type, utm_source)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-    ''', (
-        session_id,
-        created_at,
-        data.device_info,
-        user_agent,
-        0, # Not converted yet
-        0,
-        created_at, # Last activity = now
-        country,
-        country_code,
-        device_type,
-        data.utm_source
-    ))
-    
-    conn.commit()
-    
-    # Registrar evento inicial
-    cursor.execute('INSERT INTO events (session_id, event_type, created_at) VALUES (?, ?, ?)',
-                   (session_id, 'session_start', created_at))
-    conn.commit()
+    await analytics_db.write(registrar_sesion, {
+        "session_id": session_id,
+        "created_at": created_at,
+        "device_info": data.device_info,
+        "user_agent": user_agent,
+        "country": country,
+        "country_code": country_code,
+        "device_type": device_type,
+        "utm_source": data.utm_source,
+    })
     
     return {"session_id": session_id}
 
 @router.post("/event", status_code=201)
 async def track_event(data: EventInput):
-    conn = get_db()
-    cursor = conn.cursor()
-    created_at = datetime.now().isoformat()
-    
-    cursor.execute('''
-        INSERT INTO events (session_id, event_type, event_data, created_at)
-        VALUES (?, ?, ?, ?)
-    ''', (data.session_id, data.event_type, data.event_data, created_at))
-    
-    # Actualizar last_activity
-    cursor.execute("UPDATE sessions SET last_activity = ? WHERE session_id = ?", (created_at, data.session_id))
-    
-    # Lógica de Conversión
-    if data.event_type == "confirmation_page_viewed":
-        # Marcar como convertido
-        amount = 0
-        if data.event_data:
-            try:
-                import json
-                event_json = json.loads(data.event_data)
-                amount = float(event_json.get("amount", 0))
-            except:
-                pass
-        
-        cursor.execute("UPDATE sessions SET is_converted = 1, conversion_amount = ? WHERE session_id = ?", 
-                       (amount, data.session_id))
-    
-    conn.commit()
+    # Write-behind: el evento se persiste en el próximo flush del buffer
+    created_at = epoch_ahora()
+    presencia.touch(data.session_id, created_at)
+    await event_buffer.submit((data.session_id, data.event_type, data.event_data, created_at))
     return {"status": "ok"}
 
 @router.post("/heartbeat", status_code=200)
 async def heartbeat(data: HeartbeatInput):
-    conn = get_db()
-    cursor = conn.cursor()
-    now = datetime.now().isoformat()
-    
-    cursor.execute("UPDATE sessions SET last_activity = ? WHERE session_id = ?", (now, data.session_id))
-    conn.commit()
+    # Solo memoria: last_activity se vuelca a SQLite en el próximo checkpoint
+    presencia.touch(data.session_id, epoch_ahora())
     return {"status": "alive"}
 
+def borrar_datos(conn: sqlite3.Connection):
+    cursor = conn.cursor()
+    cursor.execute("DELETE FROM sessions")
+    cursor.execute("DELETE FROM presencia_cubetas")
+    borrar_particiones(conn)
+    cursor.execute("DELETE FROM system_logs")
+    cursor.execute("DELETE FROM contadores_salud")
+    borrar_rollups(conn)
+    cursor.execute("UPDATE generacion_datos SET valor = valor + 1 WHERE clave = 'reinicios'")
+
 @router.post("/reset", status_code=200)
 async def reset_database(username: str = Depends(get_current_username)):
-    conn = get_db()
-    cursor = conn.cursor()
     try:
-        cursor.execute("DELETE FROM sessions")
-        cursor.execute("DELETE FROM events")
-        cursor.execute("DELETE FROM system_logs")
-        conn.commit()
+        # write() hace rollback automáticamente si algo falla
+        await analytics_db.write(borrar_datos)
+        presencia.clear()
+        # Los demás workers descartan sus entradas de caché, sus eventos en buffer y sus
+        # heartbeats pendientes al ver la nueva generación de reinicio
+        respuestas_cache.clear()
         return {"message": "Base de datos reseteada correctamente. Datos eliminados."}
     except Exception as e:
-        conn.rollback()
         raise HTTPException(status_code=500, detail=f"Error al resetear DB: {str(e)}")
@@ -0,0 +1,91 @@
+# analytics_cache.py
+"""Caché de respuestas de los GET del dashboard con ETag.
+
+Entradas por (endpoint, start_date, end_date) con el cuerpo JSON ya
+serializado y su ETag. Una entrada vale mientras coincida su `version`:
+
+- rango cerrado (end_date < hoy): solo depende de los datos históricos; se
+  reutiliza hasta ANALYTICS_CACHE_TTL_HISTORICO_S (conversiones tardías de
+  sesiones antiguas se reflejan al vencer).
+- rango que incluye hoy: la versión incluye la generación de ingesta (último
+  event_id, compartido por todos los workers), así que cualquier evento o
+  sesión nueva la invalida; además vence a los ANALYTICS_CACHE_TTL_S.
+
+En ambos casos la versión incluye los usuarios activos del momento, que
+forman parte de la respuesta, y la generación de reinicio de analytics.db
+(tabla generacion_datos): un /reset atendido por cualquier worker invalida
+las entradas de todos. Con If-None-Match igual al ETag se responde 304.
+"""
+import hashlib
+import os
+import time
+from collections import OrderedDict
+from typing import NamedTuple, Optional
+
+from fastapi import Request, Response
+
+CACHE_ENABLED = os.environ.get("ANALYTICS_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+CACHE_TTL_S = float(os.environ.get("ANALYTICS_CACHE_TTL_S", "30"))
+CACHE_TTL_HISTORICO_S = float(os.environ.get("ANALYTICS_CACHE_TTL_HISTORICO_S", "3600"))
+CACHE_MAX_ENTRIES = int(os.environ.get("ANALYTICS_CACHE_MAX_ENTRIES", "256"))
+
+
+class EntradaCache(NamedTuple):
+    cuerpo: bytes
+    etag: str
+    version: tuple
+    creada: float
+    cerrado: bool
+
+
+def etag_de(cuerpo: bytes) -> str:
+    return '"' + hashlib.sha1(cuerpo).hexdigest() + '"'
+
+
+class ResponseCache:
+    """LRU acotado de respuestas serializadas."""
+
+    def __init__(
+        self,
+        ttl: float = CACHE_TTL_S,
+        ttl_historico: float = CACHE_TTL_HISTORICO_S,
+        max_entradas: int = CACHE_MAX_ENTRIES,
+    ):
+        self.ttl = ttl
+        self.ttl_historico = ttl_historico
+        self.max_entradas = max_entradas
+        self._entradas: "OrderedDict[tuple, EntradaCache]" = OrderedDict()
+
+    def obtener(self, clave: tuple, version: tuple) -> Optional[EntradaCache]:
+        entrada = self._entradas.get(clave)
+        if entrada is None:
+            return None
+        ttl = self.ttl_historico if entrada.cerrado else self.ttl
+        if entrada.version != version or time.monotonic() - entrada.creada > ttl:
+            del self._entradas[clave]
+            return None
+        self._entradas.move_to_end(clave)
+        return entrada
+
+    def guardar(self, clave: tuple, cuerpo: bytes, version: tuple, cerrado: bool) -> EntradaCache:
+        entrada = EntradaCache(cuerpo, etag_de(cuerpo), version, time.monotonic(), cerrado)
+        if CACHE_ENABLED:
+            self._entradas[clave] = entrada
+            self._entradas.move_to_end(clave)
+            while len(self._entradas) > self.max_entradas:
+                self._entradas.popitem(last=False)
+        return entrada
+
+    def clear(self):
+        self._entradas.clear()
+
+
+def respuesta_condicional(request: Request, entrada: EntradaCache) -> Response:
+    """200 con el cuerpo, o 304 si el cliente ya tiene esta versión."""
+    headers = {"ETag": entrada.etag, "Cache-Control": "private, no-cache"}
+    # Comparación débil (RFC 9110): un proxy pudo marcar el ETag como W/
+    if_none_match = request.headers.get("if-none-match", "")
+    etags_cliente = {etag.strip().removeprefix("W/") for etag in if_none_match.split(",")}
+    if entrada.etag in etags_cliente or "*" in etags_cliente:
+        return Response(status_code=304, headers=headers)
+    return Response(content=entrada.cuerpo, media_type="application/json", headers=headers)
@@ -0,0 +1,181 @@
+# analytics_db.py
+"""Gestor de conexiones SQLite para analytics.
+
+sqlite3 es bloqueante, así que ninguna consulta corre en el event loop: cada
+worker mantiene dos pools de hilos acotados, abiertos en el lifespan de
+FastAPI y cerrados al apagar:
+
+- lectura: N hilos, cada uno con su propia conexión de larga vida (consultas
+  del dashboard, que pueden ser pesadas).
+- escritura: 1 hilo con una única conexión (tracking). Al estar separado, las
+  escrituras nunca quedan en cola detrás de una lectura lenta del dashboard.
+
+Las conexiones se configuran con WAL (lectores y escritor no se bloquean entre
+sí) y pragmas ajustados para la carga de tracking.
+
+sessions.created_at/last_activity y events.created_at son epoch UTC en
+segundos enteros (migración 3 de init_db); la columna generada `day` es su
+fecha UTC YYYY-MM-DD, la misma que usan los filtros del dashboard.
+
+Cada read()/write() registra en /metrics la espera en la cola del pool y la
+duración de fn (con la transacción, en escritura), etiquetadas por fn.__name__.
+"""
+import asyncio
+import calendar
+import logging
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timezone
+from typing import Callable, List, Optional, TypeVar
+
+from metrics import registro_metricas
+
+T = TypeVar("T")
+
+# Pragmas aplicados a cada conexión (sobrescribibles por entorno)
+PRAGMAS = {
+    "journal_mode": "WAL",
+    # NORMAL es seguro con WAL: solo puede perderse la última transacción ante un corte de energía
+    "synchronous": os.environ.get("ANALYTICS_DB_SYNCHRONOUS", "NORMAL"),
+    "busy_timeout": int(os.environ.get("ANALYTICS_DB_BUSY_TIMEOUT_MS", "5000")),
+    # Valor negativo = KiB de caché de páginas por conexión
+    "cache_size": -int(os.environ.get("ANALYTICS_DB_CACHE_KB", "16384")),
+    "temp_store": "MEMORY",
+}
+
+READ_THREADS = int(os.environ.get("ANALYTICS_DB_READ_THREADS", "4"))
+
+METRICA_ESPERA = registro_metricas.histograma(
+    "analytics_db_espera_segundos", "Espera en la cola del pool antes de ejecutar la consulta", ("modo",)
+)
+METRICA_CONSULTA = registro_metricas.histograma(
+    "analytics_db_consulta_segundos", "Duración de las consultas a analytics.db en su hilo", ("consulta", "modo")
+)
+METRICA_ERRORES = registro_metricas.contador(
+    "analytics_db_errores_total", "Consultas a analytics.db que lanzaron una excepción", ("consulta", "modo")
+)
+
+
+# --- TIMESTAMPS ---
+
+def epoch_ahora() -> int:
+    return int(time.time())
+
+
+def epoch_de_dia(dia: str) -> int:
+    """Epoch de las 00:00 UTC del día YYYY-MM-DD (límite inferior de un rango por created_at)."""
+    return calendar.timegm(date.fromisoformat(dia).timetuple())
+
+
+def hoy_utc() -> str:
+    return datetime.now(timezone.utc).date().isoformat()
+
+
+def generacion_reinicio(conn: sqlite3.Connection) -> int:
+    """Cantidad de /reset aplicados a la base (común a todos los workers, migración 6)."""
+    fila = conn.execute("SELECT valor FROM generacion_datos WHERE clave = 'reinicios'").fetchone()
+    return fila[0] if fila else 0
+
+
+def configurar_conexion(conn: sqlite3.Connection) -> sqlite3.Connection:
+    conn.row_factory = sqlite3.Row
+    for pragma, valor in PRAGMAS.items():
+        conn.execute(f"PRAGMA {pragma}={valor}")
+    return conn
+
+
+class AnalyticsDB:
+    """Ejecutores de lectura/escritura con conexiones de larga vida por hilo."""
+
+    def __init__(self, db_path: str, read_threads: int = READ_THREADS):
+        self.db_path = db_path
+        self.read_threads = read_threads
+        self._lectura: Optional[ThreadPoolExecutor] = None
+        self._escritura: Optional[ThreadPoolExecutor] = None
+        self._local = threading.local()
+        self._conexiones: List[sqlite3.Connection] = []
+        self._lock = threading.Lock()
+
+    def open(self):
+        with self._lock:
+            if self._escritura is None:
+                self._lectura = ThreadPoolExecutor(self.read_threads, thread_name_prefix="analytics-read")
+                self._escritura = ThreadPoolExecutor(1, thread_name_prefix="analytics-write")
+                logging.info(
+                    f"🗄️ Analytics DB abierta ({self.db_path}, WAL, "
+                    f"{self.read_threads} hilos de lectura + 1 de escritura)"
+                )
+        return self
+
+    def _conexion_del_hilo(self, solo_lectura: bool) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # check_same_thread=False solo para poder cerrarla desde close()
+            conn = configurar_conexion(sqlite3.connect(self.db_path, check_same_thread=False))
+            if solo_lectura:
+                conn.execute("PRAGMA query_only=ON")
+            self._local.conn = conn
+            with self._lock:
+                self._conexiones.append(conn)
+        return conn
+
+    def _medir(self, modo: str, encolado: float, ejecutar: Callable[[], T], fn: Callable) -> T:
+        inicio = time.perf_counter()
+        METRICA_ESPERA.observar(inicio - encolado, modo)
+        try:
+            return ejecutar()
+        except Exception:
+            METRICA_ERRORES.sumar(fn.__name__, modo)
+            raise
+        finally:
+            METRICA_CONSULTA.observar(time.perf_counter() - inicio, fn.__name__, modo)
+
+    def _leer(self, fn: Callable[..., T], args, encolado: float) -> T:
+        return self._medir("lectura", encolado, lambda: fn(self._conexion_del_hilo(solo_lectura=True), *args), fn)
+
+    def _escribir(self, fn: Callable[..., T], args, encolado: float) -> T:
+        def ejecutar():
+            conn = self._conexion_del_hilo(solo_lectura=False)
+            # Transacción: commit si fn termina bien, rollback si lanza
+            with conn:
+                return fn(conn, *args)
+        return self._medir("escritura", encolado, ejecutar, fn)
+
+    async def read(self, fn: Callable[..., T], *args) -> T:
+        """Ejecuta fn(conn, *args) en el pool de lectura."""
+        if self._lectura is None:
+            self.open()
+        return await asyncio.get_running_loop().run_in_executor(
+            self._lectura, self._leer, fn, args, time.perf_counter()
+        )
+
+    async def write(self, fn: Callable[..., T], *args) -> T:
+        """Ejecuta fn(conn, *args) en el hilo de escritura, dentro de una transacción."""
+        if self._escritura is None:
+            self.open()
+        return await asyncio.get_running_loop().run_in_executor(
+            self._escritura, self._escribir, fn, args, time.perf_counter()
+        )
+
+    def close(self):
+        with self._lock:
+            ejecutores, self._lectura, self._escritura = (self._lectura, self._escritura), None, None
+        for ejecutor in ejecutores:
+            if ejecutor is not None:
+                ejecutor.shutdown(wait=True)
+        with self._lock:
+            conexiones, self._conexiones = self._conexiones, []
+        for conn in conexiones:
+            try:
+                # Actualiza estadísticas del planificador antes de cerrar
+                conn.execute("PRAGMA optimize")
+            except sqlite3.Error:
+                pass
+            conn.close()
+        # Los hilos nuevos tras un reinicio deben abrir conexiones nuevas
+        self._local = threading.local()
+        if any(ejecutores):
+            logging.info("🗄️ Analytics DB cerrada")
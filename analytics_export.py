@@ -0,0 +1,266 @@
+# analytics_export.py
+"""Export columnar (Parquet / Arrow IPC) de sessions y events para BI.
+
+En lugar de copiar analytics.db y lanzar consultas ad hoc sobre el archivo de
+producción, BI descarga el rango que necesita desde /api/analytics/export o
+con este script. El export:
+
+- lee con una conexión propia de solo lectura dentro de una transacción (una
+  instantánea WAL coherente entre particiones que no bloquea al escritor de
+  tracking ni ocupa los hilos de lectura del dashboard);
+- recorre el rango con fetchmany() y escribe cada lote de
+  ANALYTICS_EXPORT_CHUNK_ROWS filas como row group de Parquet o record batch
+  de Arrow, que se envía en cuanto está listo: la memoria queda acotada por el
+  tamaño del lote, no por el de la tabla;
+- solo selecciona las columnas pedidas (poda de columnas en el SELECT).
+
+pyarrow es opcional: se importa solo al exportar (pip install pyarrow).
+
+Uso:
+    python analytics_export.py events 2025-01-01 2025-01-31 -o events.parquet
+    python analytics_export.py sessions 2025-01-01 2025-01-31 -o sessions.arrow \\
+        --format arrow --columns session_id,created_at,country_code,is_converted
+"""
+import argparse
+import io
+import logging
+import os
+import sqlite3
+import sys
+import time
+from datetime import date, timedelta
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+from analytics_db import configurar_conexion, epoch_de_dia
+from analytics_partitions import particiones_en_rango
+
+EXPORT_CHUNK_ROWS = int(os.environ.get("ANALYTICS_EXPORT_CHUNK_ROWS", "50000"))
+
+FORMATOS = {
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+    "arrow": ("application/vnd.apache.arrow.stream", "arrow"),
+}
+
+# Columnas exportables por tabla, en orden: nombre -> tipo lógico (ver tipo_arrow)
+COLUMNAS: Dict[str, Dict[str, str]] = {
+    "sessions": {
+        "session_id": "texto",
+        "created_at": "instante",
+        "day": "texto",
+        "last_activity": "instante",
+        "device_info": "texto",
+        "user_agent": "texto",
+        "is_converted": "booleano",
+        "conversion_amount": "real",
+        "country": "texto",
+        "country_code": "texto",
+        "device_type": "texto",
+        "utm_source": "texto",
+        "utm_medium": "texto",
+        "utm_campaign": "texto",
+        "referrer": "texto",
+    },
+    "events": {
+        "event_id": "entero",
+        "session_id": "texto",
+        "event_type": "texto",
+        "event_data": "texto",
+        "created_at": "instante",
+        "day": "texto",
+    },
+}
+
+
+def importar_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.ipc
+        import pyarrow.parquet
+    except ImportError:
+        raise RuntimeError("El export columnar requiere pyarrow (pip install pyarrow)") from None
+    return pyarrow
+
+
+def parsear_columnas(tabla: str, columns: Optional[str]) -> Tuple[str, ...]:
+    """columns=a,b,... -> tupla en el orden pedido (sin repetidas); sin columns, todas."""
+    disponibles = COLUMNAS[tabla]
+    if columns is None:
+        return tuple(disponibles)
+    pedidas = tuple(dict.fromkeys(c.strip() for c in columns.split(",") if c.strip()))
+    desconocidas = [c for c in pedidas if c not in disponibles]
+    if desconocidas or not pedidas:
+        raise ValueError(f"columns inválido para {tabla}: se admiten {', '.join(disponibles)}")
+    return pedidas
+
+
+def tipo_arrow(pa, tipo: str):
+    return {
+        "texto": pa.string(),
+        "entero": pa.int64(),
+        "real": pa.float64(),
+        "booleano": pa.bool_(),
+        "instante": pa.timestamp("s", tz="UTC"),
+    }[tipo]
+
+
+def columna_arrow(pa, valores: Sequence, tipo):
+    if tipo == pa.bool_():
+        # SQLite devuelve los booleanos como 0/1
+        return pa.array(valores, type=pa.int64()).cast(tipo)
+    return pa.array(valores, type=tipo)
+
+
+def esquema_export(pa, tabla: str, columnas: Sequence[str]):
+    return pa.schema([(c, tipo_arrow(pa, COLUMNAS[tabla][c])) for c in columnas])
+
+
+def expresion_sql(tabla: str, columna: str) -> str:
+    tipo = COLUMNAS[tabla][columna]
+    if tipo == "instante":
+        # Filas heredadas que la migración 3 no pudo convertir salen como NULL
+        return f"CASE WHEN typeof({columna}) = 'integer' THEN {columna} END AS {columna}"
+    if tipo == "booleano":
+        return f"{columna} != 0 AS {columna}"
+    return columna
+
+
+def consultas_export(conn: sqlite3.Connection, tabla: str, desde: int, hasta: int,
+                     columnas: Sequence[str]) -> List[Tuple[str, tuple]]:
+    """SELECT por tabla física (sessions o cada partición de events) que cubren [desde, hasta)."""
+    select = ", ".join(expresion_sql(tabla, c) for c in columnas)
+    tablas = particiones_en_rango(conn, desde, hasta) if tabla == "events" else ["sessions"]
+    # Rango sobre created_at: usa idx_sessions_created / idx_events_YYYY_MM_created
+    return [
+        (
+            f"SELECT {select} FROM {fisica} "
+            # Columna calificada: sin tabla, ORDER BY usaría el alias (CASE ...) y ordenaría en un B-tree temporal
+            f"WHERE {fisica}.created_at >= ? AND {fisica}.created_at < ? ORDER BY {fisica}.created_at",
+            (desde, hasta),
+        )
+        for fisica in tablas
+    ]
+
+
+def rango_epoch(start_date: str, end_date: str) -> Tuple[int, int]:
+    """[00:00 UTC de start_date, 00:00 UTC del día siguiente a end_date)."""
+    fin = (date.fromisoformat(end_date) + timedelta(days=1)).isoformat()
+    return epoch_de_dia(start_date), epoch_de_dia(fin)
+
+
+def abrir_lectura(db_path: str) -> sqlite3.Connection:
+    # check_same_thread=False: StreamingResponse puede pedir cada lote desde un hilo distinto
+    conn = configurar_conexion(sqlite3.connect(db_path, check_same_thread=False))
+    conn.row_factory = None
+    conn.execute("PRAGMA query_only=ON")
+    return conn
+
+
+class _Sumidero(io.RawIOBase):
+    """Archivo de solo escritura que acumula lo escrito por pyarrow hasta vaciar()."""
+
+    def __init__(self):
+        super().__init__()
+        self._partes: List[bytes] = []
+        self._posicion = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, datos) -> int:
+        self._partes.append(bytes(datos))
+        self._posicion += len(datos)
+        return len(datos)
+
+    def tell(self) -> int:
+        return self._posicion
+
+    def vaciar(self) -> bytes:
+        datos, self._partes = b"".join(self._partes), []
+        return datos
+
+
+def generar_export(db_path: str, tabla: str, start_date: str, end_date: str, columnas: Sequence[str],
+                   formato: str = "parquet", filas_por_lote: int = EXPORT_CHUNK_ROWS) -> Iterator[bytes]:
+    """Bytes del archivo Parquet / Arrow IPC (stream), lote a lote."""
+    pa = importar_pyarrow()
+    esquema = esquema_export(pa, tabla, columnas)
+    desde, hasta = rango_epoch(start_date, end_date)
+    sumidero = _Sumidero()
+    if formato == "parquet":
+        escritor = pa.parquet.ParquetWriter(sumidero, esquema, compression="zstd")
+    else:
+        escritor = pa.ipc.new_stream(sumidero, esquema)
+
+    conn = abrir_lectura(db_path)
+    try:
+        # Una sola instantánea para todas las particiones del rango
+        conn.execute("BEGIN")
+        for sql, params in consultas_export(conn, tabla, desde, hasta, columnas):
+            cursor = conn.execute(sql, params)
+            while True:
+                filas = cursor.fetchmany(filas_por_lote)
+                if not filas:
+                    break
+                valores = list(zip(*filas))
+                lote = pa.record_batch(
+                    [columna_arrow(pa, valores[i], esquema.field(i).type) for i in range(len(columnas))],
+                    schema=esquema,
+                )
+                escritor.write_batch(lote)
+                yield sumidero.vaciar()
+        escritor.close()
+        yield sumidero.vaciar()
+    finally:
+        conn.close()
+
+
+def exportar(db_path: str, tabla: str, start_date: str, end_date: str, destino: str,
+             columnas: Optional[Sequence[str]] = None, formato: str = "parquet",
+             filas_por_lote: int = EXPORT_CHUNK_ROWS) -> int:
+    """Escribe el export en destino (vía archivo temporal); devuelve los bytes escritos."""
+    columnas = columnas or tuple(COLUMNAS[tabla])
+    temporal = f"{destino}.{os.getpid()}.tmp"
+    escritos = 0
+    try:
+        with open(temporal, "wb") as archivo:
+            for bloque in generar_export(db_path, tabla, start_date, end_date, columnas, formato, filas_por_lote):
+                archivo.write(bloque)
+                escritos += len(bloque)
+        os.replace(temporal, destino)
+    finally:
+        if os.path.exists(temporal):
+            os.remove(temporal)
+    return escritos
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Export columnar de sessions/events de analytics.db")
+    parser.add_argument("tabla", choices=sorted(COLUMNAS))
+    parser.add_argument("start_date", help="YYYY-MM-DD (UTC, inclusive)")
+    parser.add_argument("end_date", help="YYYY-MM-DD (UTC, inclusive)")
+    parser.add_argument("-o", "--output", required=True)
+    parser.add_argument("--format", choices=sorted(FORMATOS), default="parquet")
+    parser.add_argument("--columns", help="columnas separadas por coma (por defecto, todas)")
+    parser.add_argument("--db", default="analytics.db")
+    parser.add_argument("--chunk-rows", type=int, default=EXPORT_CHUNK_ROWS)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    try:
+        columnas = parsear_columnas(args.tabla, args.columns)
+        rango_epoch(args.start_date, args.end_date)
+        inicio = time.perf_counter()
+        escritos = exportar(
+            args.db, args.tabla, args.start_date, args.end_date, args.output, columnas, args.format, args.chunk_rows
+        )
+    except (ValueError, RuntimeError) as e:
+        parser.exit(2, f"❌ {e}\n")
+    logging.info(
+        f"📦 {args.tabla} {args.start_date}..{args.end_date} exportada a {args.output} "
+        f"({escritos / 1e6:.1f} MB en {time.perf_counter() - inicio:.1f}s)"
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
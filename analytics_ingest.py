@@ -0,0 +1,184 @@
+# analytics_ingest.py
+"""Ingesta write-behind de eventos de tracking.
+
+/api/analytics/event acepta el evento en memoria y responde de inmediato; un
+flusher en segundo plano lo persiste en lotes (executemany) cada
+`intervalo` segundos o al juntar `max_eventos`, lo que ocurra antes:
+
+- todos los INSERT de events del lote en una sola transacción (en la
+  partición mensual de cada evento, ver analytics_partitions.py),
+- un único UPDATE de sessions.last_activity por sesión (el más reciente),
+- una única marca de conversión por sesión (la última del lote).
+
+El intervalo es la ventana máxima de pérdida ante una caída abrupta del
+proceso; al apagar se hace un flush final. Con intervalo 0 cada evento se
+escribe de inmediato (write-through).
+
+Un /reset en otro worker no vacía este buffer: cada lote lleva la generación
+de reinicio vista en el flush anterior y, si cambió, se descartan los eventos
+de sesiones que ya no existen (las borradas por el reset).
+"""
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+from typing import List, Optional
+
+from analytics_db import AnalyticsDB, generacion_reinicio
+from analytics_partitions import Evento, insertar_eventos
+
+FLUSH_INTERVAL_MS = int(os.environ.get("ANALYTICS_FLUSH_INTERVAL_MS", "500"))
+FLUSH_MAX_EVENTS = int(os.environ.get("ANALYTICS_FLUSH_MAX_EVENTS", "200"))
+# Tope de eventos en memoria: al superarlo el request espera un flush (backpressure)
+MAX_PENDING_EVENTS = int(os.environ.get("ANALYTICS_MAX_PENDING_EVENTS", "10000"))
+
+
+def monto_conversion(event_data: Optional[str]) -> float:
+    """Extrae el monto de la multa del event_data de confirmation_page_viewed."""
+    amount = 0
+    if event_data:
+        try:
+            amount = float(json.loads(event_data).get("amount", 0))
+        except (ValueError, TypeError, AttributeError):
+            pass
+    return amount
+
+
+def persistir_eventos(conn: sqlite3.Connection, eventos: List[Evento]):
+    """Escribe un lote de eventos colapsando las actualizaciones por sesión."""
+    insertar_eventos(conn, eventos)
+
+    ultima_actividad = {}
+    conversiones = {}
+    for session_id, event_type, event_data, created_at in eventos:
+        if created_at > ultima_actividad.get(session_id, 0):
+            ultima_actividad[session_id] = created_at
+        if event_type == "confirmation_page_viewed":
+            conversiones[session_id] = monto_conversion(event_data)
+
+    conn.executemany(
+        "UPDATE sessions SET last_activity = ? WHERE session_id = ?",
+        [(created_at, session_id) for session_id, created_at in ultima_actividad.items()],
+    )
+    if conversiones:
+        conn.executemany(
+            "UPDATE sessions SET is_converted = 1, conversion_amount = ? WHERE session_id = ?",
+            [(amount, session_id) for session_id, amount in conversiones.items()],
+        )
+
+
+def persistir_vigentes(conn: sqlite3.Connection, eventos: List[Evento], generacion: Optional[int]) -> int:
+    """persistir_eventos sin lo anterior a un /reset posterior a `generacion`; devuelve la generación actual."""
+    # La generación se lee con el lock de escritura tomado: un reset no puede colarse antes del INSERT
+    if not conn.in_transaction:
+        conn.execute("BEGIN IMMEDIATE")
+    actual = generacion_reinicio(conn)
+    if generacion is not None and actual != generacion:
+        sesiones = list({evento[0] for evento in eventos})
+        vigentes = {
+            r[0]
+            for r in conn.execute(
+                f"SELECT session_id FROM sessions WHERE session_id IN ({','.join('?' * len(sesiones))})", sesiones
+            )
+        }
+        descartados = len(eventos)
+        eventos = [evento for evento in eventos if evento[0] in vigentes]
+        descartados -= len(eventos)
+        if descartados:
+            logging.warning(f"🧹 [Ingesta] {descartados} eventos anteriores a un /reset descartados")
+    if eventos:
+        persistir_eventos(conn, eventos)
+    return actual
+
+
+class EventBuffer:
+    """Buffer en memoria de eventos con flush periódico o por tamaño."""
+
+    def __init__(
+        self,
+        db: AnalyticsDB,
+        intervalo: float = FLUSH_INTERVAL_MS / 1000,
+        max_eventos: int = FLUSH_MAX_EVENTS,
+        max_pendientes: int = MAX_PENDING_EVENTS,
+    ):
+        self.db = db
+        self.intervalo = intervalo
+        self.max_eventos = max_eventos
+        self.max_pendientes = max_pendientes
+        self._eventos: List[Evento] = []
+        # Generación de reinicio vista en la última escritura (None hasta la primera)
+        self._generacion: Optional[int] = None
+        self._despertar: Optional[asyncio.Event] = None
+        self._flush_lock: Optional[asyncio.Lock] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def activo(self) -> bool:
+        return self._task is not None
+
+    def start(self):
+        if self.intervalo <= 0:
+            logging.info("📝 [Ingesta] Modo write-through (ANALYTICS_FLUSH_INTERVAL_MS=0)")
+            return
+        self._despertar = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._task = asyncio.create_task(self._run(), name="analytics-event-flusher")
+        logging.info(
+            f"📝 [Ingesta] Write-behind activo: flush cada {self.intervalo * 1000:.0f}ms "
+            f"o {self.max_eventos} eventos"
+        )
+
+    async def stop(self):
+        """Detiene el flusher y persiste lo pendiente."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+            await self.flush()
+
+    async def submit(self, evento: Evento):
+        """Acepta un evento; sin flusher activo lo escribe de inmediato."""
+        if not self.activo:
+            self._generacion = await self.db.write(persistir_vigentes, [evento], self._generacion)
+            return
+        self._eventos.append(evento)
+        if len(self._eventos) >= self.max_eventos:
+            self._despertar.set()
+        if len(self._eventos) >= self.max_pendientes:
+            await self.flush()
+
+    async def flush(self) -> int:
+        if self._flush_lock is None:
+            return 0
+        async with self._flush_lock:
+            lote, self._eventos = self._eventos, []
+            if not lote:
+                return 0
+            try:
+                self._generacion = await self.db.write(persistir_vigentes, lote, self._generacion)
+            except Exception as e:
+                # Reencolar para el próximo flush, respetando el tope de memoria
+                self._eventos[:0] = lote
+                descartados = len(self._eventos) - self.max_pendientes
+                if descartados > 0:
+                    del self._eventos[:descartados]
+                    logging.error(f"❌ [Ingesta] {descartados} eventos descartados por exceso de pendientes")
+                logging.error(f"❌ [Ingesta] Error al persistir {len(lote)} eventos: {e}")
+                return 0
+            return len(lote)
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            # Despierta al vencer el intervalo o antes si submit() llena el lote
+            temporizador = loop.call_later(self.intervalo, self._despertar.set)
+            try:
+                await self._despertar.wait()
+            finally:
+                temporizador.cancel()
+            self._despertar.clear()
+            await self.flush()
@@ -0,0 +1,222 @@
+# analytics_logs.py
+"""Logs del sistema (WARNING+) y salud del backend para el dashboard.
+
+LogRing es un logging.Handler que se instala en el logger raíz durante el
+lifespan: emit() solo agrega el registro a un anillo en memoria de
+ANALYTICS_LOGS_RING_SIZE entradas (ante una ráfaga se descartan las más
+antiguas) y nunca toca SQLite. Una tarea en segundo plano vuelca el anillo a
+system_logs por lotes cada ANALYTICS_LOGS_FLUSH_MS, en la misma transacción
+que suma los ERROR/CRITICAL a contadores_salud y recorta la tabla a las
+últimas ANALYTICS_LOGS_MAX_ROWS filas.
+
+/logs pagina por keyset (id < before_id) sobre los índices (level, id) y
+(module, id); /health lee contadores_salud (migración 5 de init_db), que
+registrar_sesion también incrementa, en lugar de COUNT(*) sobre las tablas.
+"""
+import asyncio
+import heapq
+import logging
+import os
+import sqlite3
+import time
+from collections import deque
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from analytics_db import AnalyticsDB
+
+try:
+    from mi_backend_python.init_db import CUBETA_ERRORES_S, NIVELES_ERROR
+except ImportError:
+    # Misma estructura alternativa que contempla main.py (init_db junto a main.py)
+    from init_db import CUBETA_ERRORES_S, NIVELES_ERROR
+
+LOGS_RING_SIZE = int(os.environ.get("ANALYTICS_LOGS_RING_SIZE", "1000"))
+LOGS_FLUSH_MS = int(os.environ.get("ANALYTICS_LOGS_FLUSH_MS", "1000"))
+LOGS_MAX_ROWS = int(os.environ.get("ANALYTICS_LOGS_MAX_ROWS", "100000"))
+# Errores en las últimas 24 h a partir de los cuales /health pasa a warning / critical
+HEALTH_WARNING_ERRORS = int(os.environ.get("ANALYTICS_HEALTH_WARNING_ERRORS", "1"))
+HEALTH_CRITICAL_ERRORS = int(os.environ.get("ANALYTICS_HEALTH_CRITICAL_ERRORS", "10"))
+
+VENTANA_ERRORES_S = 24 * 3600
+NIVELES = ("DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL")
+MAX_ID = 2 ** 63 - 1
+
+
+class RegistroLog(NamedTuple):
+    creado: float
+    level: str
+    message: str
+    module: Optional[str]
+    traceback: Optional[str]
+
+
+def timestamp_log(creado: float) -> str:
+    # Mismo formato que CURRENT_TIMESTAMP (UTC); el dashboard le agrega " UTC"
+    return time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(creado))
+
+
+# --- CONTADORES DE SALUD ---
+
+def sumar_contador(conn: sqlite3.Connection, clave: str, cubeta: int, n: int = 1):
+    conn.execute(
+        "INSERT INTO contadores_salud (clave, cubeta, n) VALUES (?, ?, ?) "
+        "ON CONFLICT (clave, cubeta) DO UPDATE SET n = n + excluded.n",
+        (clave, cubeta, n),
+    )
+
+
+def leer_salud(conn: sqlite3.Connection, ahora: int) -> Tuple[int, int]:
+    """(errores de las últimas 24 h, sesiones del día UTC actual)."""
+    errores = conn.execute(
+        "SELECT COALESCE(SUM(n), 0) FROM contadores_salud WHERE clave = 'errores' AND cubeta > ?",
+        ((ahora - VENTANA_ERRORES_S) // CUBETA_ERRORES_S,),
+    ).fetchone()[0]
+    sesiones = conn.execute(
+        "SELECT COALESCE(SUM(n), 0) FROM contadores_salud WHERE clave = 'sesiones' AND cubeta = ?",
+        (ahora // 86400,),
+    ).fetchone()[0]
+    return errores, sesiones
+
+
+def estado_salud(errores_24h: int) -> str:
+    if errores_24h >= HEALTH_CRITICAL_ERRORS:
+        return "critical"
+    if errores_24h >= HEALTH_WARNING_ERRORS:
+        return "warning"
+    return "healthy"
+
+
+def guardar_logs(conn: sqlite3.Connection, lote: List[RegistroLog], max_filas: int):
+    conn.executemany(
+        "INSERT INTO system_logs (timestamp, level, message, module, traceback) VALUES (?, ?, ?, ?, ?)",
+        [(timestamp_log(r.creado), r.level, r.message, r.module, r.traceback) for r in lote],
+    )
+    errores: Dict[int, int] = {}
+    for r in lote:
+        if r.level in NIVELES_ERROR:
+            cubeta = int(r.creado) // CUBETA_ERRORES_S
+            errores[cubeta] = errores.get(cubeta, 0) + 1
+    for cubeta, n in errores.items():
+        sumar_contador(conn, "errores", cubeta, n)
+
+    # Cubetas que ya no puede pedir /health
+    ahora = int(time.time())
+    conn.execute(
+        "DELETE FROM contadores_salud WHERE (clave = 'errores' AND cubeta <= ?) OR (clave = 'sesiones' AND cubeta < ?)",
+        ((ahora - VENTANA_ERRORES_S) // CUBETA_ERRORES_S, ahora // 86400 - 1),
+    )
+    if max_filas > 0:
+        conn.execute("DELETE FROM system_logs WHERE id <= (SELECT MAX(id) FROM system_logs) - ?", (max_filas,))
+
+
+# --- CONSULTA DE LOGS ---
+
+def niveles_desde(level: str) -> Tuple[str, ...]:
+    """level=ERROR -> ('ERROR', 'CRITICAL'): el filtro es de severidad mínima."""
+    return NIVELES[NIVELES.index(level):]
+
+
+def consultar_logs(conn: sqlite3.Connection, limit: int, level: Optional[str] = None,
+                   module: Optional[str] = None, before_id: Optional[int] = None) -> List[dict]:
+    """Logs más recientes primero, con paginación por keyset (id < before_id)."""
+    # Primera página: cursor por encima de cualquier id (búsqueda por rango, no recorrido)
+    condiciones, params = ["id < ?"], [before_id if before_id is not None else MAX_ID]
+    if module is not None:
+        condiciones.append("module = ?")
+        params.append(module)
+
+    # Una consulta por nivel (cada una recorre (level, id) en orden y se corta en
+    # LIMIT) y mezcla por id: con level IN (...) SQLite ordenaría todas las filas
+    por_nivel = niveles_desde(level) if level is not None else (None,)
+    consultas = []
+    for nivel in por_nivel:
+        filtros = condiciones + (["level = ?"] if nivel is not None else [])
+        consultas.append(conn.execute(f"""
+            SELECT id, timestamp, level, message, module, traceback FROM system_logs
+            WHERE {' AND '.join(filtros)}
+            ORDER BY id DESC LIMIT ?
+        """, params + ([nivel] if nivel is not None else []) + [limit]).fetchall())
+    filas = heapq.merge(*consultas, key=lambda r: r[0], reverse=True)
+    return [
+        {"id": r[0], "timestamp": r[1], "level": r[2], "message": r[3], "module": r[4], "traceback": r[5]}
+        for _, r in zip(range(limit), filas)
+    ]
+
+
+class LogRing(logging.Handler):
+    """Anillo acotado de registros WARNING+ con volcado periódico a system_logs."""
+
+    def __init__(
+        self,
+        db: AnalyticsDB,
+        capacidad: int = LOGS_RING_SIZE,
+        intervalo: float = LOGS_FLUSH_MS / 1000,
+        max_filas: int = LOGS_MAX_ROWS,
+        nivel: int = logging.WARNING,
+    ):
+        super().__init__(nivel)
+        self.db = db
+        self.intervalo = intervalo
+        self.max_filas = max_filas
+        self._anillo: deque = deque(maxlen=capacidad)
+        self._formato = logging.Formatter()
+        self.descartados = 0
+        self._task: Optional[asyncio.Task] = None
+
+    def emit(self, record: logging.LogRecord):
+        # Puede llamarse desde cualquier hilo: append en un deque es atómico
+        try:
+            traceback = self._formato.formatException(record.exc_info) if record.exc_info else None
+            if len(self._anillo) == self._anillo.maxlen:
+                self.descartados += 1
+            self._anillo.append(RegistroLog(
+                record.created,
+                record.levelname,
+                record.getMessage(),
+                record.module if record.name == "root" else record.name,
+                traceback,
+            ))
+        except Exception:
+            self.handleError(record)
+
+    async def volcar(self) -> int:
+        lote = []
+        while self._anillo:
+            lote.append(self._anillo.popleft())
+        if not lote:
+            return 0
+        try:
+            await self.db.write(guardar_logs, lote, self.max_filas)
+        except Exception as e:
+            # Devolver al frente del anillo; si no cabe todo, se pierden los más antiguos
+            recientes = []
+            while self._anillo:
+                recientes.append(self._anillo.popleft())
+            self._anillo.extend(lote)
+            self._anillo.extend(recientes)
+            logging.error(f"❌ [Logs] Error al volcar {len(lote)} registros: {e}")
+            return 0
+        if self.descartados:
+            descartados, self.descartados = self.descartados, 0
+            logging.warning(f"⚠️ [Logs] {descartados} registros descartados por anillo lleno")
+        return len(lote)
+
+    def start(self):
+        logging.getLogger().addHandler(self)
+        self._task = asyncio.create_task(self._run(), name="analytics-log-ring")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        logging.getLogger().removeHandler(self)
+        await self.volcar()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.intervalo)
+            await self.volcar()
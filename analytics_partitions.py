@@ -0,0 +1,245 @@
+# analytics_partitions.py
+"""Almacenamiento de events particionado por mes, con retención y archivo.
+
+Los eventos viven en tablas events_YYYY_MM (mes UTC de created_at) dentro de
+analytics.db (migración 4 de init_db). Al estar en el mismo archivo, el lote
+de eventos y los UPDATE de sessions siguen confirmándose en una sola
+transacción, y no hay límite de ATTACH por conexión.
+
+- Escritura: insertar_eventos() enruta cada evento a la partición de su mes y
+  la crea si falta (rollover automático). El event_id es global y creciente
+  entre particiones; de él dependen la marca de agua de los rollups y la
+  versión de la caché de respuestas.
+- Lectura: particiones_en_rango() devuelve solo las tablas que solapan el
+  rango pedido.
+- Retención: PartitionMaintainer conserva ANALYTICS_EVENTS_HOT_MONTHS meses
+  (incluido el actual). Las particiones más antiguas, una vez cubiertas por
+  los rollups diarios, se exportan a ANALYTICS_EVENTS_ARCHIVE_DIR como base
+  SQLite comprimida con gzip (tabla `events`) y se eliminan. Las páginas
+  liberadas quedan en la freelist y las reutilizan los meses nuevos, así que
+  el archivo deja de crecer sin límite.
+"""
+import asyncio
+import gzip
+import logging
+import os
+import shutil
+import sqlite3
+import time
+from typing import List, Optional, Tuple
+
+from analytics_db import AnalyticsDB
+
+try:
+    from mi_backend_python.init_db import GLOB_PARTICIONES, crear_particion_eventos, limites_mes, mes_de, tabla_particion
+except ImportError:
+    # Misma estructura alternativa que contempla main.py (init_db junto a main.py)
+    from init_db import GLOB_PARTICIONES, crear_particion_eventos, limites_mes, mes_de, tabla_particion
+
+EVENTS_HOT_MONTHS = int(os.environ.get("ANALYTICS_EVENTS_HOT_MONTHS", "3"))
+EVENTS_ARCHIVE = os.environ.get("ANALYTICS_EVENTS_ARCHIVE", "true").lower() in ("1", "true", "yes")
+EVENTS_ARCHIVE_DIR = os.environ.get("ANALYTICS_EVENTS_ARCHIVE_DIR", "")
+PARTITION_INTERVAL_S = float(os.environ.get("ANALYTICS_PARTITION_INTERVAL_S", "3600"))
+
+# (session_id, event_type, event_data, created_at)
+Evento = Tuple[str, str, Optional[str], int]
+
+# Agregado vacío con las columnas de un SELECT de eventos, para rangos sin particiones
+SQL_SIN_EVENTOS = "SELECT NULL AS day, NULL AS event_type, 0 AS events, 0 AS sessions WHERE 0"
+
+
+def mes_desplazado(mes: str, n: int) -> str:
+    """YYYY_MM desplazado n meses."""
+    total = int(mes[:4]) * 12 + int(mes[5:]) - 1 + n
+    return f"{total // 12:04d}_{total % 12 + 1:02d}"
+
+
+def particiones(conn: sqlite3.Connection) -> List[str]:
+    """Meses (YYYY_MM) con partición, en orden."""
+    return [
+        r[0][len("events_"):]
+        for r in conn.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND name GLOB ? ORDER BY name", (GLOB_PARTICIONES,)
+        )
+    ]
+
+
+def particiones_en_rango(conn: sqlite3.Connection, desde: int, hasta: int) -> List[str]:
+    """Tablas de las particiones que solapan [desde, hasta) (epoch)."""
+    if hasta <= desde:
+        return []
+    primero, ultimo = mes_de(desde), mes_de(hasta - 1)
+    return [tabla_particion(mes) for mes in particiones(conn) if primero <= mes <= ultimo]
+
+
+def particiones_desde_evento(conn: sqlite3.Connection, event_id: int) -> List[str]:
+    """Tablas que pueden tener eventos con id mayor que event_id."""
+    return [
+        r[0]
+        for r in conn.execute(
+            "SELECT name FROM sqlite_sequence WHERE name GLOB ? AND seq > ? ORDER BY name", (GLOB_PARTICIONES, event_id)
+        )
+    ]
+
+
+def ultimo_evento(conn: sqlite3.Connection) -> int:
+    """Mayor event_id asignado (sqlite_sequence guarda el máximo de cada partición)."""
+    return conn.execute(
+        "SELECT COALESCE(MAX(seq), 0) FROM sqlite_sequence WHERE name GLOB ?", (GLOB_PARTICIONES,)
+    ).fetchone()[0]
+
+
+def insertar_eventos(conn: sqlite3.Connection, eventos: List[Evento]):
+    """INSERT de un lote de eventos en sus particiones, con event_id global consecutivo.
+
+    Los id se asignan explícitamente: un evento del mes anterior que llega
+    tarde (p. ej. desde el buffer de otro worker) no puede repetir un id de
+    la partición nueva.
+
+    Varios workers escriben en la misma base: el id siguiente se lee con el
+    lock de escritura ya tomado (BEGIN IMMEDIATE), si no dos lotes
+    simultáneos reciben los mismos id. Si el llamador ya abrió la transacción
+    con un INSERT/UPDATE, ese lock ya es suyo.
+    """
+    if not conn.in_transaction:
+        conn.execute("BEGIN IMMEDIATE")
+    siguiente = ultimo_evento(conn) + 1
+    por_mes = {}
+    for i, evento in enumerate(eventos):
+        por_mes.setdefault(mes_de(evento[3]), []).append((siguiente + i,) + tuple(evento))
+    for mes, filas in por_mes.items():
+        tabla = crear_particion_eventos(conn, mes)
+        conn.executemany(
+            f"INSERT INTO {tabla} (event_id, session_id, event_type, event_data, created_at) VALUES (?, ?, ?, ?, ?)",
+            filas,
+        )
+
+
+def borrar_particiones(conn: sqlite3.Connection):
+    for mes in particiones(conn):
+        conn.execute(f"DROP TABLE {tabla_particion(mes)}")
+
+
+def meses_frios(conn: sqlite3.Connection, meses_calientes: int, ahora: Optional[int] = None) -> List[str]:
+    """Particiones fuera de la ventana caliente que los rollups ya cubren por completo."""
+    actual = mes_de(ahora if ahora is not None else int(time.time()))
+    inicio_caliente = mes_desplazado(actual, -(meses_calientes - 1))
+
+    estado = dict(conn.execute("SELECT clave, valor FROM rollup_estado").fetchall())
+    marca, corte = estado.get("ultimo_evento", 0), estado.get("corte")
+    frios = []
+    for mes in particiones(conn):
+        if mes >= inicio_caliente:
+            break
+        _, fin = limites_mes(mes)
+        maximo = conn.execute(f"SELECT COALESCE(MAX(event_id), 0) FROM {tabla_particion(mes)}").fetchone()[0]
+        # Sin corte posterior al mes o con eventos sin compactar, borrarla perdería datos del dashboard
+        if corte is None or time.strftime("%Y-%m-%d", time.gmtime(fin)) > corte or maximo > marca:
+            logging.warning(f"⚠️ [Particiones] events_{mes} fuera de la ventana pero sin compactar; se conserva")
+            continue
+        frios.append(mes)
+    return frios
+
+
+def exportar_particion(db_path: str, mes: str, directorio: str) -> Tuple[str, int]:
+    """Copia la partición a <directorio>/events_YYYY_MM.db.gz; devuelve (ruta, filas).
+
+    Corre fuera de los hilos de analytics_db con su propia conexión: solo lee
+    de analytics.db, así que no bloquea al escritor de tracking.
+    """
+    os.makedirs(directorio, exist_ok=True)
+    tabla = tabla_particion(mes)
+    destino = os.path.join(directorio, f"{tabla}.db.gz")
+    # Nombre propio del proceso: varios workers pueden archivar el mismo mes a la vez
+    temporal = os.path.join(directorio, f".{tabla}.{os.getpid()}.db")
+    try:
+        conn = sqlite3.connect(db_path)
+        try:
+            conn.execute("ATTACH DATABASE ? AS archivo", (temporal,))
+            conn.execute(f"""
+                CREATE TABLE archivo.events AS
+                SELECT event_id, session_id, event_type, event_data, created_at FROM {tabla} ORDER BY event_id
+            """)
+            filas = conn.execute("SELECT COUNT(*) FROM archivo.events").fetchone()[0]
+            conn.execute("DETACH DATABASE archivo")
+        finally:
+            conn.close()
+        with open(temporal, "rb") as origen, gzip.open(temporal + ".gz", "wb") as comprimido:
+            shutil.copyfileobj(origen, comprimido)
+        # Reemplazo atómico: el .gz final nunca queda a medio escribir
+        os.replace(temporal + ".gz", destino)
+    finally:
+        for resto in (temporal, temporal + ".gz"):
+            if os.path.exists(resto):
+                os.remove(resto)
+    return destino, filas
+
+
+def eliminar_particion(conn: sqlite3.Connection, mes: str):
+    conn.execute(f"DROP TABLE IF EXISTS {tabla_particion(mes)}")
+
+
+def crear_particiones(conn: sqlite3.Connection, meses: List[str]):
+    for mes in meses:
+        crear_particion_eventos(conn, mes)
+
+
+class PartitionMaintainer:
+    """Rollover anticipado, retención y archivo periódicos de las particiones de events."""
+
+    def __init__(
+        self,
+        db: AnalyticsDB,
+        meses_calientes: int = EVENTS_HOT_MONTHS,
+        archivar: bool = EVENTS_ARCHIVE,
+        directorio: str = EVENTS_ARCHIVE_DIR,
+        intervalo: float = PARTITION_INTERVAL_S,
+    ):
+        self.db = db
+        self.meses_calientes = meses_calientes
+        self.archivar = archivar
+        self.directorio = directorio or os.path.join(os.path.dirname(os.path.abspath(db.db_path)), "events_archive")
+        self.intervalo = intervalo
+        self._task: Optional[asyncio.Task] = None
+
+    async def mantener(self) -> int:
+        # Rollover: la partición del mes actual y la del siguiente existen antes de necesitarse
+        ahora = int(time.time())
+        await self.db.write(crear_particiones, [mes_de(ahora), mes_desplazado(mes_de(ahora), 1)])
+        if self.meses_calientes <= 0:
+            return 0
+
+        archivadas = 0
+        for mes in await self.db.read(meses_frios, self.meses_calientes, ahora):
+            try:
+                if self.archivar:
+                    destino, filas = await asyncio.to_thread(exportar_particion, self.db.db_path, mes, self.directorio)
+                    logging.info(f"🗜️ [Particiones] events_{mes} archivada en {destino} ({filas} eventos)")
+                await self.db.write(eliminar_particion, mes)
+                archivadas += 1
+            except sqlite3.OperationalError as e:
+                # Otro worker la archivó y eliminó entretanto
+                logging.warning(f"⚠️ [Particiones] events_{mes} no se pudo archivar: {e}")
+        return archivadas
+
+    def start(self):
+        if self.intervalo <= 0:
+            return
+        self._task = asyncio.create_task(self._run(), name="analytics-partition-maintainer")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                await self.mantener()
+            except Exception as e:
+                logging.error(f"❌ [Particiones] Error en el mantenimiento: {e}")
+            await asyncio.sleep(self.intervalo)
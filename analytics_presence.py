@@ -0,0 +1,121 @@
+# analytics_presence.py
+"""Presencia para los "usuarios activos" del dashboard.
+
+Cada pestaña abierta envía un heartbeat periódico; en lugar de convertir cada
+uno en un UPDATE + commit, PresenceMap guarda en memoria session_id -> última
+actividad y vuelca a sessions.last_activity solo las sesiones modificadas cada
+ANALYTICS_PRESENCE_CHECKPOINT_S segundos (y al apagar).
+
+Los activos se leen de presencia_cubetas (migración 7 de init_db): un anillo
+de cubetas de ANCHO_CUBETA_PRESENCIA_S segundos con contadores por país que
+mantienen triggers sobre sessions. Es el mismo para todos los workers y cada
+sesión cuenta una sola vez, en la cubeta de su última actividad. Leer el total
+y el desglose por país suma las cubetas de la ventana (a lo sumo
+VENTANA / ANCHO filas por país), sin recorrer sessions. La resolución es de
+una cubeta; un heartbeat se refleja en el siguiente checkpoint.
+
+Tras un /reset en otro worker los heartbeats pendientes de este no reviven
+nada: el UPDATE del checkpoint solo alcanza a sesiones que siguen existiendo.
+"""
+import asyncio
+import logging
+import os
+import sqlite3
+from datetime import timedelta
+from typing import Dict, List, NamedTuple, Optional
+
+from analytics_db import AnalyticsDB, epoch_ahora
+
+try:
+    from mi_backend_python.init_db import ANCHO_CUBETA_PRESENCIA_S
+except ImportError:
+    # Misma estructura alternativa que contempla main.py (init_db junto a main.py)
+    from init_db import ANCHO_CUBETA_PRESENCIA_S
+
+# Ventana de "usuario activo" del dashboard
+VENTANA_ACTIVOS = timedelta(minutes=5)
+CHECKPOINT_S = float(os.environ.get("ANALYTICS_PRESENCE_CHECKPOINT_S", "30"))
+
+
+class ConteoActivos(NamedTuple):
+    total: int
+    por_pais: Dict[str, int]
+
+
+def primera_cubeta_vigente() -> int:
+    """Cubeta más antigua que cae dentro de la ventana de activos."""
+    return (epoch_ahora() - int(VENTANA_ACTIVOS.total_seconds())) // ANCHO_CUBETA_PRESENCIA_S + 1
+
+
+def contar_activos(conn: sqlite3.Connection) -> ConteoActivos:
+    """Activos en la ventana (total y por país) sumando las cubetas vigentes."""
+    total = 0
+    por_pais = {}
+    for country_code, n in conn.execute(
+        "SELECT country_code, SUM(n) FROM presencia_cubetas WHERE epoca >= ? GROUP BY country_code",
+        (primera_cubeta_vigente(),),
+    ):
+        total += n
+        if country_code and n:
+            por_pais[country_code] = n
+    return ConteoActivos(total, por_pais)
+
+
+def guardar_presencia(conn: sqlite3.Connection, vistos: List[tuple]):
+    # La condición evita retroceder un last_activity más reciente (p. ej. de un evento)
+    conn.executemany(
+        "UPDATE sessions SET last_activity = ? WHERE session_id = ? AND last_activity < ?",
+        vistos,
+    )
+    # Cubetas que ya salieron de la ventana (y las que quedaron en cero)
+    conn.execute(
+        "DELETE FROM presencia_cubetas WHERE epoca < ? OR n = 0", (primera_cubeta_vigente(),)
+    )
+
+
+class PresenceMap:
+    """session_id -> última actividad (epoch) pendiente de volcar, con checkpoint periódico a SQLite."""
+
+    def __init__(self, db: AnalyticsDB, intervalo_checkpoint: float = CHECKPOINT_S):
+        self.db = db
+        self.intervalo_checkpoint = intervalo_checkpoint
+        self._pendientes: Dict[str, int] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def touch(self, session_id: str, ahora: int):
+        if ahora > self._pendientes.get(session_id, 0):
+            self._pendientes[session_id] = ahora
+
+    def clear(self):
+        self._pendientes.clear()
+
+    async def checkpoint(self) -> int:
+        pendientes, self._pendientes = self._pendientes, {}
+        lote = [(visto, session_id, visto) for session_id, visto in pendientes.items()]
+        try:
+            # También sin heartbeats: poda las cubetas vencidas
+            await self.db.write(guardar_presencia, lote)
+        except Exception as e:
+            for session_id, visto in pendientes.items():
+                self.touch(session_id, visto)
+            logging.error(f"❌ [Presencia] Error en checkpoint de {len(lote)} sesiones: {e}")
+            return 0
+        return len(lote)
+
+    def start(self):
+        self._task = asyncio.create_task(self._run(), name="analytics-presence-checkpoint")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.checkpoint()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.intervalo_checkpoint)
+            await self.checkpoint()
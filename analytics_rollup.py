@@ -0,0 +1,255 @@
+# analytics_rollup.py
+"""Rollups diarios para las consultas del dashboard.
+
+Dos tablas pre-agregadas por día (creadas por la migración 2 de init_db):
+
+- rollup_sesiones_diarias: sesiones, conversiones y monto por
+  día × country_code × device_type × utm_source (día = created_at de la sesión).
+- rollup_eventos_diarios: eventos y sesiones distintas por día × event_type.
+- rollup_funnel_sesiones (migración 8): un registro por día × paso del
+  funnel × sesión que lo alcanzó.
+
+Un compactor periódico recalcula solo los días "sucios": los de los eventos
+con event_id mayor que la marca de agua guardada en rollup_estado, más el día
+de creación de sus sesiones (toda alta o conversión de una sesión llega con un
+evento en la misma transacción). Los días anteriores al último corte se leen
+de los rollups; desde el corte (hoy) en adelante, de las tablas crudas.
+
+Los días son UTC (columna generada `day`); las tablas crudas se filtran por
+rangos enteros de created_at (epoch), que resuelven los índices, y de events
+solo se leen las particiones mensuales que solapan el rango. Un día cuya
+partición ya se archivó conserva su rollup de eventos.
+
+Las sesiones distintas de un rango no se pueden sumar día a día (una sesión
+que repite un paso en dos días contaría dos veces), así que el funnel cuenta
+COUNT(DISTINCT session_id) sobre rollup_funnel_sesiones más los eventos crudos
+de hoy. Los días cuyas particiones ya estaban archivadas al aplicar la
+migración 8 no tienen esas filas.
+"""
+import asyncio
+import logging
+import os
+import sqlite3
+from datetime import date, timedelta
+from typing import List, Optional, Tuple
+
+from analytics_db import AnalyticsDB, epoch_de_dia, hoy_utc
+from analytics_partitions import (
+    SQL_SIN_EVENTOS, particiones, particiones_desde_evento, particiones_en_rango, tabla_particion, ultimo_evento,
+)
+
+try:
+    from mi_backend_python.init_db import PASOS_FUNNEL
+except ImportError:
+    # Misma estructura alternativa que contempla main.py (init_db junto a main.py)
+    from init_db import PASOS_FUNNEL
+
+ROLLUP_INTERVAL_S = float(os.environ.get("ANALYTICS_ROLLUP_INTERVAL_S", "60"))
+# Días recalculados por transacción (acota el bloqueo del escritor en el backfill inicial)
+DIAS_POR_TRANSACCION = 31
+
+# Agregados crudos con las mismas columnas que los rollups
+_SQL_SESIONES_CRUDAS = """
+    SELECT day, country_code, MAX(country) AS country, device_type, utm_source,
+           COUNT(*) AS sessions,
+           SUM(CASE WHEN is_converted = 1 THEN 1 ELSE 0 END) AS conversions,
+           SUM(CASE WHEN is_converted = 1 THEN conversion_amount ELSE 0 END) AS conversion_amount
+    FROM sessions
+    WHERE created_at >= ? AND created_at < ?
+    GROUP BY day, country_code, device_type, utm_source
+"""
+
+# Por partición: un día nunca cruza de un mes a otro, así que las sesiones distintas no se duplican
+_SQL_EVENTOS_CRUDOS = """
+    SELECT day, event_type,
+           COUNT(*) AS events, COUNT(DISTINCT session_id) AS sessions
+    FROM {tabla}
+    WHERE created_at >= ? AND created_at < ?
+    GROUP BY day, event_type
+"""
+
+# Sesiones que alcanzaron cada paso del funnel, con las mismas columnas que rollup_funnel_sesiones
+_SQL_FUNNEL_CRUDO = f"""
+    SELECT DISTINCT day, event_type, session_id
+    FROM {{tabla}}
+    WHERE created_at >= ? AND created_at < ? AND event_type IN ({",".join("?" * len(PASOS_FUNNEL))})
+"""
+_SQL_SIN_FUNNEL = "SELECT NULL AS day, NULL AS event_type, NULL AS session_id WHERE 0"
+
+
+def dia_siguiente(dia: str) -> str:
+    return (date.fromisoformat(dia) + timedelta(days=1)).isoformat()
+
+
+def eventos_crudos(conn: sqlite3.Connection, desde: int, hasta: int) -> Tuple[str, tuple]:
+    """_SQL_EVENTOS_CRUDOS sobre las particiones que solapan [desde, hasta)."""
+    tablas = particiones_en_rango(conn, desde, hasta)
+    if not tablas:
+        return SQL_SIN_EVENTOS, ()
+    return " UNION ALL ".join(_SQL_EVENTOS_CRUDOS.format(tabla=t) for t in tablas), (desde, hasta) * len(tablas)
+
+
+def funnel_crudo(conn: sqlite3.Connection, desde: int, hasta: int) -> Tuple[str, tuple]:
+    """_SQL_FUNNEL_CRUDO sobre las particiones que solapan [desde, hasta)."""
+    tablas = particiones_en_rango(conn, desde, hasta)
+    if not tablas:
+        return _SQL_SIN_FUNNEL, ()
+    params = ((desde, hasta) + PASOS_FUNNEL) * len(tablas)
+    return " UNION ALL ".join(_SQL_FUNNEL_CRUDO.format(tabla=t) for t in tablas), params
+
+
+def leer_estado(conn: sqlite3.Connection, clave: str, defecto=None):
+    fila = conn.execute("SELECT valor FROM rollup_estado WHERE clave = ?", (clave,)).fetchone()
+    return fila[0] if fila else defecto
+
+
+def _guardar_estado(conn: sqlite3.Connection, clave: str, valor):
+    conn.execute(
+        "INSERT INTO rollup_estado (clave, valor) VALUES (?, ?) "
+        "ON CONFLICT(clave) DO UPDATE SET valor = excluded.valor",
+        (clave, valor),
+    )
+
+
+def dias_sucios(conn: sqlite3.Connection) -> Tuple[List[str], int]:
+    """Días a recalcular y el event_id hasta el que quedan cubiertos."""
+    marca = leer_estado(conn, "ultimo_evento", 0)
+    hasta = ultimo_evento(conn)
+    if marca == 0:
+        # Primera compactación: backfill de todo el histórico (incluye sesiones sin eventos)
+        tablas = [tabla_particion(mes) for mes in particiones(conn)]
+        filas = conn.execute(" UNION ".join(["SELECT day FROM sessions"] + [f"SELECT day FROM {t}" for t in tablas]))
+    else:
+        dias = set()
+        for tabla in particiones_desde_evento(conn, marca):
+            dias.update(r[0] for r in conn.execute(f"""
+                SELECT e.day FROM {tabla} e WHERE e.event_id > ? AND e.event_id <= ?
+                UNION
+                SELECT s.day FROM {tabla} e JOIN sessions s ON s.session_id = e.session_id
+                WHERE e.event_id > ? AND e.event_id <= ?
+            """, (marca, hasta, marca, hasta)))
+        filas = [(dia,) for dia in dias]
+    return sorted(r[0] for r in filas if r[0]), hasta
+
+
+def recalcular_dias(conn: sqlite3.Connection, dias: List[str]):
+    for dia in dias:
+        rango = (epoch_de_dia(dia), epoch_de_dia(dia_siguiente(dia)))
+        conn.execute("DELETE FROM rollup_sesiones_diarias WHERE day = ?", (dia,))
+        conn.execute(f"INSERT INTO rollup_sesiones_diarias {_SQL_SESIONES_CRUDAS}", rango)
+        if particiones_en_rango(conn, *rango):
+            sql, params = eventos_crudos(conn, *rango)
+            conn.execute("DELETE FROM rollup_eventos_diarios WHERE day = ?", (dia,))
+            conn.execute(f"INSERT INTO rollup_eventos_diarios {sql}", params)
+            sql, params = funnel_crudo(conn, *rango)
+            conn.execute("DELETE FROM rollup_funnel_sesiones WHERE day = ?", (dia,))
+            conn.execute(f"INSERT INTO rollup_funnel_sesiones {sql}", params)
+
+
+def cerrar_compactacion(conn: sqlite3.Connection, hasta: int, corte: str):
+    # Nunca retroceder la marca: otro worker pudo compactar más lejos entretanto
+    if hasta >= leer_estado(conn, "ultimo_evento", 0):
+        _guardar_estado(conn, "ultimo_evento", hasta)
+        _guardar_estado(conn, "corte", corte)
+
+
+def borrar_rollups(conn: sqlite3.Connection):
+    conn.execute("DELETE FROM rollup_sesiones_diarias")
+    conn.execute("DELETE FROM rollup_eventos_diarios")
+    conn.execute("DELETE FROM rollup_funnel_sesiones")
+    conn.execute("DELETE FROM rollup_estado")
+
+
+# --- FUENTES PARA LAS CONSULTAS DEL DASHBOARD ---
+
+def _tramos(conn: sqlite3.Connection, start_date: str, end_date: str):
+    """Divide [start_date, end_date] en tramo compactado (días de rollups) y tramo crudo (epoch)."""
+    corte = leer_estado(conn, "corte") or start_date
+    fin_rollup = min(end_date, (date.fromisoformat(corte) - timedelta(days=1)).isoformat())
+    inicio_crudo = max(start_date, corte)
+    return (start_date, fin_rollup), (epoch_de_dia(inicio_crudo), epoch_de_dia(dia_siguiente(end_date)))
+
+
+def fuente_sesiones(conn: sqlite3.Connection, start_date: str, end_date: str) -> Tuple[str, tuple]:
+    """CTE `s` con agregados de sesiones del rango: rollups + sesiones crudas recientes."""
+    (ini_rollup, fin_rollup), (ini_crudo, fin_crudo) = _tramos(conn, start_date, end_date)
+    sql = f"""
+        WITH s AS (
+            SELECT day, country_code, country, device_type, utm_source, sessions, conversions, conversion_amount
+            FROM rollup_sesiones_diarias WHERE day BETWEEN ? AND ?
+            UNION ALL
+            {_SQL_SESIONES_CRUDAS}
+        )
+    """
+    return sql, (ini_rollup, fin_rollup, ini_crudo, fin_crudo)
+
+
+def fuente_eventos(conn: sqlite3.Connection, start_date: str, end_date: str) -> Tuple[str, tuple]:
+    """CTE `e` con eventos y sesiones distintas por día y tipo: rollups + eventos crudos recientes."""
+    (ini_rollup, fin_rollup), (ini_crudo, fin_crudo) = _tramos(conn, start_date, end_date)
+    crudos, params = eventos_crudos(conn, ini_crudo, fin_crudo)
+    sql = f"""
+        WITH e AS (
+            SELECT day, event_type, events, sessions
+            FROM rollup_eventos_diarios WHERE day BETWEEN ? AND ?
+            UNION ALL
+            {crudos}
+        )
+    """
+    return sql, (ini_rollup, fin_rollup) + params
+
+
+def fuente_funnel(conn: sqlite3.Connection, start_date: str, end_date: str) -> Tuple[str, tuple]:
+    """CTE `f` con (día, paso, sesión) del funnel en el rango: rollups + eventos crudos recientes."""
+    (ini_rollup, fin_rollup), (ini_crudo, fin_crudo) = _tramos(conn, start_date, end_date)
+    crudos, params = funnel_crudo(conn, ini_crudo, fin_crudo)
+    sql = f"""
+        WITH f AS (
+            SELECT day, event_type, session_id
+            FROM rollup_funnel_sesiones WHERE day BETWEEN ? AND ?
+            UNION ALL
+            {crudos}
+        )
+    """
+    return sql, (ini_rollup, fin_rollup) + params
+
+
+class RollupCompactor:
+    """Recalcula periódicamente los días sucios de los rollups."""
+
+    def __init__(self, db: AnalyticsDB, intervalo: float = ROLLUP_INTERVAL_S):
+        self.db = db
+        self.intervalo = intervalo
+        self._task: Optional[asyncio.Task] = None
+
+    async def compactar(self) -> int:
+        corte = hoy_utc()
+        dias, hasta = await self.db.read(dias_sucios)
+        for i in range(0, len(dias), DIAS_POR_TRANSACCION):
+            await self.db.write(recalcular_dias, dias[i:i + DIAS_POR_TRANSACCION])
+        await self.db.write(cerrar_compactacion, hasta, corte)
+        if dias:
+            logging.info(f"📊 [Rollup] {len(dias)} días recalculados (hasta evento {hasta})")
+        return len(dias)
+
+    def start(self):
+        if self.intervalo <= 0:
+            return
+        self._task = asyncio.create_task(self._run(), name="analytics-rollup-compactor")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                await self.compactar()
+            except Exception as e:
+                logging.error(f"❌ [Rollup] Error en la compactación: {e}")
+            await asyncio.sleep(self.intervalo)
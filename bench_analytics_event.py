@@ -0,0 +1,113 @@
+"""
+Benchmark del endpoint público POST /api/analytics/event.
+
+Compara requests/segundo con:
+  - antes:   réplica del handler anterior (conexión sqlite3 nueva por request,
+             consultas en el event loop), montada en /legacy/event
+  - despues: el endpoint con analytics_db en modo write-through (conexiones
+             de larga vida, WAL + pragmas, escritura en su propio hilo)
+  - buffer:  el endpoint con el buffer write-behind activo (flush en lotes);
+             al final verifica que el flush de apagado no pierda eventos
+
+Se ejecuta en proceso contra la app ASGI (sin red), sobre una base temporal.
+
+Uso:
+    python bench_analytics_event.py [requests] [concurrencia]
+"""
+import asyncio
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import httpx
+from fastapi import FastAPI
+
+import analytics
+from mi_backend_python.init_db import GLOB_PARTICIONES, init_db
+
+
+def crear_app():
+    app = FastAPI()
+    app.include_router(analytics.router)
+
+    @app.post("/legacy/event", status_code=201)
+    async def track_event_anterior(data: analytics.EventInput):
+        conn = sqlite3.connect(analytics.ANALYTICS_DB)
+        conn.row_factory = sqlite3.Row
+        cursor = conn.cursor()
+        created_at = datetime.now().isoformat()
+        cursor.execute(
+            "INSERT INTO events (session_id, event_type, event_data, created_at) VALUES (?, ?, ?, ?)",
+            (data.session_id, data.event_type, data.event_data, created_at),
+        )
+        cursor.execute("UPDATE sessions SET last_activity = ? WHERE session_id = ?", (created_at, data.session_id))
+        conn.commit()
+        return {"status": "ok"}
+
+    return app
+
+
+async def medir(app, ruta, total, concurrencia, session_id):
+    transport = httpx.ASGITransport(app=app)
+    semaforo = asyncio.Semaphore(concurrencia)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        async def enviar(i):
+            async with semaforo:
+                r = await client.post(ruta, json={
+                    "session_id": session_id, "event_type": f"question_viewed_q{i % 41 + 1}"
+                })
+                r.raise_for_status()
+
+        inicio = time.perf_counter()
+        await asyncio.gather(*(enviar(i) for i in range(total)))
+        return total / (time.perf_counter() - inicio)
+
+
+async def main():
+    total = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    concurrencia = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+
+    with tempfile.TemporaryDirectory() as directorio:
+        analytics.ANALYTICS_DB = os.path.join(directorio, "analytics.db")
+        analytics.analytics_db.db_path = analytics.ANALYTICS_DB
+        init_db(analytics.ANALYTICS_DB)
+
+        app = crear_app()
+
+        # "antes" corre primero: la base sigue en modo rollback-journal hasta
+        # que analytics_db abra sus conexiones en WAL
+        with sqlite3.connect(analytics.ANALYTICS_DB) as conn:
+            # El endpoint "antes" escribe en la tabla única events del esquema original
+            conn.execute("CREATE TABLE events (event_id INTEGER PRIMARY KEY AUTOINCREMENT, session_id TEXT NOT NULL, "
+                         "event_type TEXT NOT NULL, event_data TEXT, created_at DATETIME)")
+            session_id = "bench-session"
+            conn.execute("INSERT INTO sessions (session_id, created_at) VALUES (?, ?)",
+                         (session_id, int(time.time())))
+        antes = await medir(app, "/legacy/event", total, concurrencia, session_id)
+        despues = await medir(app, "/api/analytics/event", total, concurrencia, session_id)
+
+        analytics.event_buffer.start()
+        buffer = await medir(app, "/api/analytics/event", total, concurrencia, session_id)
+        await analytics.detener_analytics()
+
+        with sqlite3.connect(analytics.ANALYTICS_DB) as conn:
+            guardados = sum(
+                conn.execute(f"SELECT COUNT(*) FROM {tabla}").fetchone()[0]
+                for (tabla,) in conn.execute(
+                    "SELECT name FROM sqlite_master WHERE type = 'table' AND (name = 'events' OR name GLOB ?)",
+                    (GLOB_PARTICIONES,),
+                ).fetchall()
+            )
+        assert guardados == 3 * total, f"se esperaban {3 * total} eventos, hay {guardados}"
+
+    print(f"POST /api/analytics/event ({total} requests, concurrencia {concurrencia})")
+    print(f"  antes  (conexión por request):  {antes:8.0f} req/s")
+    print(f"  despues (analytics_db):         {despues:8.0f} req/s  ({despues / antes:.1f}x)")
+    print(f"  buffer (write-behind):          {buffer:8.0f} req/s  ({buffer / antes:.1f}x)")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,162 @@
+"""
+Benchmark del funnel y drop-off por pregunta de GET /api/analytics/dashboard.
+
+Compara sobre una base sintética de N eventos (1M por defecto):
+  - antes:   4 COUNT(DISTINCT) por paso del funnel + 2 COUNT por pregunta sobre
+             la tabla única events del esquema original (q1..q20 como el código
+             original, y q1..q41 para igualar cobertura), con y sin el índice
+             (event_type, created_at)
+  - despues: contar_eventos_dashboard(), que lee los rollups diarios
+             (analytics_rollup.py) tras compactar
+
+Verifica que ambos produzcan los mismos conteos antes de medir.
+
+Uso:
+    python bench_dashboard_funnel.py [eventos] [repeticiones]
+"""
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+from analytics import PASOS_FUNNEL, contar_eventos_dashboard
+from analytics_db import configurar_conexion, epoch_de_dia, hoy_utc
+from analytics_partitions import insertar_eventos
+from analytics_rollup import cerrar_compactacion, dia_siguiente, dias_sucios, recalcular_dias
+from constants import PREGUNTAS_ORDENADAS
+from mi_backend_python.init_db import init_db
+
+DIAS = 90
+
+
+def poblar(db_path, total):
+    """Sesiones que recorren el funnel y el cuestionario hasta abandonar en algún punto."""
+    random.seed(7)
+    inicio = datetime(2025, 1, 1, tzinfo=timezone.utc)
+
+    def eventos():
+        generados = 0
+        sesion = 0
+        while generados < total:
+            sesion += 1
+            session_id = f"s{sesion}"
+            # Hasta las 23:00: el recorrido de una sesión no cruza la medianoche
+            t = inicio + timedelta(days=random.randrange(DIAS), seconds=random.randrange(23 * 3600))
+            recorrido = list(PASOS_FUNNEL[:3])
+            for qid in PREGUNTAS_ORDENADAS[:random.randrange(1, len(PREGUNTAS_ORDENADAS) + 1)]:
+                recorrido.append(f"question_viewed_{qid}")
+                if random.random() < 0.97:
+                    recorrido.append(f"question_answered_{qid}")
+            if random.random() < 0.4:
+                recorrido.append(PASOS_FUNNEL[3])
+            for event_type in recorrido:
+                if generados >= total:
+                    return
+                t += timedelta(seconds=random.randrange(2, 30))
+                generados += 1
+                yield session_id, event_type, None, int(t.timestamp())
+
+    with sqlite3.connect(db_path) as conn:
+        # Tabla única del esquema original para "antes"; los mismos eventos van a las particiones
+        conn.execute("""
+            CREATE TABLE events (
+                event_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                session_id TEXT NOT NULL,
+                event_type TEXT NOT NULL,
+                event_data TEXT,
+                created_at INTEGER
+            )
+        """)
+        conn.executemany(
+            "INSERT INTO events (session_id, event_type, event_data, created_at) VALUES (?, ?, ?, ?)",
+            eventos(),
+        )
+        cursor = conn.execute("SELECT session_id, event_type, event_data, created_at FROM events ORDER BY event_id")
+        while lote := cursor.fetchmany(50_000):
+            insertar_eventos(conn, lote)
+
+
+def conteos_anteriores(conn, date_filter, preguntas):
+    cursor = conn.cursor()
+    conteos = {}
+    for step in PASOS_FUNNEL:
+        cursor.execute(f"""
+            SELECT COUNT(DISTINCT session_id)
+            FROM events
+            WHERE event_type = '{step}' AND {date_filter}
+        """)
+        conteos[step] = cursor.fetchone()[0]
+    for qid in preguntas:
+        for accion in ("viewed", "answered"):
+            cursor.execute(f"SELECT COUNT(*) FROM events WHERE event_type = 'question_{accion}_{qid}' AND {date_filter}")
+            conteos[f"question_{accion}_{qid}"] = cursor.fetchone()[0]
+    return conteos
+
+
+def conteos_nuevos(conn, start_date, end_date):
+    conteos = contar_eventos_dashboard(conn, start_date, end_date)
+    resultado = {step: conteos.get(step, (0, 0))[1] for step in PASOS_FUNNEL}
+    for qid in PREGUNTAS_ORDENADAS:
+        for accion in ("viewed", "answered"):
+            resultado[f"question_{accion}_{qid}"] = conteos.get(f"question_{accion}_{qid}", (0, 0))[0]
+    return resultado
+
+
+def medir(fn, repeticiones):
+    tiempos = []
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        fn()
+        tiempos.append(time.perf_counter() - inicio)
+    return min(tiempos) * 1000
+
+
+def main():
+    total = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    repeticiones = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+
+    with tempfile.TemporaryDirectory() as directorio:
+        db_path = os.path.join(directorio, "analytics.db")
+        init_db(db_path)
+        inicio = time.perf_counter()
+        poblar(db_path, total)
+        print(f"Base sintética: {total:,} eventos ({time.perf_counter() - inicio:.1f}s)")
+
+        conn = configurar_conexion(sqlite3.connect(db_path))
+        start_date, end_date = "2025-01-01", "2025-02-15"
+        date_filter = f"created_at >= {epoch_de_dia(start_date)} AND created_at < {epoch_de_dia(dia_siguiente(end_date))}"
+
+        inicio = time.perf_counter()
+        dias, hasta = dias_sucios(conn)
+        with conn:
+            recalcular_dias(conn, dias)
+            cerrar_compactacion(conn, hasta, hoy_utc())
+        print(f"Compactación inicial: {len(dias)} días ({time.perf_counter() - inicio:.1f}s)")
+
+        nuevos = conteos_nuevos(conn, start_date, end_date)
+        anteriores = conteos_anteriores(conn, date_filter, PREGUNTAS_ORDENADAS)
+        assert nuevos == anteriores, "Los conteos difieren entre ambas implementaciones"
+
+        despues = medir(lambda: conteos_nuevos(conn, start_date, end_date), repeticiones)
+        antes = {}
+        for esquema in ("sin índice", "con índice"):
+            if esquema == "con índice":
+                conn.execute("CREATE INDEX idx_bench_type_created ON events(event_type, created_at, session_id)")
+            antes[esquema] = (
+                medir(lambda: conteos_anteriores(conn, date_filter, PREGUNTAS_ORDENADAS[:20]), repeticiones),
+                medir(lambda: conteos_anteriores(conn, date_filter, PREGUNTAS_ORDENADAS), repeticiones),
+            )
+        conn.close()
+
+    print(f"Funnel + drop-off por pregunta, {start_date}..{end_date} (mejor de {repeticiones})")
+    for esquema, (antes_20, antes_41) in antes.items():
+        print(f"  antes  [{esquema}] 44 consultas, q1..q20:  {antes_20:9.1f} ms")
+        print(f"  antes  [{esquema}] 86 consultas, q1..q41:  {antes_41:9.1f} ms")
+    print(f"  despues (rollups diarios, q1..q41):           {despues:9.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
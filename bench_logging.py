@@ -0,0 +1,160 @@
+"""
+Benchmark del costo de logging por diagnóstico en el camino de /api/diagnostico.
+
+Cada escenario corre en un proceso nuevo (la configuración de logging se fija
+al importar main) que escribe sus logs en un archivo, como en producción, y
+mide el tiempo por diagnóstico en el hilo que atiende el request: el cálculo
+de la multa más los logs del cálculo, del diagnóstico procesado y del
+encolado a Make.com. Se reporta el tiempo de pared y el CPU del propio hilo:
+con cola, el formateo y la escritura corren en el hilo del QueueListener (que
+en este proceso compite por el GIL, por eso el tiempo de pared baja menos).
+
+  - sin logs:    logging.disable, referencia para calcular el sobrecosto
+  - antes:       réplica de los logs anteriores (9 logging.info con f-strings
+                 en el logger raíz, handler síncrono)
+  - texto:       registros actuales (lazy, uno por bloque), handler síncrono
+  - json + cola: LOG_FORMAT=json, LOG_QUEUE_ENABLED=true
+  - json + cola + muestreo: además LOG_SAMPLING=diagnostico.calculo=0.05
+
+Uso:
+    python bench_logging.py [diagnosticos] [repeticiones]
+"""
+import logging
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+REPO_DIR = Path(__file__).resolve().parent
+
+ESCENARIOS = {
+    "sin logs": {},
+    "antes": {},
+    "texto": {},
+    "json + cola": {"LOG_FORMAT": "json", "LOG_QUEUE_ENABLED": "true"},
+    "json + cola + muestreo": {
+        "LOG_FORMAT": "json", "LOG_QUEUE_ENABLED": "true", "LOG_SAMPLING": "diagnostico.calculo=0.05",
+    },
+}
+
+
+def datos_diagnostico(i):
+    from fine_engine_vectorized import PREGUNTAS
+    return {
+        "nombre": "Bench", "empresa": f"Empresa {i % 100}", "cargo": "Gerente",
+        "numero_trabajadores": 10 + i % 500, "tipo_empresa": ("micro", "pequena", "no_mype")[i % 3],
+        "respuestas": {p: ("no" if (j + i) % 4 == 0 else "si") for j, p in enumerate(PREGUNTAS)},
+    }
+
+
+def calcular_anterior(main, datos_formulario):
+    """calcular_multa_sunafil con los logs de depuración de la versión anterior."""
+    tipo_empresa = datos_formulario.get("tipo_empresa", "no_mype")
+    numero_trabajadores = int(datos_formulario.get("numero_trabajadores", 0))
+    mascara = main.mascara_incumplimientos(datos_formulario.get("respuestas", {}), tipo_empresa)
+    hallazgos = dict(zip(main.SEVERIDADES, main.contar_hallazgos(mascara)))
+    main.detalle_hallazgos(datos_formulario.get("respuestas", {}), mascara)
+    monto_multa = 0
+    if numero_trabajadores > 0 and sum(hallazgos.values()) > 0:
+        multa_leve, multa_grave, multa_muy_grave = main.multas_unitarias(tipo_empresa, numero_trabajadores)
+        monto_multa = (
+            hallazgos['Leves'] * multa_leve +
+            hallazgos['Grave'] * multa_grave +
+            hallazgos['Muy Grave'] * multa_muy_grave
+        )
+        logging.info(f"=== CÁLCULO MULTA ACUMULATIVA ===")
+        logging.info(f"Tipo empresa: {tipo_empresa}, Trabajadores: {numero_trabajadores}")
+        logging.info(f"Hallazgos: Leves={hallazgos['Leves']}, Grave={hallazgos['Grave']}, Muy Grave={hallazgos['Muy Grave']}")
+        logging.info(f"Multas unitarias: Leve={multa_leve}, Grave={multa_grave}, Muy Grave={multa_muy_grave}")
+        logging.info(f"MONTO TOTAL ACUMULATIVO: {monto_multa}")
+    return {"lead": {"empresa": datos_formulario.get("empresa")}, "multa": {"monto_final_soles": float(monto_multa)}}
+
+
+def diagnostico_anterior(main, datos):
+    resultado = calcular_anterior(main, datos)
+    empresa = resultado['lead']['empresa']
+    logging.info(f"=== DIAGNÓSTICO PROCESADO ===")
+    logging.info(f"Empresa: {empresa}")
+    logging.info(f"Multa calculada: S/ {resultado['multa']['monto_final_soles']:.2f}")
+    logging.info(f"📤 Tarea ENCOLADA exitosamente para: {empresa} | Webhook: 🟢 activo | Auth: 🔐 autenticado")
+
+
+def diagnostico_actual(main, datos):
+    # Mismos registros que ejecutar_diagnostico y programar_envio_make
+    resultado = main.calcular_multa_sunafil(datos)
+    empresa = resultado['lead']['empresa']
+    main.log_diagnostico.info(
+        "DIAGNÓSTICO PROCESADO: empresa=%(empresa)s multa=S/ %(monto_multa_soles).2f",
+        {"empresa": empresa, "monto_multa_soles": resultado['multa']['monto_final_soles']},
+    )
+    main.log_diagnostico.info(
+        "📤 Tarea ENCOLADA exitosamente para: %s | Webhook: %s | Auth: %s",
+        empresa, "🟢 activo", "🔐 autenticado",
+    )
+
+
+def correr_escenario(nombre, total):
+    """Dentro del proceso hijo: imprime µs por diagnóstico (pared y CPU del hilo)."""
+    import main
+    from log_pipeline import request_id
+
+    if nombre == "sin logs":
+        logging.disable(logging.CRITICAL)
+    diagnostico = diagnostico_anterior if nombre == "antes" else diagnostico_actual
+    lote = [datos_diagnostico(i) for i in range(total)]
+    for datos in lote[:50]:
+        diagnostico(main, datos)
+
+    inicio, cpu = time.perf_counter(), time.thread_time()
+    for i, datos in enumerate(lote):
+        token = request_id.set(f"bench-{i}")
+        diagnostico(main, datos)
+        request_id.reset(token)
+    print((time.perf_counter() - inicio) / total * 1e6, (time.thread_time() - cpu) / total * 1e6)
+
+
+def medir(nombre, total, repeticiones, cwd):
+    env = dict(os.environ, PYTHONPATH=str(REPO_DIR), PYTHONDONTWRITEBYTECODE="1", **ESCENARIOS[nombre])
+    for variable in ("LOG_FORMAT", "LOG_QUEUE_ENABLED", "LOG_SAMPLING"):
+        if variable not in ESCENARIOS[nombre]:
+            env.pop(variable, None)
+    paredes, cpus = [], []
+    for _ in range(repeticiones):
+        # Los logs van a un archivo real (como el log que lee Passenger)
+        with open(os.path.join(cwd, "bench.log"), "w") as log:
+            salida = subprocess.run(
+                [sys.executable, __file__, "--escenario", nombre, str(total)],
+                cwd=cwd, env=env, stdout=subprocess.PIPE, stderr=log, text=True, check=True,
+            )
+        pared, cpu = salida.stdout.strip().splitlines()[-1].split()
+        paredes.append(float(pared))
+        cpus.append(float(cpu))
+    return statistics.median(paredes), statistics.median(cpus)
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == "--escenario":
+        correr_escenario(sys.argv[2], int(sys.argv[3]))
+        return
+
+    total = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    repeticiones = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+    # Directorio temporal: importar main crea analytics.db en el cwd
+    with tempfile.TemporaryDirectory() as cwd:
+        resultados = {nombre: medir(nombre, total, repeticiones, cwd) for nombre in ESCENARIOS}
+
+    base_pared, base_cpu = resultados["sin logs"]
+    antes = resultados["antes"][1] - base_cpu
+    print(f"Logging por diagnóstico ({total} diagnósticos, mediana de {repeticiones} procesos)")
+    print(f"{'escenario':<24} {'pared (µs)':>11} {'CPU hilo (µs)':>14} {'logging CPU (µs)':>17} {'vs antes':>9}")
+    for nombre, (pared, cpu) in resultados.items():
+        sobrecosto = cpu - base_cpu
+        relacion = f"{antes / sobrecosto:.1f}x" if nombre not in ("sin logs", "antes") and sobrecosto > 0 else ""
+        print(f"{nombre:<24} {pared:>11.1f} {cpu:>14.1f} {sobrecosto:>17.1f} {relacion:>9}")
+
+
+if __name__ == "__main__":
+    main()
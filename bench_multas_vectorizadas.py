@@ -0,0 +1,134 @@
+"""
+Benchmark: cálculo escalar (calcular_multa_sunafil en bucle) vs vectorizado.
+
+Genera cohortes aleatorias de 1k/10k/100k empresas, verifica que ambos
+caminos den exactamente los mismos conteos, severidad máxima y montos, y
+reporta el tiempo de cada uno.
+
+Después compara calcular_lote (el cálculo de /api/diagnostico/batch, sobre el
+motor vectorizado) con el bucle anterior de calcular_multa_sunafil por fila,
+con los logs activos como en producción, para lotes de hasta
+MAX_DIAGNOSTICOS_POR_LOTE: ambos deben devolver exactamente los mismos
+resultados.
+
+Uso:
+    python bench_multas_vectorizadas.py [tamaño ...]
+"""
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from fine_engine_vectorized import (
+    NOMBRES_SEVERIDAD_MAXIMA,
+    PREGUNTAS,
+    calcular_multas_vectorizado,
+    matriz_respuestas,
+)
+
+TAMANOS = [1_000, 10_000, 100_000]
+TAMANOS_LOTE = [10, 100, 1_000]
+REPETICIONES_LOTE = 20
+TIPOS_EMPRESA = ['micro', 'pequena', 'no_mype']
+
+
+def generar_cohorte(n, semilla=42):
+    rng = random.Random(semilla)
+    cohorte = []
+    for _ in range(n):
+        tipo = rng.choice(TIPOS_EMPRESA)
+        trabajadores = rng.randint(0, 1500)
+        respuestas = {p: ('no' if rng.random() < 0.3 else 'si') for p in PREGUNTAS}
+        cohorte.append({"tipo_empresa": tipo, "numero_trabajadores": trabajadores, "respuestas": respuestas})
+    return cohorte
+
+
+def importar_main():
+    # Importar main crea analytics.db en el cwd: usar un directorio temporal
+    directorio_original = os.getcwd()
+    os.chdir(tempfile.mkdtemp())
+    try:
+        import main
+    finally:
+        os.chdir(directorio_original)
+    return main
+
+
+def medir_lotes(main):
+    """calcular_lote vs el bucle anterior, con los logs a un archivo como en producción."""
+    raiz = logging.getLogger()
+    handlers = raiz.handlers[:]
+    raiz.handlers[:] = [logging.FileHandler(os.path.join(tempfile.mkdtemp(), "bench.log"))]
+    logging.disable(logging.NOTSET)
+    try:
+        print(f"\n{'lote':>8} {'bucle (ms)':>11} {'calcular_lote (ms)':>19} {'aceleración':>12}")
+        for n in TAMANOS_LOTE:
+            lote = main.ADAPTADOR_LOTE.validate_python([
+                {"nombre": "Bench", "email": "bench@example.com", "telefono": "999", "empresa": f"Empresa {i}",
+                 "cargo": "Gerente", **fila}
+                for i, fila in enumerate(generar_cohorte(n, semilla=n))
+            ])
+            esperados = [main.calcular_multa_sunafil(datos.model_dump()) for datos in lote]
+            assert main.calcular_lote(lote) == esperados
+
+            inicio = time.perf_counter()
+            for _ in range(REPETICIONES_LOTE):
+                [main.calcular_multa_sunafil(datos.model_dump()) for datos in lote]
+            t_bucle = (time.perf_counter() - inicio) / REPETICIONES_LOTE
+
+            inicio = time.perf_counter()
+            for _ in range(REPETICIONES_LOTE):
+                main.calcular_lote(lote)
+            t_lote = (time.perf_counter() - inicio) / REPETICIONES_LOTE
+
+            print(f"{n:>8} {t_bucle * 1000:>11.2f} {t_lote * 1000:>19.2f} {t_bucle / t_lote:>11.1f}x")
+    finally:
+        raiz.handlers[:] = handlers
+
+
+def main():
+    tamanos = [int(t) for t in sys.argv[1:]] or TAMANOS
+    backend = importar_main()
+    calcular_multa_sunafil = backend.calcular_multa_sunafil
+    # Los logs de depuración por fila distorsionarían la comparación
+    logging.disable(logging.INFO)
+
+    print(f"{'filas':>8} {'escalar (ms)':>13} {'matriz (ms)':>12} {'vectorizado (ms)':>17} {'aceleración':>12}")
+    for n in tamanos:
+        cohorte = generar_cohorte(n)
+
+        inicio = time.perf_counter()
+        escalares = [calcular_multa_sunafil(fila) for fila in cohorte]
+        t_escalar = time.perf_counter() - inicio
+
+        # La construcción de la matriz desde diccionarios se reporta aparte
+        inicio = time.perf_counter()
+        tipos = np.array([fila["tipo_empresa"] for fila in cohorte])
+        trabajadores = np.array([fila["numero_trabajadores"] for fila in cohorte])
+        matriz = matriz_respuestas(fila["respuestas"] for fila in cohorte)
+        t_matriz = time.perf_counter() - inicio
+
+        inicio = time.perf_counter()
+        resultado = calcular_multas_vectorizado(tipos, trabajadores, matriz)
+        t_vectorizado = time.perf_counter() - inicio
+
+        for i, esperado in enumerate(escalares):
+            diagnostico = esperado["diagnostico"]
+            assert list(resultado["hallazgos"][i]) == list(diagnostico["resumen_hallazgos"].values()), i
+            assert NOMBRES_SEVERIDAD_MAXIMA[resultado["severidad_maxima"][i]] == diagnostico["severidad_maxima"], i
+            assert float(resultado["monto_final_soles"][i]) == esperado["multa"]["monto_final_soles"], i
+
+        print(
+            f"{n:>8} {t_escalar * 1000:>13.1f} {t_matriz * 1000:>12.1f} "
+            f"{t_vectorizado * 1000:>17.1f} {t_escalar / t_vectorizado:>11.1f}x"
+        )
+
+    medir_lotes(backend)
+
+
+if __name__ == "__main__":
+    main()
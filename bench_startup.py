@@ -0,0 +1,67 @@
+"""
+Benchmark de arranque en frío del backend.
+
+Mide el tiempo de pared y la memoria residente máxima (RSS) de
+`python -c "import main"` en procesos nuevos, comparando:
+
+  - antes:   el import path con pandas (se fuerza la carga de las vistas
+             DataFrame de constants.py, como hacía la versión anterior)
+  - despues: el import path actual, sin pandas
+
+Uso:
+    python bench_startup.py [repeticiones]
+"""
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+REPO_DIR = Path(__file__).resolve().parent
+
+# Cada escenario imprime su RSS máximo (KB en Linux) al terminar
+_REPORTE_RSS = "import resource; print(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)"
+
+ESCENARIOS = {
+    "antes (con pandas)": (
+        "import constants; "
+        "constants.TABLA_MULTAS_MICRO; constants.TABLA_MULTAS_PEQUENA; constants.TABLA_MULTAS_GENERAL; "
+        "import main; " + _REPORTE_RSS
+    ),
+    "despues (sin pandas)": "import main; " + _REPORTE_RSS,
+}
+
+
+def medir(codigo, repeticiones, cwd):
+    env = dict(os.environ, PYTHONPATH=str(REPO_DIR), PYTHONDONTWRITEBYTECODE="1")
+    tiempos, rss = [], []
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        salida = subprocess.run(
+            [sys.executable, "-c", codigo],
+            cwd=cwd, env=env, capture_output=True, text=True, check=True,
+        )
+        tiempos.append(time.perf_counter() - inicio)
+        rss.append(int(salida.stdout.strip().splitlines()[-1]))
+    return tiempos, rss
+
+
+def main():
+    repeticiones = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    # Directorio temporal: importar main crea analytics.db en el cwd
+    with tempfile.TemporaryDirectory() as cwd:
+        resultados = {nombre: medir(codigo, repeticiones, cwd) for nombre, codigo in ESCENARIOS.items()}
+
+    print(f"python -c \"import main\" ({repeticiones} repeticiones)")
+    print(f"{'escenario':<22} {'mediana (ms)':>13} {'min (ms)':>10} {'RSS máx (MB)':>13}")
+    for nombre, (tiempos, rss) in resultados.items():
+        print(
+            f"{nombre:<22} {statistics.median(tiempos) * 1000:>13.1f} "
+            f"{min(tiempos) * 1000:>10.1f} {max(rss) / 1024:>13.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,25 +1,31 @@
 # constants.py
-import pandas as pd
+# Las tablas se exponen como estructuras Python planas: importar este módulo
+# NO carga pandas. Las vistas DataFrame (TABLA_MULTAS_*) se construyen bajo
+# demanda solo cuando alguna herramienta las pide (ver __getattr__ al final).
 
 # --- VALORES GLOBALES ---
 VALOR_UIT = 5500  # UIT 2026
 PREGUNTAS_EXENTAS_MYPE = ['q36', 'q37', 'q38', 'q39', 'q41']
 
 # --- TABLAS DE MULTAS ---
+# Filas de data_micro / data_pequena (en este orden)
+SEVERIDADES_TABLA = ['Leves', 'Grave', 'Muy Grave']
+
 data_micro = {
     '1': [240.75, 588.50, 1230.50], '2': [267.50, 749.00, 1337.50], '3': [374.50, 856.00, 1551.50], '4': [428.00, 963.00, 1712.00], '5': [481.50, 1070.00, 1926.00], '6': [588.50, 1337.50, 2193.50], '7': [749.00, 1551.50, 2514.50], '8': [856.00, 1819.00, 2889.00], '9': [963.00, 2033.00, 3263.50], '10 y más': [1230.50, 2407.50, 3638.00]
 }
-TABLA_MULTAS_MICRO = pd.DataFrame(data_micro, index=['Leves', 'Grave', 'Muy Grave'])
 
 data_pequena = {
     '1 a 5': [481.50, 2407.50, 4440.50], '6 a 10': [749.00, 3156.50, 6742.00], '11 a 20': [963.00, 4120.50, 8827.50], '21 a 30': [1230.50, 5189.50, 11449.00], '31 a 40': [1712.00, 6742.00, 14817.50], '41 a 50': [2407.50, 8078.50, 17912.50], '51 a 60': [3263.50, 10700.00, 23754.00], '61 a 70': [4440.50, 13321.50, 29634.00], '71 a 99': [5403.50, 16328.50, 35310.00], '100 y más': [12037.50, 24167.50, 61840.50]
 }
-TABLA_MULTAS_PEQUENA = pd.DataFrame(data_pequena, index=['Leves', 'Grave', 'Muy Grave'])
 
 TABLA_MULTAS_GENERAL_UIT = {
     '1-10': {'Leve': 0.13, 'Grave': 0.45, 'Muy Grave': 0.94}, '11-25': {'Leve': 0.38, 'Grave': 1.58, 'Muy Grave': 3.16}, '26-50': {'Leve': 0.61, 'Grave': 6.46, 'Muy Grave': 10.61}, '51-100': {'Leve': 1.04, 'Grave': 10.70, 'Muy Grave': 21.22}, '101-200': {'Leve': 1.58, 'Grave': 14.94, 'Muy Grave': 31.83}, '201-300': {'Leve': 2.01, 'Grave': 18.06, 'Muy Grave': 42.44}, '301-400': {'Leve': 2.44, 'Grave': 21.18, 'Muy Grave': 53.04}, '401-500': {'Leve': 2.87, 'Grave': 24.29, 'Muy Grave': 63.64}, '501-600': {'Leve': 3.29, 'Grave': 28.53, 'Muy Grave': 74.25}, '601-700': {'Leve': 3.72, 'Grave': 32.77, 'Muy Grave': 84.85}, '701-800': {'Leve': 4.15, 'Grave': 37.01, 'Muy Grave': 95.45}, '801-900': {'Leve': 4.58, 'Grave': 41.25, 'Muy Grave': 106.05}, '901-a-mas': {'Leve': 5.02, 'Grave': 45.49, 'Muy Grave': 116.65}
 }
-TABLA_MULTAS_GENERAL = pd.DataFrame(TABLA_MULTAS_GENERAL_UIT).T * VALOR_UIT
+TABLA_MULTAS_GENERAL_SOLES = {
+    rango: {severidad: uit * VALOR_UIT for severidad, uit in multas.items()}
+    for rango, multas in TABLA_MULTAS_GENERAL_UIT.items()
+}
 
 # --- BASE DE DATOS DE INFRACCIONES ---
 BASE_DE_DATOS_INFRACCIONES = {
@@ -65,3 +71,59 @@ BASE_DE_DATOS_INFRACCIONES = {
     'q40': {'severidad': 'Grave', 'articulo': 'Art. 27.8', 'descripcion': 'No llevar el registro de inducción, capacitación, entrenamiento y simulacros de emergencia.'},
     'q41': {'severidad': 'Grave', 'articulo': 'Art. 27.8', 'descripcion': 'No llevar el registro de auditorías.'},
 }
+
+
+# --- ÍNDICE COMPACTO DE PREGUNTAS ---
+# Construido una sola vez al importar: cada pregunta ocupa un slot (bit) fijo,
+# de modo que un cuestionario completo se puntúa con operaciones de bits.
+# Lo comparten el cálculo por request, el de lotes y el análisis de analytics.
+CODIGOS_SEVERIDAD = {severidad: codigo for codigo, severidad in enumerate(SEVERIDADES_TABLA)}
+
+PREGUNTAS_ORDENADAS = tuple(BASE_DE_DATOS_INFRACCIONES)
+SLOT_PREGUNTA = {pregunta_id: slot for slot, pregunta_id in enumerate(PREGUNTAS_ORDENADAS)}
+BIT_PREGUNTA = {pregunta_id: 1 << slot for pregunta_id, slot in SLOT_PREGUNTA.items()}
+SEVERIDAD_POR_SLOT = tuple(
+    CODIGOS_SEVERIDAD[BASE_DE_DATOS_INFRACCIONES[pregunta_id]['severidad']]
+    for pregunta_id in PREGUNTAS_ORDENADAS
+)
+
+# Bits de todas las preguntas de cada severidad (índice = código de severidad)
+MASCARAS_SEVERIDAD = tuple(
+    sum(1 << slot for slot, codigo in enumerate(SEVERIDAD_POR_SLOT) if codigo == codigo_severidad)
+    for codigo_severidad in range(len(SEVERIDADES_TABLA))
+)
+
+# Bits exentos por tipo de empresa (los tipos no listados no tienen exenciones)
+_MASCARA_EXENTAS_MYPE = sum(BIT_PREGUNTA[pregunta_id] for pregunta_id in PREGUNTAS_EXENTAS_MYPE)
+MASCARAS_EXENTAS_POR_TIPO = {'micro': _MASCARA_EXENTAS_MYPE, 'pequena': _MASCARA_EXENTAS_MYPE}
+
+# Todas las variantes de mayúsculas de 'no' (evita respuesta.lower() por respuesta)
+RESPUESTAS_NO = frozenset({'no', 'No', 'nO', 'NO'})
+
+# --- VISTAS PANDAS (SOLO HERRAMIENTAS) ---
+# TABLA_MULTAS_MICRO, TABLA_MULTAS_PEQUENA y TABLA_MULTAS_GENERAL se mantienen
+# como DataFrames para scripts de análisis/verificación, pero se construyen
+# recién al primer acceso para no pagar el import de pandas en el arranque.
+def _vista_micro(pd):
+    return pd.DataFrame(data_micro, index=SEVERIDADES_TABLA)
+
+def _vista_pequena(pd):
+    return pd.DataFrame(data_pequena, index=SEVERIDADES_TABLA)
+
+def _vista_general(pd):
+    return pd.DataFrame(TABLA_MULTAS_GENERAL_UIT).T * VALOR_UIT
+
+_VISTAS_PANDAS = {
+    'TABLA_MULTAS_MICRO': _vista_micro,
+    'TABLA_MULTAS_PEQUENA': _vista_pequena,
+    'TABLA_MULTAS_GENERAL': _vista_general,
+}
+
+def __getattr__(name):
+    constructor = _VISTAS_PANDAS.get(name)
+    if constructor is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    import pandas as pd
+    vista = constructor(pd)
+    globals()[name] = vista
+    return vista
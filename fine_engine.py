@@ -0,0 +1,118 @@
+# fine_engine.py
+"""Motor compilado de multas SUNAFIL.
+
+Las tablas de constants.py se compilan una sola vez al importar el módulo en
+tuplas inmutables indexadas por (tipo de empresa, banda de trabajadores,
+severidad). La banda se resuelve con bisect sobre los límites superiores de
+cada tabla, de modo que el cálculo por request no toca pandas.
+
+Los hallazgos se puntúan sobre el índice compacto de preguntas de
+constants.py: el cuestionario se reduce a una máscara de bits de
+incumplimientos y los conteos por severidad son popcounts.
+"""
+from bisect import bisect_left
+from typing import Dict, List, Mapping, NamedTuple, Tuple
+
+from constants import (
+    BASE_DE_DATOS_INFRACCIONES,
+    BIT_PREGUNTA,
+    MASCARAS_EXENTAS_POR_TIPO,
+    MASCARAS_SEVERIDAD,
+    RESPUESTAS_NO,
+    SEVERIDADES_TABLA,
+    TABLA_MULTAS_GENERAL_SOLES,
+    data_micro,
+    data_pequena,
+)
+
+# Orden fijo de severidades dentro de cada banda compilada
+SEVERIDADES = tuple(SEVERIDADES_TABLA)
+
+# --- DEFINICIÓN DE BANDAS ---
+# (límite superior inclusivo, columna de la tabla); la última banda es abierta.
+BANDAS_MICRO = (
+    (1, '1'), (2, '2'), (3, '3'), (4, '4'), (5, '5'),
+    (6, '6'), (7, '7'), (8, '8'), (9, '9'), (None, '10 y más'),
+)
+BANDAS_PEQUENA = (
+    (5, '1 a 5'), (10, '6 a 10'), (20, '11 a 20'), (30, '21 a 30'), (40, '31 a 40'),
+    (50, '41 a 50'), (60, '51 a 60'), (70, '61 a 70'), (99, '71 a 99'), (None, '100 y más'),
+)
+BANDAS_GENERAL = (
+    (10, '1-10'), (25, '11-25'), (50, '26-50'), (100, '51-100'), (200, '101-200'),
+    (300, '201-300'), (400, '301-400'), (500, '401-500'), (600, '501-600'),
+    (700, '601-700'), (800, '701-800'), (900, '801-900'), (None, '901-a-mas'),
+)
+
+
+class TablaCompilada(NamedTuple):
+    """Tabla de multas de un tipo de empresa lista para consulta O(log n)."""
+    limites: Tuple[int, ...]
+    columnas: Tuple[str, ...]
+    montos: Tuple[Tuple[float, float, float], ...]
+
+    def banda(self, numero_trabajadores: int) -> int:
+        return bisect_left(self.limites, numero_trabajadores)
+
+    def multas_unitarias(self, numero_trabajadores: int) -> Tuple[float, float, float]:
+        return self.montos[self.banda(numero_trabajadores)]
+
+
+def _compilar(bandas, montos_por_columna) -> TablaCompilada:
+    limites = tuple(limite for limite, _ in bandas if limite is not None)
+    columnas = tuple(columna for _, columna in bandas)
+    montos = tuple(tuple(float(m) for m in montos_por_columna[columna]) for columna in columnas)
+    if any(len(fila) != len(SEVERIDADES) for fila in montos):
+        raise ValueError("Cada banda debe definir una multa por severidad")
+    return TablaCompilada(limites, columnas, montos)
+
+
+TABLA_COMPILADA_MICRO = _compilar(BANDAS_MICRO, data_micro)
+TABLA_COMPILADA_PEQUENA = _compilar(BANDAS_PEQUENA, data_pequena)
+TABLA_COMPILADA_GENERAL = _compilar(BANDAS_GENERAL, {
+    rango: [fila['Leve'], fila['Grave'], fila['Muy Grave']]
+    for rango, fila in TABLA_MULTAS_GENERAL_SOLES.items()
+})
+
+TABLAS_COMPILADAS: Dict[str, TablaCompilada] = {
+    'micro': TABLA_COMPILADA_MICRO,
+    'pequena': TABLA_COMPILADA_PEQUENA,
+}
+
+
+def tabla_para(tipo_empresa: str) -> TablaCompilada:
+    """Devuelve la tabla compilada del tipo de empresa (No MYPE por defecto)."""
+    return TABLAS_COMPILADAS.get(tipo_empresa, TABLA_COMPILADA_GENERAL)
+
+
+def multas_unitarias(tipo_empresa: str, numero_trabajadores: int) -> Tuple[float, float, float]:
+    """Multas unitarias (leve, grave, muy grave) para la empresa indicada."""
+    return tabla_para(tipo_empresa).multas_unitarias(numero_trabajadores)
+
+
+# --- PUNTUACIÓN POR MÁSCARA DE BITS ---
+
+def mascara_incumplimientos(respuestas: Mapping[str, str], tipo_empresa: str) -> int:
+    """Bits de las preguntas respondidas 'no', sin las exentas para el tipo de empresa.
+
+    Las preguntas que no existen en BASE_DE_DATOS_INFRACCIONES se ignoran.
+    """
+    mascara = 0
+    for pregunta_id, respuesta in respuestas.items():
+        if respuesta in RESPUESTAS_NO:
+            mascara |= BIT_PREGUNTA.get(pregunta_id, 0)
+    return mascara & ~MASCARAS_EXENTAS_POR_TIPO.get(tipo_empresa, 0)
+
+
+def contar_hallazgos(mascara: int) -> Tuple[int, int, int]:
+    """Cantidad de hallazgos por severidad (en el orden de SEVERIDADES)."""
+    return tuple((mascara & bits).bit_count() for bits in MASCARAS_SEVERIDAD)
+
+
+def detalle_hallazgos(respuestas: Mapping[str, str], mascara: int) -> List[dict]:
+    """Infracciones de la máscara, en el orden en que vienen las respuestas del formulario."""
+    return [
+        BASE_DE_DATOS_INFRACCIONES[pregunta_id]
+        for pregunta_id in respuestas
+        if mascara & BIT_PREGUNTA.get(pregunta_id, 0)
+    ]
@@ -0,0 +1,124 @@
+# fine_engine_vectorized.py
+"""Cálculo vectorizado (NumPy) de multas SUNAFIL para cohortes grandes.
+
+Variante de calcular_multa_sunafil pensada para reportes de cartera: recibe
+arreglos de tipos de empresa y número de trabajadores más una matriz de
+incumplimientos (empresas × preguntas) y resuelve exenciones MYPE, conteo por
+severidad, severidad máxima y monto acumulado como operaciones matriciales.
+
+NumPy solo se importa aquí, no en el camino de arranque de main.py.
+"""
+from typing import Dict, Iterable, Mapping
+
+import numpy as np
+
+from constants import (
+    MASCARAS_EXENTAS_POR_TIPO,
+    PREGUNTAS_ORDENADAS,
+    RESPUESTAS_NO,
+    SEVERIDAD_POR_SLOT,
+    SLOT_PREGUNTA,
+)
+from fine_engine import SEVERIDADES, TABLAS_COMPILADAS, TABLA_COMPILADA_GENERAL
+
+# Columnas de la matriz de respuestas: los slots del índice de preguntas
+PREGUNTAS = PREGUNTAS_ORDENADAS
+
+# Código de severidad máxima -> nombre usado en el diagnóstico
+NOMBRES_SEVERIDAD_MAXIMA = ('Ninguna',) + SEVERIDADES
+
+# (preguntas × severidades): 1 en la severidad de cada infracción
+MATRIZ_SEVERIDAD = np.eye(len(SEVERIDADES), dtype=np.int64)[list(SEVERIDAD_POR_SLOT)]
+
+# Máscaras de bits de exención expandidas a vectores booleanos por tipo de empresa
+EXENTAS_POR_TIPO = {
+    tipo: np.array([bool(mascara >> slot & 1) for slot in range(len(PREGUNTAS))])
+    for tipo, mascara in MASCARAS_EXENTAS_POR_TIPO.items()
+}
+
+# Tablas compiladas como arreglos: (límites de banda, montos banda × severidad)
+_TABLAS_NUMPY = {
+    tipo: (np.asarray(tabla.limites, dtype=np.int64), np.asarray(tabla.montos, dtype=np.float64))
+    for tipo, tabla in TABLAS_COMPILADAS.items()
+}
+_TABLA_GENERAL_NUMPY = (
+    np.asarray(TABLA_COMPILADA_GENERAL.limites, dtype=np.int64),
+    np.asarray(TABLA_COMPILADA_GENERAL.montos, dtype=np.float64),
+)
+
+
+def matriz_respuestas(lista_respuestas: Iterable[Mapping[str, str]]) -> np.ndarray:
+    """Convierte diccionarios {pregunta_id: 'si'/'no'} en la matriz de incumplimientos.
+
+    Las preguntas que no existen en BASE_DE_DATOS_INFRACCIONES se ignoran,
+    igual que en calcular_multa_sunafil.
+    """
+    filas = list(lista_respuestas)
+    matriz = np.zeros((len(filas), len(PREGUNTAS)), dtype=bool)
+    for fila, respuestas in enumerate(filas):
+        for pregunta_id, respuesta in respuestas.items():
+            columna = SLOT_PREGUNTA.get(pregunta_id)
+            if columna is not None and respuesta in RESPUESTAS_NO:
+                matriz[fila, columna] = True
+    return matriz
+
+
+def matriz_desde_mascaras(mascaras: Iterable[int]) -> np.ndarray:
+    """Matriz de incumplimientos a partir de máscaras de mascara_incumplimientos (un bit por slot)."""
+    bits = np.fromiter(mascaras, dtype=np.uint64)
+    return ((bits[:, None] >> np.arange(len(PREGUNTAS), dtype=np.uint64)) & np.uint64(1)).astype(bool)
+
+
+def calcular_multas_vectorizado(tipos_empresa, numeros_trabajadores, incumplimientos) -> Dict[str, np.ndarray]:
+    """Calcula las multas de una cohorte completa.
+
+    Args:
+        tipos_empresa: arreglo (n,) con 'micro', 'pequena' o cualquier otro valor (No MYPE).
+        numeros_trabajadores: arreglo (n,) de enteros.
+        incumplimientos: matriz booleana (n, len(PREGUNTAS)); True = respuesta 'no'.
+
+    Returns:
+        dict con 'hallazgos' (n, 3) por severidad (Leves, Grave, Muy Grave),
+        'total_incumplimientos' (n,), 'severidad_maxima' (n,) como código sobre
+        NOMBRES_SEVERIDAD_MAXIMA y 'monto_final_soles' (n,).
+    """
+    tipos = np.asarray(tipos_empresa)
+    trabajadores = np.asarray(numeros_trabajadores, dtype=np.int64)
+    incumplimientos = np.asarray(incumplimientos, dtype=bool)
+    if incumplimientos.shape != (len(tipos), len(PREGUNTAS)):
+        raise ValueError(f"La matriz de respuestas debe tener forma ({len(tipos)}, {len(PREGUNTAS)})")
+
+    # Exención MYPE aplicada como máscara (empresas del tipo × preguntas exentas)
+    efectivos = incumplimientos.copy()
+    for tipo, exentas in EXENTAS_POR_TIPO.items():
+        efectivos[tipos == tipo] &= ~exentas
+
+    hallazgos = efectivos.astype(np.int64) @ MATRIZ_SEVERIDAD
+    total = hallazgos.sum(axis=1)
+
+    # Código de severidad máxima: la columna más grave con al menos un hallazgo
+    presentes = hallazgos > 0
+    severidad_maxima = np.where(
+        presentes[:, 2], 3, np.where(presentes[:, 1], 2, np.where(presentes[:, 0], 1, 0))
+    )
+
+    # Multas unitarias por fila: banda vía searchsorted (equivale a bisect_left)
+    multas = np.empty((len(tipos), len(SEVERIDADES)), dtype=np.float64)
+    asignadas = np.zeros(len(tipos), dtype=bool)
+    for tipo, (limites, montos) in _TABLAS_NUMPY.items():
+        filas = tipos == tipo
+        multas[filas] = montos[np.searchsorted(limites, trabajadores[filas], side='left')]
+        asignadas |= filas
+    limites, montos = _TABLA_GENERAL_NUMPY
+    multas[~asignadas] = montos[np.searchsorted(limites, trabajadores[~asignadas], side='left')]
+
+    # Mismo orden de suma que el cálculo escalar para obtener montos idénticos
+    monto = hallazgos[:, 0] * multas[:, 0] + hallazgos[:, 1] * multas[:, 1] + hallazgos[:, 2] * multas[:, 2]
+    monto = np.where((trabajadores > 0) & (total > 0), monto, 0.0)
+
+    return {
+        'hallazgos': hallazgos,
+        'total_incumplimientos': total,
+        'severidad_maxima': severidad_maxima,
+        'monto_final_soles': monto,
+    }
@@ -0,0 +1,197 @@
+# log_pipeline.py
+"""Configuración del logging del backend: texto o JSON, síncrono o en cola.
+
+Por defecto se mantiene el formato de siempre (una línea de texto por registro
+en stderr, que es lo que lee Passenger). Con variables de entorno:
+
+- LOG_FORMAT=json: un objeto JSON por línea (ts, level, logger, msg,
+  request_id, module y, si el registro se emitió con un dict de argumentos,
+  esos campos en "datos").
+- LOG_QUEUE_ENABLED=true: el logger raíz solo tiene un QueueHandler que pone
+  el registro en una cola en memoria; un QueueListener en su propio hilo lo
+  formatea y lo escribe, así la E/S del handler no ocurre en el event loop.
+  Los mensajes con argumentos inmutables (logging.info("... %s", x)) se
+  formatean recién en ese hilo.
+- LOG_SAMPLING=diagnostico.calculo=0.05,...: muestreo por logger. Solo pasa
+  esa fracción de los registros DEBUG/INFO emitidos con ese logger; WARNING+
+  nunca se muestrea.
+
+RequestIdMiddleware asigna a cada request un id (el header X-Request-ID del
+cliente o uno nuevo), lo devuelve en la respuesta y lo deja en una ContextVar
+que se agrega a cada registro, incluidos los de las tareas en background.
+"""
+import atexit
+import copy
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import re
+import time
+import uuid
+from contextvars import ContextVar
+from typing import Dict, Optional
+
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "text").lower()
+LOG_QUEUE_ENABLED = os.environ.get("LOG_QUEUE_ENABLED", "false").lower() in ("1", "true", "yes")
+LOG_SAMPLING = os.environ.get("LOG_SAMPLING", "")
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+
+FORMATO_TEXTO = '%(asctime)s - %(levelname)s - %(message)s'
+REQUEST_ID_HEADER = "x-request-id"
+# Ids de cliente aceptados tal cual; cualquier otro valor se reemplaza
+_REQUEST_ID_VALIDO = re.compile(r"[A-Za-z0-9._:-]{1,64}")
+
+request_id: ContextVar[Optional[str]] = ContextVar("request_id", default=None)
+
+# Atributos propios de LogRecord: lo demás viene de extra= y va al JSON
+_ATRIBUTOS_RECORD = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime", "request_id"}
+# Argumentos que se pueden formatear más tarde en otro hilo sin riesgo de que cambien
+_INMUTABLES = (str, int, float, bool, type(None))
+
+
+def parsear_muestreo(spec: str) -> Dict[str, float]:
+    """'a=0.1,b.c=0.5' -> {'a': 0.1, 'b.c': 0.5}."""
+    tasas = {}
+    for parte in spec.split(","):
+        if not parte.strip():
+            continue
+        nombre, _, tasa = parte.partition("=")
+        tasas[nombre.strip()] = min(max(float(tasa), 0.0), 1.0)
+    return tasas
+
+
+def argumentos_inmutables(args) -> bool:
+    valores = args.values() if isinstance(args, dict) else args
+    return all(isinstance(v, _INMUTABLES) for v in valores)
+
+
+class RequestIdFilter(logging.Filter):
+    """Agrega record.request_id desde la ContextVar del request en curso."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = request_id.get()
+        return True
+
+
+class Muestreo(logging.Filter):
+    """Deja pasar una fracción de los registros por debajo de WARNING."""
+
+    def __init__(self, tasa: float):
+        super().__init__()
+        self.tasa = tasa
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        return record.levelno >= logging.WARNING or random.random() < self.tasa
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entrada = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created)) + f".{int(record.msecs):03d}Z",
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+            "request_id": getattr(record, "request_id", None),
+            "module": record.module,
+        }
+        if isinstance(record.args, dict):
+            entrada["datos"] = record.args
+        for clave, valor in vars(record).items():
+            if clave not in _ATRIBUTOS_RECORD:
+                entrada[clave] = valor
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entrada["exc"] = record.exc_text
+        return json.dumps(entrada, ensure_ascii=False, default=str)
+
+
+class ColaHandler(logging.handlers.QueueHandler):
+    """QueueHandler que no formatea en el hilo que loguea.
+
+    El prepare() estándar llama a format() (y por lo tanto arma el mensaje y
+    el JSON) antes de encolar. Aquí solo se resuelve lo que no puede esperar:
+    el traceback y los mensajes cuyos argumentos son objetos mutables.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        if not record.exc_info and (not record.args or argumentos_inmutables(record.args)):
+            return record
+        # Copia: otros handlers del logger raíz (p. ej. LogRing) reciben el mismo registro
+        record = copy.copy(record)
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        if record.args and not argumentos_inmutables(record.args):
+            record.msg, record.args = record.getMessage(), None
+        return record
+
+
+def crear_formatter(formato: str = LOG_FORMAT) -> logging.Formatter:
+    return JsonFormatter() if formato == "json" else logging.Formatter(FORMATO_TEXTO)
+
+
+def configurar_logging(
+    formato: str = LOG_FORMAT,
+    en_cola: bool = LOG_QUEUE_ENABLED,
+    muestreo: str = LOG_SAMPLING,
+    nivel: str = LOG_LEVEL,
+) -> Optional[logging.handlers.QueueListener]:
+    """Reemplaza los handlers del logger raíz; devuelve el listener si hay cola."""
+    raiz = logging.getLogger()
+    for handler in list(raiz.handlers):
+        raiz.removeHandler(handler)
+    raiz.setLevel(nivel)
+
+    salida = logging.StreamHandler()
+    salida.setFormatter(crear_formatter(formato))
+    listener = None
+    if en_cola:
+        cola = queue.SimpleQueue()
+        listener = logging.handlers.QueueListener(cola, salida, respect_handler_level=True)
+        listener.start()
+        # Al salir: vaciar la cola antes de que termine el proceso
+        atexit.register(listener.stop)
+        entrada = ColaHandler(cola)
+    else:
+        entrada = salida
+    # El request id se lee en el contexto de quien loguea, no en el hilo del listener
+    entrada.addFilter(RequestIdFilter())
+    raiz.addHandler(entrada)
+
+    for nombre, tasa in parsear_muestreo(muestreo).items():
+        logging.getLogger(nombre).addFilter(Muestreo(tasa))
+    return listener
+
+
+class RequestIdMiddleware:
+    """Middleware ASGI: request id por request en la ContextVar y en X-Request-ID."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        recibido = next(
+            (v.decode("latin-1") for k, v in scope["headers"] if k == REQUEST_ID_HEADER.encode()), ""
+        )
+        rid = recibido if _REQUEST_ID_VALIDO.fullmatch(recibido) else uuid.uuid4().hex[:16]
+
+        async def enviar(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = list(message.get("headers", [])) + [
+                    (REQUEST_ID_HEADER.encode(), rid.encode())
+                ]
+            await send(message)
+
+        token = request_id.set(rid)
+        try:
+            await self.app(scope, receive, enviar)
+        finally:
+            request_id.reset(token)
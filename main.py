@@ -1,38 +1,47 @@
 # main.py
+import asyncio
+import json
 import logging
 import os
+import sqlite3
+import time
 from contextlib import asynccontextmanager
 from datetime import datetime
-from typing import Dict
+from typing import Dict, List, Optional
 from dotenv import load_dotenv
 
 load_dotenv()
 
 
-import pandas as pd
-from constants import (
-    BASE_DE_DATOS_INFRACCIONES,
-    PREGUNTAS_EXENTAS_MYPE,
-    TABLA_MULTAS_GENERAL,
-    TABLA_MULTAS_MICRO,
-    TABLA_MULTAS_PEQUENA,
-    VALOR_UIT,
+from fine_engine import (
+    SEVERIDADES,
+    contar_hallazgos,
+    detalle_hallazgos,
+    mascara_incumplimientos,
+    multas_unitarias,
 )
+from alert_engine import ALERT_WEBHOOK_URL, AlertEngine, sink_webhook
+from log_pipeline import RequestIdMiddleware, configurar_logging
+from metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, CUBETAS_LATENCIA, registro_metricas
+from request_profiler import ORDENES as ORDENES_PERFIL, ProfilingMiddleware, RequestProfiler
+from webhook_delivery import MakeBatcher, TokenBucketCompartido
+from webhook_outbox import OUTBOX_DB, OutboxDispatcher, WebhookOutbox
 import httpx
-from fastapi import FastAPI, HTTPException, Request, BackgroundTasks
+from fastapi import FastAPI, HTTPException, Request, BackgroundTasks, Depends, Query
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse, FileResponse
+from fastapi.responses import JSONResponse, FileResponse, PlainTextResponse, Response
 from fastapi.staticfiles import StaticFiles
-from pydantic import BaseModel, ValidationError
+from pydantic import BaseModel, Field, TypeAdapter, ValidationError
 from pathlib import Path
 
 # --- CONFIGURACIÓN DEL LOGGING ---
 # Esto configurará el logger para que los mensajes se muestren en la salida
 # estándar, que es lo que servicios como Passenger leen para sus archivos de log.
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s'
-)
+# LOG_FORMAT=json, LOG_QUEUE_ENABLED y LOG_SAMPLING: ver log_pipeline.py
+configurar_logging()
+# Loggers del camino de /api/diagnostico (el de cálculo se puede muestrear)
+log_diagnostico = logging.getLogger("diagnostico")
+log_calculo = logging.getLogger("diagnostico.calculo")
 
 # --- CONFIGURACIÓN DE URL DE WEBHOOK (MAKE/INTEGROMAT) ---
 MAKE_WEBHOOK_URL = os.environ.get("MAKE_WEBHOOK_URL")
@@ -48,18 +57,11 @@ def calcular_multa_sunafil(datos_formulario):
     tipo_empresa = datos_formulario.get("tipo_empresa", "no_mype")
     numero_trabajadores = int(datos_formulario.get("numero_trabajadores", 0))
     respuestas = datos_formulario.get("respuestas", {})
-    hallazgos = {'Leves': 0, 'Grave': 0, 'Muy Grave': 0}
-    lista_hallazgos_detallada = []
     
-    # Contar infracciones por severidad
-    for pregunta_id, respuesta in respuestas.items():
-        if respuesta.lower() == 'no':
-            if (tipo_empresa in ['micro', 'pequena']) and pregunta_id in PREGUNTAS_EXENTAS_MYPE:
-                continue
-            infraccion = BASE_DE_DATOS_INFRACCIONES.get(pregunta_id)
-            if infraccion:
-                hallazgos[infraccion['severidad']] += 1
-                lista_hallazgos_detallada.append(infraccion)
+    # Contar infracciones por severidad (máscara de bits sobre el índice de preguntas)
+    mascara = mascara_incumplimientos(respuestas, tipo_empresa)
+    hallazgos = dict(zip(SEVERIDADES, contar_hallazgos(mascara)))
+    lista_hallazgos_detallada = detalle_hallazgos(respuestas, mascara)
     
     # Determinar severidad máxima (para el diagnóstico)
     severidad_maxima = 'Ninguna'
@@ -70,46 +72,8 @@ def calcular_multa_sunafil(datos_formulario):
     # NUEVO: Calcular multas ACUMULATIVAS
     monto_multa = 0
     if numero_trabajadores > 0 and sum(hallazgos.values()) > 0:
-        if tipo_empresa == 'micro':
-            if numero_trabajadores <= 9: columna = str(numero_trabajadores)
-            else: columna = '10 y más'
-            # Obtener multa unitaria por cada severidad
-            multa_leve = TABLA_MULTAS_MICRO.loc['Leves', columna]
-            multa_grave = TABLA_MULTAS_MICRO.loc['Grave', columna]
-            multa_muy_grave = TABLA_MULTAS_MICRO.loc['Muy Grave', columna]
-        elif tipo_empresa == 'pequena':
-            if numero_trabajadores <= 5: columna = '1 a 5'
-            elif numero_trabajadores <= 10: columna = '6 a 10'
-            elif numero_trabajadores <= 20: columna = '11 a 20'
-            elif numero_trabajadores <= 30: columna = '21 a 30'
-            elif numero_trabajadores <= 40: columna = '31 a 40'
-            elif numero_trabajadores <= 50: columna = '41 a 50'
-            elif numero_trabajadores <= 60: columna = '51 a 60'
-            elif numero_trabajadores <= 70: columna = '61 a 70'
-            elif numero_trabajadores <= 99: columna = '71 a 99'
-            else: columna = '100 y más'
-            # Obtener multa unitaria por cada severidad
-            multa_leve = TABLA_MULTAS_PEQUENA.loc['Leves', columna]
-            multa_grave = TABLA_MULTAS_PEQUENA.loc['Grave', columna]
-            multa_muy_grave = TABLA_MULTAS_PEQUENA.loc['Muy Grave', columna]
-        else: # No MYPE
-            if numero_trabajadores <= 10: rango = '1-10'
-            elif numero_trabajadores <= 25: rango = '11-25'
-            elif numero_trabajadores <= 50: rango = '26-50'
-            elif numero_trabajadores <= 100: rango = '51-100'
-            elif numero_trabajadores <= 200: rango = '101-200'
-            elif numero_trabajadores <= 300: rango = '201-300'
-            elif numero_trabajadores <= 400: rango = '301-400'
-            elif numero_trabajadores <= 500: rango = '401-500'
-            elif numero_trabajadores <= 600: rango = '501-600'
-            elif numero_trabajadores <= 700: rango = '601-700'
-            elif numero_trabajadores <= 800: rango = '701-800'
-            elif numero_trabajadores <= 900: rango = '801-900'
-            else: rango = '901-a-mas'
-            # Obtener multa unitaria por cada severidad
-            multa_leve = TABLA_MULTAS_GENERAL.loc[rango, 'Leve']
-            multa_grave = TABLA_MULTAS_GENERAL.loc[rango, 'Grave']
-            multa_muy_grave = TABLA_MULTAS_GENERAL.loc[rango, 'Muy Grave']
+        # Multa unitaria por cada severidad (tablas compiladas, sin pandas)
+        multa_leve, multa_grave, multa_muy_grave = multas_unitarias(tipo_empresa, numero_trabajadores)
         
         # Sumar multas acumulativamente
         monto_multa = (
@@ -118,12 +82,23 @@ def calcular_multa_sunafil(datos_formulario):
             hallazgos['Muy Grave'] * multa_muy_grave
         )
         
-        # LOG de depuración
-        logging.info(f"=== CÁLCULO MULTA ACUMULATIVA ===")
-        logging.info(f"Tipo empresa: {tipo_empresa}, Trabajadores: {numero_trabajadores}")
-        logging.info(f"Hallazgos: Leves={hallazgos['Leves']}, Grave={hallazgos['Grave']}, Muy Grave={hallazgos['Muy Grave']}")
-        logging.info(f"Multas unitarias: Leve={multa_leve}, Grave={multa_grave}, Muy Grave={multa_muy_grave}")
-        logging.info(f"MONTO TOTAL ACUMULATIVO: {monto_multa}")
+        # LOG de depuración (un solo registro; el mensaje se arma solo si se emite)
+        log_calculo.info(
+            "CÁLCULO MULTA ACUMULATIVA: tipo=%(tipo_empresa)s trabajadores=%(trabajadores)s "
+            "hallazgos L/G/MG=%(leves)s/%(graves)s/%(muy_graves)s "
+            "multas unitarias L/G/MG=%(multa_leve)s/%(multa_grave)s/%(multa_muy_grave)s total=%(monto)s",
+            {
+                "tipo_empresa": tipo_empresa,
+                "trabajadores": numero_trabajadores,
+                "leves": hallazgos['Leves'],
+                "graves": hallazgos['Grave'],
+                "muy_graves": hallazgos['Muy Grave'],
+                "multa_leve": multa_leve,
+                "multa_grave": multa_grave,
+                "multa_muy_grave": multa_muy_grave,
+                "monto": monto_multa,
+            },
+        )
     
     return {
         "lead": {"nombre": datos_formulario.get("nombre"), "empresa": datos_formulario.get("empresa"), "cargo": datos_formulario.get("cargo"), "numero_trabajadores": numero_trabajadores, "tipo_empresa": tipo_empresa.replace('_', ' ').title()},
@@ -147,7 +122,68 @@ async def lifespan(app: FastAPI):
         limits=httpx.Limits(max_connections=100, max_keepalive_connections=20)
     )
     logging.info("Cliente HTTP compartido inicializado")
+    
+    # Outbox persistente para Make.com (opcional)
+    app.state.outbox = None
+    app.state.outbox_dispatcher = None
+    if MAKE_OUTBOX_ENABLED:
+        app.state.outbox = WebhookOutbox(MAKE_OUTBOX_DB).open()
+        logging.info(f"📦 Outbox persistente en {MAKE_OUTBOX_DB}: {app.state.outbox.stats()}")
+        if webhook_permitido(MAKE_WEBHOOK_URL):
+            app.state.outbox_dispatcher = OutboxDispatcher(
+                app.state.outbox,
+                app.state.http_client,
+                MAKE_WEBHOOK_URL,
+                headers_factory=construir_headers_make,
+                concurrencia=MAKE_OUTBOX_CONCURRENCY,
+                max_intentos=MAKE_OUTBOX_MAX_ATTEMPTS,
+                limitador=MAKE_RATE_LIMITER,
+                tamano_lote=MAKE_BATCH_MAX_SIZE if MAKE_BATCH_ENABLED else 1,
+                ventana_lote=MAKE_BATCH_WINDOW_MS / 1000,
+                al_intentar=registrar_intento_make,
+                al_terminar=registrar_entrega_make,
+                al_agotar=alertar_dead_letter_make,
+            )
+            app.state.outbox_dispatcher.start()
+        else:
+            logging.warning("⚠️ [Outbox] Sin webhook válido: los diagnósticos quedan pendientes en disco")
+    
+    # Agrupación en memoria (solo sin outbox: con outbox agrupa el despachador)
+    app.state.make_batcher = None
+    if MAKE_BATCH_ENABLED and not MAKE_OUTBOX_ENABLED and MAKE_WEBHOOK_URL:
+        http_client = app.state.http_client
+        app.state.make_batcher = MakeBatcher(
+            lambda lote, etiqueta: enviar_a_make_background(lote, http_client, etiqueta),
+            ventana=MAKE_BATCH_WINDOW_MS / 1000,
+            tamano_max=MAKE_BATCH_MAX_SIZE,
+        )
+        logging.info(f"📦 [Batch] Agrupación activa: {MAKE_BATCH_WINDOW_MS}ms / {MAKE_BATCH_MAX_SIZE} diagnósticos")
+    
+    # Analytics: conexiones SQLite del worker + buffer write-behind de eventos
+    await iniciar_analytics()
+    
+    # Alertas agrupadas (por defecto al log; con ALERT_WEBHOOK_URL, también por POST)
+    if ALERT_WEBHOOK_URL:
+        alertas.sink = sink_webhook(app.state.http_client, ALERT_WEBHOOK_URL)
+    alertas.start()
+    
+    # Instantáneas de métricas para /metrics entre workers (solo con METRICS_DIR)
+    registro_metricas.start()
+    
     yield
+    
+    if app.state.make_batcher is not None:
+        await app.state.make_batcher.close()
+    if app.state.outbox_dispatcher is not None:
+        await app.state.outbox_dispatcher.stop()
+    # Tras los últimos envíos: emite lo acumulado antes de cerrar analytics.db
+    await alertas.stop()
+    await detener_analytics()
+    await registro_metricas.stop()
+    if app.state.outbox is not None:
+        app.state.outbox.close()
+    if MAKE_RATE_LIMITER is not None:
+        MAKE_RATE_LIMITER.close()
     await app.state.http_client.aclose()
     logging.info("Cliente HTTP compartido cerrado")
 
@@ -169,25 +205,50 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# Perfilado de requests bajo demanda (ver request_profiler.py); inactivo por defecto
+perfilador = RequestProfiler()
+app.add_middleware(ProfilingMiddleware, perfilador=perfilador)
+# Request id en cada registro de log y en el header X-Request-ID de la respuesta
+# (agregado después: envuelve al perfilado, que guarda el id con cada perfil)
+app.add_middleware(RequestIdMiddleware)
 
 # --- INTEGRACIÓN ANALYTICS (DASHBOARD) ---
-from analytics import router as analytics_router
+from analytics import (
+    analytics_db,
+    detener_analytics,
+    get_current_username,
+    iniciar_analytics,
+    router as analytics_router,
+)
 app.include_router(analytics_router)
 
+# --- ALERTAS AGRUPADAS (ver alert_engine.py) ---
+# Las fallas de entrega a Make.com se reportan por clave: sale una alerta
+# resumida por ventana y cooldown en lugar de varias líneas de log por lead.
+alertas = AlertEngine(analytics_db)
+
 # Verificar/Crear DB de analytics si no existe (para persistencia básica en Railway)
+# y aplicar migraciones de esquema pendientes sobre una base existente
 import os, shutil
 if not os.path.exists("analytics.db"):
     logging.info("🆕 Base de datos no encontrada. Inicializando esquema vacío...")
+# Cada worker lo ejecuta al importar; init_db espera el bloqueo de escritura
+# (ANALYTICS_MIGRATION_TIMEOUT_S) mientras otro worker aplica las migraciones.
+try:
+    from mi_backend_python.init_db import init_db
+except ImportError:
+    # Fallback si no encuentra el módulo (ej. estructura de carpetas diferente en docker)
     try:
-        from mi_backend_python.init_db import init_db
-        init_db("analytics.db")
+        from init_db import init_db
     except ImportError:
-        # Fallback si no encuentra el módulo (ej. estructura de carpetas diferente en docker)
-        try:
-            from init_db import init_db
-            init_db("analytics.db")
-        except:
-            logging.error("❌ Error crítico: No se pudo inicializar la base de datos.")
+        init_db = None
+        logging.error("❌ Error crítico: No se encontró init_db; analytics.db no se inicializa.")
+if init_db is not None:
+    try:
+        init_db("analytics.db")
+    except sqlite3.Error as e:
+        # El worker sigue arrancando: el diagnóstico no depende de analytics.db
+        logging.critical(f"❌ Error crítico: No se pudo inicializar/migrar analytics.db: {e}", exc_info=True)
 
 class DatosFormulario(BaseModel):
     """Modelo de datos del formulario SST con protección contra inyección de campos."""
@@ -241,6 +302,89 @@ if MAKE_WEBHOOK_URL:
     validar_protocolo_https(MAKE_WEBHOOK_URL)
 
 
+def construir_headers_make() -> dict:
+    """Encabezados de autenticación para el webhook de Make.com."""
+    if MAKE_AUTH_TOKEN:
+        return {"X-Webhook-Token": MAKE_AUTH_TOKEN}
+    return {}
+
+
+# --- OUTBOX PERSISTENTE (OPCIONAL) ---
+# Con MAKE_OUTBOX_ENABLED=true cada diagnóstico se guarda en SQLite antes de
+# responder y un despachador dedicado lo entrega con reintentos, Retry-After
+# y dead-letter, sobreviviendo a redeploys y caídas largas de Make.com.
+MAKE_OUTBOX_ENABLED = os.environ.get("MAKE_OUTBOX_ENABLED", "false").lower() in ("1", "true", "yes")
+MAKE_OUTBOX_DB = os.environ.get("MAKE_OUTBOX_DB", OUTBOX_DB)
+MAKE_OUTBOX_CONCURRENCY = int(os.environ.get("MAKE_OUTBOX_CONCURRENCY", "4"))
+MAKE_OUTBOX_MAX_ATTEMPTS = int(os.environ.get("MAKE_OUTBOX_MAX_ATTEMPTS", "8"))
+
+
+# --- CONTROL DE CAUDAL HACIA MAKE.COM (OPCIONAL) ---
+# MAKE_RATE_LIMIT_PER_MINUTE activa un token bucket compartido por todas las
+# entregas de todos los workers (su estado vive en MAKE_OUTBOX_DB, así la
+# tasa es la configurada aunque gunicorn levante varios). MAKE_BATCH_ENABLED agrupa diagnósticos durante
+# MAKE_BATCH_WINDOW_MS o hasta MAKE_BATCH_MAX_SIZE y los envía como un arreglo.
+MAKE_RATE_LIMIT_PER_MINUTE = float(os.environ.get("MAKE_RATE_LIMIT_PER_MINUTE", "0"))
+MAKE_RATE_LIMIT_BURST = float(os.environ.get("MAKE_RATE_LIMIT_BURST", "5"))
+MAKE_BATCH_ENABLED = os.environ.get("MAKE_BATCH_ENABLED", "false").lower() in ("1", "true", "yes")
+MAKE_BATCH_WINDOW_MS = int(os.environ.get("MAKE_BATCH_WINDOW_MS", "2000"))
+MAKE_BATCH_MAX_SIZE = int(os.environ.get("MAKE_BATCH_MAX_SIZE", "50"))
+
+MAKE_RATE_LIMITER = (
+    TokenBucketCompartido(MAKE_OUTBOX_DB, MAKE_RATE_LIMIT_PER_MINUTE / 60.0, MAKE_RATE_LIMIT_BURST)
+    if MAKE_RATE_LIMIT_PER_MINUTE > 0 else None
+)
+
+
+def webhook_permitido(url: str) -> bool:
+    """Bloquea envíos por HTTP inseguro (salvo localhost)."""
+    return bool(url) and not (url.startswith("http://") and "localhost" not in url)
+
+
+# --- MÉTRICAS (ver metrics.py; expuestas en /metrics) ---
+METRICA_ETAPAS = registro_metricas.histograma(
+    "diagnostico_etapa_segundos", "Duración de cada etapa de POST /api/diagnostico", ("etapa",),
+    # Validación y cálculo suelen durar decenas de µs
+    cubetas=(0.00005, 0.0001, 0.00025) + CUBETAS_LATENCIA,
+)
+METRICA_MAKE_INTENTOS = registro_metricas.contador(
+    "make_intentos_total", "Intentos de envío a Make.com por resultado", ("resultado",)
+)
+METRICA_MAKE_INTENTO = registro_metricas.histograma(
+    "make_intento_segundos", "Duración de cada intento de envío a Make.com", ("resultado",)
+)
+METRICA_MAKE_ENTREGAS = registro_metricas.contador(
+    "make_entregas_total", "Entregas a Make.com por resultado final", ("resultado",)
+)
+METRICA_MAKE_ENTREGA = registro_metricas.histograma(
+    "make_entrega_segundos", "Duración total de una entrega a Make.com, reintentos incluidos", ("resultado",),
+    cubetas=(0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0),
+)
+
+
+def registrar_intento_make(resultado: str, inicio: float):
+    METRICA_MAKE_INTENTOS.sumar(resultado)
+    METRICA_MAKE_INTENTO.observar(time.perf_counter() - inicio, resultado)
+
+
+def registrar_entrega_make(resultado: str, inicio: float):
+    METRICA_MAKE_ENTREGAS.sumar(resultado)
+    METRICA_MAKE_ENTREGA.observar(time.perf_counter() - inicio, resultado)
+
+
+# Misma clave de alerta que la falla definitiva en enviar_a_make_background
+CLAVES_ALERTA_MAKE = {"http_5xx": "make.down", "http_429": "make.rate_limit", "timeout": "make.timeout", "red": "make.red"}
+
+
+def alertar_dead_letter_make(resultado: str, error: str, empresa: str):
+    """Alerta de registros del outbox movidos a dead-letter (ver OutboxDispatcher)."""
+    alertas.reportar(
+        CLAVES_ALERTA_MAKE.get(resultado, f"make.{resultado}"),
+        f"Diagnósticos movidos a dead-letter del outbox tras {MAKE_OUTBOX_MAX_ATTEMPTS} intentos: {error}",
+        empresa,
+    )
+
+
 # --- FUNCIÓN BACKGROUND: Envío asíncrono a Make.com ---
 async def enviar_a_make_background(
     data: dict, 
@@ -258,58 +402,72 @@ async def enviar_a_make_background(
     - Reintentos con backoff exponencial
     - Manejo específico de errores 500 (Make Down) y 429 (Rate Limit)
     """
-    import asyncio
-    
     max_retries = 3
     base_delay = 2  # segundos
+    inicio_entrega = time.perf_counter()
     
     # Validación de seguridad del protocolo
-    if MAKE_WEBHOOK_URL and MAKE_WEBHOOK_URL.startswith("http://") and "localhost" not in MAKE_WEBHOOK_URL:
-        logging.error(f"❌ [Background] Envío BLOQUEADO para {empresa}: protocolo HTTP inseguro detectado")
+    if MAKE_WEBHOOK_URL and not webhook_permitido(MAKE_WEBHOOK_URL):
+        alertas.reportar(
+            "make.http_inseguro", "Envíos a Make BLOQUEADOS: protocolo HTTP inseguro detectado", empresa, "CRITICAL"
+        )
+        registrar_entrega_make("bloqueado", inicio_entrega)
         return
     
     # Construir headers de autenticación
-    headers = {}
+    headers = construir_headers_make()
     if MAKE_AUTH_TOKEN:
-        headers["X-Webhook-Token"] = MAKE_AUTH_TOKEN
         logging.debug(f"🔐 [Background] Header de autenticación incluido para: {empresa}")
     else:
-        logging.warning(f"⚠️ [Background] Enviando sin autenticación para: {empresa}")
+        alertas.reportar("make.sin_auth", "Enviando a Make sin autenticación (MAKE_AUTH_TOKEN)", empresa, "WARNING")
     
     for attempt in range(max_retries):
         try:
+            # Limitador compartido: espaciar los envíos en lugar de provocar 429
+            if MAKE_RATE_LIMITER is not None:
+                await MAKE_RATE_LIMITER.acquire()
+            # La espera del limitador no cuenta como duración del intento
+            inicio_intento = time.perf_counter()
             response = await http_client.post(
                 MAKE_WEBHOOK_URL,
                 json=data,
                 headers=headers
             )
             response.raise_for_status()
+            registrar_intento_make("ok", inicio_intento)
+            registrar_entrega_make("entregado", inicio_entrega)
             logging.info(f"✅ [Background] Diagnóstico enviado a Make para: {empresa} (intento {attempt + 1})")
             return  # Éxito, salir
             
         except httpx.HTTPStatusError as e:
             status_code = e.response.status_code
+            registrar_intento_make(
+                "http_5xx" if status_code >= 500 else "http_429" if status_code == 429 else "http_4xx", inicio_intento
+            )
             
             # Error 500: Make.com caído
+            # Cada intento queda en DEBUG; la falla definitiva se agrupa en una alerta
             if status_code >= 500:
-                logging.error(
+                logging.debug(
                     f"🔴 [Background] Make.com DOWN (HTTP {status_code}) para {empresa}. "
                     f"Intento {attempt + 1}/{max_retries}. El servidor NO se detuvo."
                 )
                 if attempt < max_retries - 1:
                     delay = base_delay * (2 ** attempt)  # Backoff exponencial
-                    logging.info(f"⏳ [Background] Reintentando en {delay}s...")
+                    logging.debug(f"⏳ [Background] Reintentando en {delay}s...")
                     await asyncio.sleep(delay)
                 else:
-                    logging.error(
-                        f"❌ [Background] Error definitivo (Make Down) para {empresa}. "
-                        f"Datos NO entregados. Considere implementar cola persistente."
+                    alertas.reportar(
+                        "make.down",
+                        f"Make.com DOWN (HTTP {status_code}): diagnósticos NO entregados tras {max_retries} intentos. "
+                        f"Considere activar MAKE_OUTBOX_ENABLED.",
+                        empresa,
                     )
             
             # Error 429: Rate Limit
             elif status_code == 429:
                 retry_after = e.response.headers.get("Retry-After", "60")
-                logging.warning(
+                logging.debug(
                     f"🟡 [Background] RATE LIMIT (HTTP 429) para {empresa}. "
                     f"Make solicita esperar {retry_after}s."
                 )
@@ -319,59 +477,109 @@ async def enviar_a_make_background(
                         delay = min(int(retry_after), 60)  # Máximo 60s de espera
                     except ValueError:
                         delay = base_delay * (2 ** attempt)
-                    logging.info(f"⏳ [Background] Procesamiento en cola. Reintentando en {delay}s...")
+                    logging.debug(f"⏳ [Background] Procesamiento en cola. Reintentando en {delay}s...")
                     await asyncio.sleep(delay)
                 else:
-                    logging.error(
-                        f"❌ [Background] Rate limit persistente para {empresa}. "
-                        f"Datos en cola excedieron reintentos."
+                    alertas.reportar(
+                        "make.rate_limit",
+                        f"Rate limit persistente de Make (HTTP 429): diagnósticos excedieron {max_retries} intentos",
+                        empresa,
                     )
             
             # Otros errores HTTP
             else:
-                logging.warning(
+                logging.debug(
                     f"⚠️ [Background] Error HTTP {status_code} para {empresa}. "
                     f"Intento {attempt + 1}/{max_retries}"
                 )
                 if attempt < max_retries - 1:
                     await asyncio.sleep(base_delay * (2 ** attempt))
                 else:
-                    logging.error(f"❌ [Background] Error definitivo (HTTP {status_code}) para {empresa}")
+                    alertas.reportar(
+                        f"make.http_{status_code}", f"Error definitivo de Make (HTTP {status_code})", empresa
+                    )
                     
         except httpx.TimeoutException as e:
-            logging.warning(
+            registrar_intento_make("timeout", inicio_intento)
+            logging.debug(
                 f"⏱️ [Background] Timeout al enviar a Make para {empresa}. "
                 f"Intento {attempt + 1}/{max_retries}: {e}"
             )
             if attempt < max_retries - 1:
                 await asyncio.sleep(base_delay * (2 ** attempt))
             else:
-                logging.error(f"❌ [Background] Timeout definitivo para {empresa}")
+                alertas.reportar("make.timeout", f"Timeout definitivo al enviar a Make ({max_retries} intentos)", empresa)
                 
         except httpx.HTTPError as e:
-            logging.warning(
+            registrar_intento_make("red", inicio_intento)
+            logging.debug(
                 f"⚠️ [Background] Error de red para {empresa}. "
                 f"Intento {attempt + 1}/{max_retries}: {e}"
             )
             if attempt < max_retries - 1:
                 await asyncio.sleep(base_delay * (2 ** attempt))
             else:
-                logging.error(f"❌ [Background] Error de red definitivo para {empresa}: {e}")
+                alertas.reportar("make.red", f"Error de red definitivo al enviar a Make: {e}", empresa)
+    
+    # Solo se llega aquí si se agotaron los reintentos
+    registrar_entrega_make("fallido", inicio_entrega)
 
-@app.post("/api/diagnostico")
-async def ejecutar_diagnostico(request: Request, background_tasks: BackgroundTasks):
-    try:
-        json_data = await request.json()
-        datos = DatosFormulario.model_validate(json_data)
-    except ValidationError as e:
-        # Usamos logging para registrar el error de validación
-        logging.error(f"Error de validación de Pydantic: {e.errors()}")
-        return JSONResponse(status_code=422, content={"detail": e.errors()})
+# --- PROGRAMACIÓN DEL ENVÍO A MAKE.COM ---
+async def programar_envio_make(request: Request, background_tasks: BackgroundTasks, payload, empresa: str):
+    """Programa la entrega de un payload a Make.com sin bloquear la respuesta.
+
+    Con MAKE_OUTBOX_ENABLED el payload se persiste en el outbox y lo entrega el
+    despachador dedicado; si el outbox falla se recurre a BackgroundTasks para
+    no perder el lead. Con MAKE_BATCH_ENABLED (sin outbox) el payload se suma
+    al lote en memoria en lugar de programar una tarea propia.
+    """
+    webhook_status = "🟢 activo" if MAKE_WEBHOOK_URL else "🔴 no configurado"
+    auth_status = "🔐 autenticado" if MAKE_AUTH_TOKEN else "⚠️ sin autenticación"
+    
+    outbox = getattr(request.app.state, "outbox", None)
+    if outbox is not None:
+        try:
+            outbox_id = await asyncio.to_thread(outbox.enqueue, payload, empresa)
+        except sqlite3.Error as e:
+            logging.error(f"❌ No se pudo guardar en outbox para {empresa}: {e}. Usando BackgroundTasks.")
+        else:
+            dispatcher = getattr(request.app.state, "outbox_dispatcher", None)
+            if dispatcher is not None:
+                dispatcher.notify()
+            log_diagnostico.info(
+                "📥 Diagnóstico #%s guardado en OUTBOX para: %s | Webhook: %s | Auth: %s",
+                outbox_id, empresa, webhook_status, auth_status,
+            )
+            return
+    
+    batcher = getattr(request.app.state, "make_batcher", None)
+    if batcher is not None:
+        batcher.add(payload)
+        log_diagnostico.info("📦 Diagnóstico AGRUPADO para envío por lotes: %s", empresa)
+        return
+    
+    if MAKE_WEBHOOK_URL:
+        background_tasks.add_task(
+            enviar_a_make_background,
+            payload,
+            request.app.state.http_client,
+            empresa
+        )
+        log_diagnostico.info(
+            "📤 Tarea ENCOLADA exitosamente para: %s | Webhook: %s | Auth: %s",
+            empresa, webhook_status, auth_status,
+        )
+    else:
+        logging.warning(
+            f"⚠️ Tarea NO encolada para: {empresa} - "
+            f"MAKE_WEBHOOK_URL no configurado"
+        )
 
-    datos_dict = datos.model_dump()
-    resultado = calcular_multa_sunafil(datos_dict)
 
-    data_to_insert = {
+# --- PAYLOAD PARA MAKE.COM ---
+def construir_payload_make(resultado: dict, datos: DatosFormulario) -> dict:
+    """Aplana el resultado del cálculo al formato que espera el escenario de Make."""
+    return {
         'nombre_lead': resultado['lead']['nombre'],
         'empresa': resultado['lead']['empresa'],
         'cargo_lead': resultado['lead']['cargo'],
@@ -385,33 +593,45 @@ async def ejecutar_diagnostico(request: Request, background_tasks: BackgroundTas
         'telefono_lead': datos.telefono,
         'created_at': datetime.now().isoformat()
     }
+
+
+@app.post("/api/diagnostico")
+async def ejecutar_diagnostico(request: Request, background_tasks: BackgroundTasks):
+    # Duración por etapa en /metrics (diagnostico_etapa_segundos)
+    inicio = time.perf_counter()
+    try:
+        json_data = await request.json()
+        t_json = time.perf_counter()
+        METRICA_ETAPAS.observar(t_json - inicio, "json")
+        datos = DatosFormulario.model_validate(json_data)
+    except ValidationError as e:
+        # Usamos logging para registrar el error de validación
+        logging.error(f"Error de validación de Pydantic: {e.errors()}")
+        return JSONResponse(status_code=422, content={"detail": e.errors()})
+    t_validacion = time.perf_counter()
+    METRICA_ETAPAS.observar(t_validacion - t_json, "validacion")
+
+    datos_dict = datos.model_dump()
+    resultado = calcular_multa_sunafil(datos_dict)
+    t_calculo = time.perf_counter()
+    METRICA_ETAPAS.observar(t_calculo - t_validacion, "calculo")
+
+    data_to_insert = construir_payload_make(resultado, datos)
     
     # LOG de depuración
-    logging.info(f"=== DIAGNÓSTICO PROCESADO ===")
-    logging.info(f"Empresa: {resultado['lead']['empresa']}")
-    logging.info(f"Multa calculada: S/ {data_to_insert['monto_multa_soles']:.2f}")
+    log_diagnostico.info(
+        "DIAGNÓSTICO PROCESADO: empresa=%(empresa)s multa=S/ %(monto_multa_soles).2f",
+        {"empresa": resultado['lead']['empresa'], "monto_multa_soles": data_to_insert['monto_multa_soles']},
+    )
     
     # ✨ ENVÍO ASÍNCRONO: El usuario NO espera a Make.com
-    # La tarea se ejecuta en background después de enviar la respuesta
-    webhook_status = "🟢 activo" if MAKE_WEBHOOK_URL else "🔴 no configurado"
-    auth_status = "🔐 autenticado" if MAKE_AUTH_TOKEN else "⚠️ sin autenticación"
-    
-    if MAKE_WEBHOOK_URL:
-        background_tasks.add_task(
-            enviar_a_make_background,
-            data_to_insert,
-            request.app.state.http_client,
-            resultado['lead']['empresa']
-        )
-        logging.info(
-            f"📤 Tarea ENCOLADA exitosamente para: {resultado['lead']['empresa']} | "
-            f"Webhook: {webhook_status} | Auth: {auth_status}"
-        )
-    else:
-        logging.warning(
-            f"⚠️ Tarea NO encolada para: {resultado['lead']['empresa']} - "
-            f"MAKE_WEBHOOK_URL no configurado"
-        )
+    # La tarea se ejecuta en background (o vía outbox) después de enviar la respuesta
+    t_payload = time.perf_counter()
+    METRICA_ETAPAS.observar(t_payload - t_calculo, "payload")
+    await programar_envio_make(request, background_tasks, data_to_insert, resultado['lead']['empresa'])
+    fin = time.perf_counter()
+    METRICA_ETAPAS.observar(fin - t_payload, "encolado")
+    METRICA_ETAPAS.observar(fin - inicio, "total")
     
     # Respuesta INMEDIATA al usuario (no espera el webhook)
     return {
@@ -425,6 +645,160 @@ async def ejecutar_diagnostico(request: Request, background_tasks: BackgroundTas
     }
 
 
+# --- DIAGNÓSTICO POR LOTES ---
+# Pensado para consultoras que cargan hojas de cálculo con cientos de empresas.
+# Acepta un arreglo JSON o NDJSON (una empresa por línea), valida todo el lote
+# en una sola pasada de pydantic y devuelve los resultados como NDJSON. El lote
+# es atómico (se rechaza completo si una fila es inválida y va a Make en un solo
+# envío), así que la respuesta se arma completa antes de enviarla: no es streaming.
+MAX_DIAGNOSTICOS_POR_LOTE = int(os.environ.get("MAX_DIAGNOSTICOS_POR_LOTE", "1000"))
+ADAPTADOR_LOTE = TypeAdapter(List[DatosFormulario])
+
+
+async def leer_lote(request: Request) -> list:
+    """Lee el cuerpo del request como arreglo JSON o NDJSON (según Content-Type)."""
+    content_type = request.headers.get("content-type", "")
+    if "ndjson" not in content_type and "jsonl" not in content_type:
+        return await request.json()
+
+    filas = []
+    pendiente = b""
+    async for chunk in request.stream():
+        pendiente += chunk
+        *lineas, pendiente = pendiente.split(b"\n")
+        filas.extend(json.loads(linea) for linea in lineas if linea.strip())
+        if len(filas) > MAX_DIAGNOSTICOS_POR_LOTE:
+            break
+    if pendiente.strip():
+        filas.append(json.loads(pendiente))
+    return filas
+
+
+def calcular_lote(lote: List[DatosFormulario]) -> List[dict]:
+    """Calcula todos los diagnósticos del lote con el motor vectorizado.
+
+    Mismo resultado por fila que calcular_multa_sunafil, sin su log de
+    depuración por diagnóstico. Por fila solo se arma la máscara (que también
+    da el detalle); conteos, severidad y montos salen de una pasada matricial.
+    NumPy se importa con el primer lote, no al arrancar.
+    """
+    if not lote:
+        return []
+    from fine_engine_vectorized import NOMBRES_SEVERIDAD_MAXIMA, calcular_multas_vectorizado, matriz_desde_mascaras
+
+    mascaras = [mascara_incumplimientos(datos.respuestas, datos.tipo_empresa) for datos in lote]
+    calculo = calcular_multas_vectorizado(
+        [datos.tipo_empresa for datos in lote],
+        [datos.numero_trabajadores for datos in lote],
+        matriz_desde_mascaras(mascaras),
+    )
+    resultados = []
+    for datos, mascara, hallazgos, total, severidad, monto in zip(
+        lote, mascaras, calculo['hallazgos'].tolist(), calculo['total_incumplimientos'].tolist(),
+        calculo['severidad_maxima'].tolist(), calculo['monto_final_soles'].tolist(),
+    ):
+        resultados.append({
+            "lead": {"nombre": datos.nombre, "empresa": datos.empresa, "cargo": datos.cargo, "numero_trabajadores": datos.numero_trabajadores, "tipo_empresa": datos.tipo_empresa.replace('_', ' ').title()},
+            "diagnostico": {"severidad_maxima": NOMBRES_SEVERIDAD_MAXIMA[severidad], "total_incumplimientos": total, "resumen_hallazgos": dict(zip(SEVERIDADES, hallazgos)), "detalle_hallazgos": detalle_hallazgos(datos.respuestas, mascara)},
+            "multa": {"monto_final_soles": monto},
+        })
+    return resultados
+
+
+@app.post("/api/diagnostico/batch")
+async def ejecutar_diagnostico_lote(request: Request, background_tasks: BackgroundTasks):
+    try:
+        filas = await leer_lote(request)
+    except ValueError as e:
+        logging.error(f"Lote con JSON inválido: {e}")
+        return JSONResponse(status_code=400, content={"detail": "JSON/NDJSON inválido"})
+
+    if not isinstance(filas, list):
+        return JSONResponse(status_code=422, content={"detail": "Se esperaba un arreglo de diagnósticos"})
+    if len(filas) > MAX_DIAGNOSTICOS_POR_LOTE:
+        return JSONResponse(
+            status_code=413,
+            content={"detail": f"El lote excede el máximo de {MAX_DIAGNOSTICOS_POR_LOTE} diagnósticos"}
+        )
+
+    try:
+        lote = ADAPTADOR_LOTE.validate_python(filas)
+    except ValidationError as e:
+        logging.error(f"Error de validación en lote: {e.error_count()} errores")
+        return JSONResponse(status_code=422, content={"detail": e.errors()})
+
+    resultados = calcular_lote(lote)
+    payloads = [construir_payload_make(resultado, datos) for resultado, datos in zip(resultados, lote)]
+    logging.info(f"=== LOTE PROCESADO: {len(lote)} diagnósticos ===")
+
+    # Un único envío agregado a Make.com en lugar de N tareas en background
+    if payloads:
+        await programar_envio_make(
+            request, background_tasks, payloads, f"lote de {len(payloads)} diagnósticos"
+        )
+
+    cuerpo = "".join(
+        json.dumps({
+            "indice": indice,
+            "empresa": resultado['lead']['empresa'],
+            "diagnostico": {
+                "severidad_maxima": resultado['diagnostico']['severidad_maxima'],
+                "total_incumplimientos": resultado['diagnostico']['total_incumplimientos'],
+                "monto_multa_soles": resultado['multa']['monto_final_soles']
+            }
+        }, ensure_ascii=False) + "\n"
+        for indice, resultado in enumerate(resultados)
+    )
+    return Response(content=cuerpo, media_type="application/x-ndjson")
+
+
+# --- MÉTRICAS (FORMATO PROMETHEUS) ---
+# Mismas credenciales que el dashboard. Con varios workers, definir METRICS_DIR
+# para que cualquier worker responda con la suma de todos (ver metrics.py).
+@app.get("/metrics", include_in_schema=False)
+async def exponer_metricas(username: str = Depends(get_current_username)):
+    texto = await asyncio.to_thread(registro_metricas.exponer)
+    return Response(content=texto, media_type=METRICS_CONTENT_TYPE)
+
+
+# --- PERFILADO DE REQUESTS (ADMIN) ---
+# Estado y perfiles son por worker: el listado indica el pid que respondió.
+class ConfigPerfilado(BaseModel):
+    enabled: Optional[bool] = None
+    sample_rate: Optional[float] = Field(None, ge=0, le=1)
+
+
+@app.get("/api/admin/profiling")
+async def listar_perfiles(username: str = Depends(get_current_username)):
+    return {"config": perfilador.estado(), "profiles": perfilador.listar()}
+
+
+@app.put("/api/admin/profiling")
+async def configurar_perfilado(config: ConfigPerfilado, username: str = Depends(get_current_username)):
+    estado = perfilador.configurar(config.enabled, config.sample_rate)
+    logging.warning(f"🔬 Perfilado de requests configurado por {username}: {estado}")
+    return estado
+
+
+@app.get("/api/admin/profiling/{perfil_id}")
+async def descargar_perfil(perfil_id: int, format: str = "prof", sort: str = "cumulative",
+                           limit: int = Query(40, ge=1, le=500), username: str = Depends(get_current_username)):
+    perfil = perfilador.obtener(perfil_id)
+    if perfil is None:
+        raise HTTPException(status_code=404, detail=f"Perfil {perfil_id} no disponible en el worker {os.getpid()}")
+    if format == "text":
+        if sort not in ORDENES_PERFIL:
+            raise HTTPException(status_code=422, detail=f"sort debe ser uno de: {', '.join(ORDENES_PERFIL)}")
+        return PlainTextResponse(await asyncio.to_thread(perfil.texto, sort, limit))
+    if format != "prof":
+        raise HTTPException(status_code=422, detail="format debe ser prof o text")
+    return Response(
+        content=await asyncio.to_thread(perfil.prof),
+        media_type="application/octet-stream",
+        headers={"Content-Disposition": f'attachment; filename="perfil_{perfil_id}.prof"'},
+    )
+
+
 # ==============================================================================
 # SERVIR ARCHIVOS ESTÁTICOS DEL FRONTEND (Solo en producción/Docker)
 # ==============================================================================
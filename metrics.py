@@ -0,0 +1,252 @@
+# metrics.py
+"""Registro de métricas en memoria (contadores e histogramas) sin servicios externos.
+
+Los módulos declaran sus métricas sobre registro_metricas y las actualizan en
+el camino caliente (una búsqueda en un dict y una suma bajo un lock: se puede
+llamar desde el event loop o desde los hilos de analytics_db). /metrics las
+expone en el formato de texto de Prometheus (0.0.4).
+
+Con varios workers de gunicorn cada proceso tiene su propio registro. Si se
+define METRICS_DIR, cada worker vuelca una instantánea (metrics_<pid>.json)
+cada METRICS_FLUSH_S y /metrics suma la del worker que atiende (en vivo) con
+las de los demás, así cualquier worker responde con el total. Las
+instantáneas de workers ya terminados (su PID no existe) se borran al leerlas:
+el total baja como un reinicio de contadores, que rate()/increase() de
+Prometheus ya contemplan. Por eso METRICS_DIR debe ser local a la máquina
+(los PID solo tienen sentido en ella).
+"""
+import asyncio
+import bisect
+import glob
+import json
+import logging
+import os
+import threading
+from typing import Dict, List, Optional, Sequence, Tuple
+
+METRICS_DIR = os.environ.get("METRICS_DIR", "")
+METRICS_FLUSH_S = float(os.environ.get("METRICS_FLUSH_S", "15"))
+
+# Cubetas por defecto (segundos): de 0,5 ms a 10 s
+CUBETAS_LATENCIA = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class Counter:
+    tipo = "counter"
+
+    def __init__(self, nombre: str, ayuda: str, etiquetas: Sequence[str] = ()):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = tuple(etiquetas)
+        self._series: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def sumar(self, *valores: str, n: float = 1):
+        with self._lock:
+            self._series[valores] = self._series.get(valores, 0) + n
+
+    def instantanea(self) -> dict:
+        with self._lock:
+            series = [[list(clave), valor] for clave, valor in self._series.items()]
+        return {"tipo": self.tipo, "ayuda": self.ayuda, "etiquetas": list(self.etiquetas), "series": series}
+
+
+class Histogram:
+    tipo = "histogram"
+
+    def __init__(self, nombre: str, ayuda: str, etiquetas: Sequence[str] = (),
+                 cubetas: Sequence[float] = CUBETAS_LATENCIA):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = tuple(etiquetas)
+        self.cubetas = tuple(sorted(cubetas))
+        # etiquetas -> [conteos por cubeta (no acumulados, el último es +Inf), suma]
+        self._series: Dict[Tuple[str, ...], list] = {}
+        self._lock = threading.Lock()
+
+    def observar(self, valor: float, *valores: str):
+        indice = bisect.bisect_left(self.cubetas, valor)
+        with self._lock:
+            serie = self._series.get(valores)
+            if serie is None:
+                serie = self._series[valores] = [[0] * (len(self.cubetas) + 1), 0.0]
+            serie[0][indice] += 1
+            serie[1] += valor
+
+    def instantanea(self) -> dict:
+        with self._lock:
+            series = [[list(clave), [list(conteos), suma]] for clave, (conteos, suma) in self._series.items()]
+        return {
+            "tipo": self.tipo, "ayuda": self.ayuda, "etiquetas": list(self.etiquetas),
+            "cubetas": list(self.cubetas), "series": series,
+        }
+
+
+def _escapar(valor: str, comillas: bool = True) -> str:
+    texto = str(valor).replace("\\", "\\\\").replace("\n", "\\n")
+    # En HELP solo se escapan \ y saltos de línea
+    return texto.replace('"', '\\"') if comillas else texto
+
+
+def _etiquetas(nombres: Sequence[str], valores: Sequence[str], extra: str = "") -> str:
+    pares = [f'{n}="{_escapar(v)}"' for n, v in zip(nombres, valores)]
+    if extra:
+        pares.append(extra)
+    return "{" + ",".join(pares) + "}" if pares else ""
+
+
+def _numero(valor: float) -> str:
+    return str(int(valor)) if float(valor).is_integer() else repr(float(valor))
+
+
+def combinar(instantaneas: List[dict]) -> Dict[str, dict]:
+    """Suma las instantáneas de varios procesos (mismas métricas, series por etiquetas)."""
+    total: Dict[str, dict] = {}
+    for instantanea in instantaneas:
+        for nombre, metrica in instantanea.items():
+            destino = total.setdefault(nombre, {**metrica, "series": {}})
+            for clave, valor in metrica["series"]:
+                clave = tuple(clave)
+                previo = destino["series"].get(clave)
+                if metrica["tipo"] == "counter":
+                    destino["series"][clave] = (previo or 0) + valor
+                elif previo is None:
+                    destino["series"][clave] = [list(valor[0]), valor[1]]
+                elif len(previo[0]) == len(valor[0]):
+                    previo[0] = [a + b for a, b in zip(previo[0], valor[0])]
+                    previo[1] += valor[1]
+    return total
+
+
+def formato_texto(metricas: Dict[str, dict]) -> str:
+    lineas = []
+    for nombre, metrica in sorted(metricas.items()):
+        lineas.append(f"# HELP {nombre} {_escapar(metrica['ayuda'], comillas=False)}")
+        lineas.append(f"# TYPE {nombre} {metrica['tipo']}")
+        etiquetas = metrica["etiquetas"]
+        for clave, valor in sorted(metrica["series"].items()):
+            if metrica["tipo"] == "counter":
+                lineas.append(f"{nombre}{_etiquetas(etiquetas, clave)} {_numero(valor)}")
+                continue
+            conteos, suma = valor
+            acumulado = 0
+            for limite, conteo in zip(list(metrica["cubetas"]) + ["+Inf"], conteos):
+                acumulado += conteo
+                le = 'le="' + (limite if limite == "+Inf" else _numero(limite)) + '"'
+                lineas.append(f"{nombre}_bucket{_etiquetas(etiquetas, clave, le)} {acumulado}")
+            lineas.append(f"{nombre}_sum{_etiquetas(etiquetas, clave)} {_numero(suma)}")
+            lineas.append(f"{nombre}_count{_etiquetas(etiquetas, clave)} {acumulado}")
+    return "\n".join(lineas) + "\n"
+
+
+def proceso_vivo(ruta: str) -> bool:
+    """Si el worker de metrics_<pid>.json sigue corriendo."""
+    try:
+        pid = int(os.path.basename(ruta)[len("metrics_"):-len(".json")])
+    except ValueError:
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # Existe, pero es de otro usuario
+        pass
+    return True
+
+
+class MetricsRegistry:
+    def __init__(self, directorio: str = METRICS_DIR, intervalo: float = METRICS_FLUSH_S):
+        self.directorio = directorio
+        self.intervalo = intervalo
+        self._metricas: Dict[str, object] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def _registrar(self, metrica):
+        existente = self._metricas.get(metrica.nombre)
+        if existente is not None:
+            return existente
+        self._metricas[metrica.nombre] = metrica
+        return metrica
+
+    def contador(self, nombre: str, ayuda: str, etiquetas: Sequence[str] = ()) -> Counter:
+        return self._registrar(Counter(nombre, ayuda, etiquetas))
+
+    def histograma(self, nombre: str, ayuda: str, etiquetas: Sequence[str] = (),
+                   cubetas: Sequence[float] = CUBETAS_LATENCIA) -> Histogram:
+        return self._registrar(Histogram(nombre, ayuda, etiquetas, cubetas))
+
+    def instantanea(self) -> dict:
+        return {nombre: metrica.instantanea() for nombre, metrica in self._metricas.items()}
+
+    # --- VOLCADO ENTRE WORKERS (METRICS_DIR) ---
+
+    def _archivo_propio(self) -> str:
+        return os.path.join(self.directorio, f"metrics_{os.getpid()}.json")
+
+    def volcar(self):
+        if not self.directorio:
+            return
+        os.makedirs(self.directorio, exist_ok=True)
+        destino = self._archivo_propio()
+        temporal = f"{destino}.tmp"
+        with open(temporal, "w") as archivo:
+            json.dump(self.instantanea(), archivo)
+        os.replace(temporal, destino)
+
+    def _instantaneas_ajenas(self) -> List[dict]:
+        propio = self._archivo_propio()
+        instantaneas = []
+        for ruta in glob.glob(os.path.join(self.directorio, "metrics_*.json")):
+            if ruta == propio:
+                continue
+            if not proceso_vivo(ruta):
+                try:
+                    os.remove(ruta)
+                except FileNotFoundError:
+                    # Otro worker la borró entretanto
+                    pass
+                continue
+            try:
+                with open(ruta) as archivo:
+                    instantaneas.append(json.load(archivo))
+            except (OSError, ValueError) as e:
+                logging.warning(f"⚠️ [Métricas] Instantánea ilegible {ruta}: {e}")
+        return instantaneas
+
+    def exponer(self) -> str:
+        """Texto para /metrics: este proceso más los demás workers (si hay METRICS_DIR)."""
+        instantaneas = [self.instantanea()]
+        if self.directorio:
+            instantaneas.extend(self._instantaneas_ajenas())
+        return formato_texto(combinar(instantaneas))
+
+    def start(self):
+        if not self.directorio or self.intervalo <= 0:
+            return
+        self._task = asyncio.create_task(self._run(), name="metrics-flush")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        try:
+            await asyncio.to_thread(self.volcar)
+        except OSError as e:
+            logging.error(f"❌ [Métricas] Error al volcar instantánea: {e}")
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.intervalo)
+            try:
+                await asyncio.to_thread(self.volcar)
+            except OSError as e:
+                logging.error(f"❌ [Métricas] Error al volcar instantánea: {e}")
+
+
+registro_metricas = MetricsRegistry()
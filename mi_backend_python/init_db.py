@@ -1,13 +1,372 @@
 
+import calendar
+import os
 import sqlite3
 import logging
+import time
+
+# Filas por transacción en las migraciones de datos
+LOTE_MIGRACION = 5000
+# Espera máxima por el bloqueo de escritura: con varios workers arrancando a la vez,
+# uno puede estar creando índices o migrando datos de una base grande
+MIGRATION_TIMEOUT_S = float(os.environ.get("ANALYTICS_MIGRATION_TIMEOUT_S", "600"))
+
+
+# --- PARTICIONES DE EVENTS ---
+# Desde la migración 4 los eventos viven en una tabla por mes UTC de created_at
+# (events_YYYY_MM). El event_id es global y creciente entre particiones: cada
+# partición nueva arranca su sqlite_sequence en el máximo vigente.
+GLOB_PARTICIONES = "events_[0-9][0-9][0-9][0-9]_[0-9][0-9]"
+
+
+def mes_de(epoch: int) -> str:
+    return time.strftime("%Y_%m", time.gmtime(epoch))
+
+
+def tabla_particion(mes: str) -> str:
+    return f"events_{mes}"
+
+
+def limites_mes(mes: str):
+    """(epoch inicial, epoch final exclusivo) del mes YYYY_MM."""
+    anio, numero = int(mes[:4]), int(mes[5:])
+    siguiente = (anio + 1, 1) if numero == 12 else (anio, numero + 1)
+    return calendar.timegm((anio, numero, 1, 0, 0, 0)), calendar.timegm(siguiente + (1, 0, 0, 0))
+
+
+def tabla_existe(conn, tabla: str) -> bool:
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (tabla,)).fetchone() is not None
+
+
+def crear_particion_eventos(conn, mes: str) -> str:
+    """Crea la partición del mes si no existe; devuelve el nombre de la tabla."""
+    tabla = tabla_particion(mes)
+    if tabla_existe(conn, tabla):
+        return tabla
+    conn.execute(f"""
+        CREATE TABLE {tabla} (
+            event_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            session_id TEXT NOT NULL,
+            event_type TEXT NOT NULL,
+            event_data TEXT,
+            created_at INTEGER NOT NULL,
+            day TEXT GENERATED ALWAYS AS (date(created_at, 'unixepoch')) VIRTUAL,
+            FOREIGN KEY (session_id) REFERENCES sessions(session_id)
+        )
+    """)
+    conn.execute(f"CREATE INDEX idx_{tabla}_created ON {tabla}(created_at, event_type, session_id)")
+    # Sin esto, si se archivan las particiones anteriores los event_id volverían a empezar
+    conn.execute(
+        "INSERT INTO sqlite_sequence (name, seq) "
+        "SELECT ?, COALESCE(MAX(seq), 0) FROM sqlite_sequence WHERE name GLOB ?",
+        (tabla, GLOB_PARTICIONES),
+    )
+    return tabla
+
+
+def convertir_timestamps(conn):
+    """Migración 3: created_at/last_activity de texto ISO a epoch UTC entero, en el lugar.
+
+    Recorre cada tabla por tramos de rowid y confirma cada tramo, así el
+    bloqueo de escritura se libera entre lotes. Es reanudable: solo toca
+    valores que siguen siendo texto, y las columnas `day` se agregan al final.
+    """
+    conversiones = [("sessions", ("created_at", "last_activity")), ("events", ("created_at",))]
+    for tabla, columnas in conversiones:
+        # Un worker que arrancó a la vez pudo completar esta migración y la 4 (que elimina events)
+        if conn.execute("PRAGMA user_version").fetchone()[0] >= 3:
+            return
+        asignaciones = ", ".join(
+            # datetime.now().isoformat() es hora local; CURRENT_TIMESTAMP ('YYYY-MM-DD HH:MM:SS') ya es UTC
+            f"""{col} = CASE WHEN typeof({col}) != 'text' THEN {col}
+                WHEN {col} LIKE '____-__-__ __:__:__' THEN CAST(strftime('%s', {col}) AS INTEGER)
+                ELSE COALESCE(CAST(strftime('%s', {col}, 'utc') AS INTEGER), {col}) END"""
+            for col in columnas
+        )
+        pendientes = " OR ".join(f"typeof({col}) = 'text'" for col in columnas)
+        desde, hasta = conn.execute(f"SELECT MIN(rowid), MAX(rowid) FROM {tabla}").fetchone()
+        if desde is None:
+            continue
+        convertidas = 0
+        for inicio in range(desde, hasta + 1, LOTE_MIGRACION):
+            convertidas += conn.execute(
+                f"UPDATE {tabla} SET {asignaciones} WHERE rowid >= ? AND rowid < ? AND ({pendientes})",
+                (inicio, inicio + LOTE_MIGRACION),
+            ).rowcount
+            conn.execute("COMMIT")
+            conn.execute("BEGIN IMMEDIATE")
+            if conn.execute("PRAGMA user_version").fetchone()[0] >= 3:
+                return
+        if convertidas:
+            logging.info(f"🔧 {tabla}: {convertidas} filas convertidas a epoch")
+
+    # Otro worker pudo terminar la migración mientras se soltaba el bloqueo entre lotes
+    for tabla in ("sessions", "events"):
+        if "day" not in {r[1] for r in conn.execute(f"PRAGMA table_xinfo({tabla})")}:
+            # VIRTUAL: ALTER TABLE no admite agregar columnas STORED; los índices sí la materializan
+            conn.execute(
+                f"ALTER TABLE {tabla} ADD COLUMN day TEXT GENERATED ALWAYS AS (date(created_at, 'unixepoch')) VIRTUAL"
+            )
+
+
+def particionar_eventos(conn):
+    """Migración 4: mueve events a particiones mensuales por lotes de rowid y elimina la tabla.
+
+    Cada lote se copia (conservando event_id) y se borra de events en la misma
+    transacción, así que es reanudable. Filas sin created_at válido se descartan.
+    Entre lotes se suelta el bloqueo: si otro worker que arrancó a la vez
+    termina la migración (y elimina events) mientras tanto, se deja en sus manos.
+    """
+    if tabla_existe(conn, "events"):
+        movidas = descartadas = 0
+        while True:
+            if not tabla_existe(conn, "events"):
+                logging.info("🔧 events: otro worker completó la partición")
+                return
+            desde = conn.execute("SELECT MIN(rowid) FROM events").fetchone()[0]
+            if desde is None:
+                break
+            rango = (desde, desde + LOTE_MIGRACION)
+            meses = conn.execute(
+                "SELECT DISTINCT strftime('%Y_%m', created_at, 'unixepoch') FROM events "
+                "WHERE rowid >= ? AND rowid < ? AND typeof(created_at) = 'integer'",
+                rango,
+            ).fetchall()
+            for (mes,) in meses:
+                tabla = crear_particion_eventos(conn, mes)
+                movidas += conn.execute(f"""
+                    INSERT INTO {tabla} (event_id, session_id, event_type, event_data, created_at)
+                    SELECT event_id, session_id, event_type, event_data, created_at FROM events
+                    WHERE rowid >= ? AND rowid < ? AND typeof(created_at) = 'integer'
+                      AND created_at >= ? AND created_at < ?
+                """, rango + limites_mes(mes)).rowcount
+            descartadas += conn.execute("DELETE FROM events WHERE rowid >= ? AND rowid < ?", rango).rowcount
+            conn.execute("COMMIT")
+            conn.execute("BEGIN IMMEDIATE")
+        descartadas -= movidas
+        logging.info(f"🔧 events: {movidas} eventos movidos a particiones mensuales"
+                     + (f" ({descartadas} sin fecha válida descartados)" if descartadas else ""))
+        conn.execute("DROP TABLE events")
+    crear_particion_eventos(conn, mes_de(int(time.time())))
+
+
+# --- CONTADORES DE SALUD ---
+# /api/analytics/health lee contadores mantenidos al escribir (migración 5) en
+# lugar de hacer COUNT(*) sobre system_logs y sessions:
+#   ('errores', epoch // CUBETA_ERRORES_S)  ERROR/CRITICAL de cada cubeta de 5 minutos
+#   ('sesiones', epoch // 86400)            sesiones creadas en cada día UTC
+CUBETA_ERRORES_S = 300
+NIVELES_ERROR = ("ERROR", "CRITICAL")
+
+
+def recalcular_contadores_salud(conn):
+    """Reconstruye contadores_salud desde system_logs (últimas 24 h) y sessions (hoy)."""
+    ahora = int(time.time())
+    conn.execute("DELETE FROM contadores_salud")
+    conn.execute("""
+        INSERT INTO contadores_salud (clave, cubeta, n)
+        SELECT 'sesiones', created_at / 86400, COUNT(*) FROM sessions
+        WHERE typeof(created_at) = 'integer' AND created_at >= ?
+        GROUP BY 2
+    """, (ahora - ahora % 86400,))
+    # Timestamps de texto UTC; los que no se pueden interpretar quedan fuera (NULL)
+    conn.execute(f"""
+        INSERT INTO contadores_salud (clave, cubeta, n)
+        SELECT 'errores', CAST(strftime('%s', timestamp) AS INTEGER) / {CUBETA_ERRORES_S}, COUNT(*) FROM system_logs
+        WHERE level IN ({", ".join("?" * len(NIVELES_ERROR))}) AND CAST(strftime('%s', timestamp) AS INTEGER) >= ?
+        GROUP BY 2
+    """, NIVELES_ERROR + (ahora - 24 * 3600,))
+
+
+def crear_contadores_salud(conn):
+    """Migración 5: contadores de /health e índices de la paginación de /logs."""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS contadores_salud (
+            clave TEXT NOT NULL,
+            cubeta INTEGER NOT NULL,
+            n INTEGER NOT NULL,
+            PRIMARY KEY (clave, cubeta)
+        ) WITHOUT ROWID
+    """)
+    # /logs pagina por id descendente (keyset) con filtros opcionales de nivel y módulo
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_system_logs_level ON system_logs(level, id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_system_logs_module ON system_logs(module, id)")
+    recalcular_contadores_salud(conn)
+
+
+# --- CUBETAS DE USUARIOS ACTIVOS ---
+# Anillo compartido por todos los workers (migración 7): presencia_cubetas cuenta
+# las sesiones por cubeta de ANCHO_CUBETA_PRESENCIA_S segundos de su last_activity
+# y por país. Lo mantienen triggers sobre sessions, así que cada sesión cuenta una
+# sola vez en la cubeta de su última actividad, la registre el worker que la registre.
+ANCHO_CUBETA_PRESENCIA_S = 10
+
+
+def _sumar_cubeta(epoch: str, pais: str, n: int) -> str:
+    return f"""
+        INSERT INTO presencia_cubetas (epoca, country_code, n)
+        SELECT {epoch} / {ANCHO_CUBETA_PRESENCIA_S}, COALESCE({pais}, ''), {n}
+        WHERE typeof({epoch}) = 'integer'
+        ON CONFLICT(epoca, country_code) DO UPDATE SET n = n + excluded.n;"""
+
+
+def crear_cubetas_presencia(conn):
+    """Migración 7: tabla de cubetas de activos, sus triggers y la carga de la última hora."""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS presencia_cubetas (
+            epoca INTEGER NOT NULL,
+            country_code TEXT NOT NULL,
+            n INTEGER NOT NULL,
+            PRIMARY KEY (epoca, country_code)
+        ) WITHOUT ROWID
+    """)
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS presencia_alta AFTER INSERT ON sessions BEGIN
+            {_sumar_cubeta("NEW.last_activity", "NEW.country_code", 1)}
+        END
+    """)
+    # Solo cuando cambia la cubeta o el país: la mayoría de los heartbeats no la mueven
+    mueve = (
+        f"(OLD.last_activity / {ANCHO_CUBETA_PRESENCIA_S} IS NOT NEW.last_activity / {ANCHO_CUBETA_PRESENCIA_S} "
+        "OR OLD.country_code IS NOT NEW.country_code)"
+    )
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS presencia_cambio AFTER UPDATE OF last_activity, country_code ON sessions
+        WHEN {mueve} BEGIN
+            {_sumar_cubeta("OLD.last_activity", "OLD.country_code", -1)}
+            {_sumar_cubeta("NEW.last_activity", "NEW.country_code", 1)}
+        END
+    """)
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS presencia_baja AFTER DELETE ON sessions BEGIN
+            {_sumar_cubeta("OLD.last_activity", "OLD.country_code", -1)}
+        END
+    """)
+    # Las cubetas más viejas que la ventana no se leen: basta con la última hora
+    conn.execute(f"""
+        INSERT INTO presencia_cubetas (epoca, country_code, n)
+        SELECT last_activity / {ANCHO_CUBETA_PRESENCIA_S}, COALESCE(country_code, ''), COUNT(*) FROM sessions
+        WHERE typeof(last_activity) = 'integer' AND last_activity >= ?
+        GROUP BY 1, 2
+    """, (int(time.time()) - 3600,))
+
+
+# --- SESIONES DEL FUNNEL ---
+# Pasos del funnel: form_start -> form_submit -> questionnaire_start -> confirmation_page_viewed
+PASOS_FUNNEL = ("form_start", "form_submit", "questionnaire_start", "confirmation_page_viewed")
+
+
+def crear_rollup_funnel(conn):
+    """Migración 8: (día, paso, sesión) distintos del funnel, cargados desde las particiones."""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS rollup_funnel_sesiones (
+            day TEXT NOT NULL,
+            event_type TEXT NOT NULL,
+            session_id TEXT NOT NULL,
+            PRIMARY KEY (day, event_type, session_id)
+        ) WITHOUT ROWID
+    """)
+    marcadores = ",".join("?" * len(PASOS_FUNNEL))
+    for (tabla,) in conn.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'table' AND name GLOB ?", (GLOB_PARTICIONES,)
+    ).fetchall():
+        conn.execute(f"""
+            INSERT OR IGNORE INTO rollup_funnel_sesiones (day, event_type, session_id)
+            SELECT DISTINCT day, event_type, session_id FROM {tabla} WHERE event_type IN ({marcadores})
+        """, PASOS_FUNNEL)
+
+
+# --- MIGRACIONES DE ESQUEMA ---
+# Lista ordenada de (versión, descripción, sentencias). PRAGMA user_version guarda
+# la última versión aplicada, así que cada migración corre una sola vez por base.
+# Las sentencias pueden ser una función fn(conn) para migraciones de datos por lotes.
+# Para cambiar el esquema se agrega una entrada al final; nunca se editan las ya publicadas.
+MIGRACIONES = [
+    (1, "Índices compuestos para las consultas del dashboard", [
+        # KPIs, tráfico diario, devices, channels y geo filtran sessions por created_at;
+        # is_converted y conversion_amount incluidos para que KPIs/tráfico no lean la tabla
+        "CREATE INDEX IF NOT EXISTS idx_sessions_created ON sessions(created_at, is_converted, conversion_amount)",
+        # Funnel y drop-off por pregunta: event_type IN (...) AND created_at BETWEEN,
+        # COUNT(DISTINCT session_id) resuelto desde el propio índice
+        "CREATE INDEX IF NOT EXISTS idx_events_type_created ON events(event_type, created_at, session_id)",
+    ]),
+    (2, "Rollups diarios del dashboard (ver analytics_rollup.py)", [
+        """CREATE TABLE IF NOT EXISTS rollup_sesiones_diarias (
+            day TEXT NOT NULL,
+            country_code TEXT,
+            country TEXT,
+            device_type TEXT,
+            utm_source TEXT,
+            sessions INTEGER NOT NULL,
+            conversions INTEGER NOT NULL,
+            conversion_amount REAL NOT NULL
+        )""",
+        "CREATE INDEX IF NOT EXISTS idx_rollup_sesiones_day ON rollup_sesiones_diarias(day)",
+        """CREATE TABLE IF NOT EXISTS rollup_eventos_diarios (
+            day TEXT NOT NULL,
+            event_type TEXT NOT NULL,
+            events INTEGER NOT NULL,
+            sessions INTEGER NOT NULL,
+            PRIMARY KEY (day, event_type)
+        )""",
+        # Marca de agua (último event_id compactado) y corte (días < corte vienen de rollups)
+        """CREATE TABLE IF NOT EXISTS rollup_estado (
+            clave TEXT PRIMARY KEY,
+            valor
+        )""",
+        # El compactor y el tramo crudo (hoy) agregan events por rango de created_at;
+        # el funnel ya no filtra por event_type sobre todo el rango
+        "CREATE INDEX IF NOT EXISTS idx_events_created ON events(created_at, event_type, session_id)",
+        "DROP INDEX IF EXISTS idx_events_type_created",
+    ]),
+    (3, "Timestamps de sessions/events como epoch UTC entero con columna day", convertir_timestamps),
+    (4, "events particionada por mes (ver analytics_partitions.py)", particionar_eventos),
+    (5, "Contadores de salud e índices de system_logs (ver analytics_logs.py)", crear_contadores_salud),
+    (6, "Generación de reinicio de datos para la caché de respuestas (ver analytics_cache.py)", [
+        # /reset la incrementa: invalida la caché de todos los workers, no solo la del que lo atiende
+        """CREATE TABLE IF NOT EXISTS generacion_datos (
+            clave TEXT PRIMARY KEY,
+            valor INTEGER NOT NULL
+        ) WITHOUT ROWID""",
+        "INSERT OR IGNORE INTO generacion_datos (clave, valor) VALUES ('reinicios', 0)",
+    ]),
+    (7, "Cubetas de usuarios activos compartidas entre workers (ver analytics_presence.py)", crear_cubetas_presencia),
+    (8, "Sesiones distintas del funnel por día para rollups exactos (ver analytics_rollup.py)", crear_rollup_funnel),
+]
+
+
+def migrar_db(conn):
+    """Aplica las migraciones pendientes; devuelve la versión final del esquema."""
+    conn.isolation_level = None
+    for numero, descripcion, sentencias in MIGRACIONES:
+        # BEGIN IMMEDIATE serializa a los workers que arrancan a la vez
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            version = conn.execute("PRAGMA user_version").fetchone()[0]
+            if numero > version:
+                logging.info(f"🔧 Migración {numero}: {descripcion}")
+                if callable(sentencias):
+                    sentencias(conn)
+                else:
+                    for sentencia in sentencias:
+                        conn.execute(sentencia)
+                conn.execute(f"PRAGMA user_version = {numero}")
+                version = numero
+            conn.execute("COMMIT")
+        except Exception:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+    return version
+
 
 def init_db(db_path="analytics.db"):
     """
-    Inicializa la base de datos de Analytics con tablas vacías.
+    Inicializa la base de datos de Analytics con tablas vacías y aplica las
+    migraciones pendientes. Es idempotente: puede ejecutarse sobre una base existente.
     NO inserta datos de prueba.
     """
-    conn = sqlite3.connect(db_path)
+    conn = sqlite3.connect(db_path, timeout=MIGRATION_TIMEOUT_S)
     cursor = conn.cursor()
     
     logging.info(f"🔨 Inicializando esquema de base de datos en {db_path}...")
@@ -35,17 +394,18 @@ def init_db(db_path="analytics.db"):
     cursor.execute("CREATE INDEX IF NOT EXISTS idx_sessions_converted ON sessions(is_converted)")
     cursor.execute("CREATE INDEX IF NOT EXISTS idx_sessions_activity ON sessions(last_activity)")
     
-    # 2. Tabla EVENTS
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS events (
-            event_id INTEGER PRIMARY KEY AUTOINCREMENT,
-            session_id TEXT NOT NULL,
-            event_type TEXT NOT NULL,
-            event_data TEXT,
-            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (session_id) REFERENCES sessions(session_id)
-        )
-    """)
+    # 2. Tabla EVENTS (solo bases previas a la migración 4, que la reparte en particiones mensuales)
+    if cursor.execute("PRAGMA user_version").fetchone()[0] < 4:
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS events (
+                event_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                session_id TEXT NOT NULL,
+                event_type TEXT NOT NULL,
+                event_data TEXT,
+                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (session_id) REFERENCES sessions(session_id)
+            )
+        """)
     
     # 3. Tabla SYSTEM_LOGS
     cursor.execute("""
@@ -68,8 +428,9 @@ def init_db(db_path="analytics.db"):
     """)
     
     conn.commit()
+    version = migrar_db(conn)
     conn.close()
-    logging.info("✅ Base de datos inicializada (VACÍA).")
+    logging.info(f"✅ Base de datos inicializada (esquema v{version}).")
 
 if __name__ == "__main__":
     init_db()
@@ -5,7 +5,12 @@ Esto permite visualizar el dashboard como se vería en producción.
 import sqlite3
 import uuid
 import random
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
+
+try:
+    from mi_backend_python.init_db import GLOB_PARTICIONES, crear_particion_eventos, mes_de, recalcular_contadores_salud
+except ImportError:
+    from init_db import GLOB_PARTICIONES, crear_particion_eventos, mes_de, recalcular_contadores_salud
 
 # Configuración
 ANALYTICS_DB_PATH = "analytics.db"
@@ -67,6 +72,14 @@ def random_date(days_back):
     )
     return now - delta
 
+def insertar_evento(cursor, session_id, event_type, event_data, created_at):
+    """Inserta en la partición mensual de events, con el siguiente event_id global."""
+    tabla = crear_particion_eventos(cursor.connection, mes_de(created_at))
+    cursor.execute(f'''
+        INSERT INTO {tabla} (event_id, session_id, event_type, event_data, created_at)
+        VALUES ((SELECT COALESCE(MAX(seq), 0) + 1 FROM sqlite_sequence WHERE name GLOB ?), ?, ?, ?, ?)
+    ''', (GLOB_PARTICIONES, session_id, event_type, event_data, created_at))
+
 def weighted_choice(choices_with_weights):
     """Selección ponderada."""
     choices = [c[0] for c in choices_with_weights]
@@ -78,7 +91,15 @@ def main():
     cursor = conn.cursor()
     
     print("🗑️  Limpiando datos anteriores...")
-    cursor.execute("DELETE FROM events")
+    for (tabla,) in cursor.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'table' AND name GLOB ?", (GLOB_PARTICIONES,)
+    ).fetchall():
+        cursor.execute(f"DROP TABLE {tabla}")
+    # Los rollups y su marca de agua se recalculan desde cero con los eventos nuevos
+    cursor.execute("DELETE FROM rollup_sesiones_diarias")
+    cursor.execute("DELETE FROM rollup_eventos_diarios")
+    cursor.execute("DELETE FROM rollup_funnel_sesiones")
+    cursor.execute("DELETE FROM rollup_estado")
     cursor.execute("DELETE FROM sessions")
     cursor.execute("DELETE FROM system_logs WHERE message LIKE '%ejemplo%' OR message LIKE '%seed%'")
     conn.commit()
@@ -124,12 +145,12 @@ def main():
             VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
         ''', (
             session_id,
-            created_at.isoformat(),
+            int(created_at.timestamp()),
             f"{device_type} device",
             f"Mozilla/5.0 ({device_type})",
             is_converted,
             conversion_amount,
-            last_activity.isoformat(),
+            int(last_activity.timestamp()),
             country_data,
             country_code,
             device_type,
@@ -140,26 +161,17 @@ def main():
         event_time = created_at
         
         # Evento: form_start (todos)
-        cursor.execute('''
-            INSERT INTO events (session_id, event_type, event_data, created_at)
-            VALUES (?, ?, ?, ?)
-        ''', (session_id, "form_start", None, event_time.isoformat()))
+        insertar_evento(cursor, session_id, "form_start", None, int(event_time.timestamp()))
         
         # Evento: form_submit (85% de los que inician)
         if random.random() < 0.85:
             event_time += timedelta(seconds=random.randint(30, 180))
-            cursor.execute('''
-                INSERT INTO events (session_id, event_type, event_data, created_at)
-                VALUES (?, ?, ?, ?)
-            ''', (session_id, "form_submit", None, event_time.isoformat()))
+            insertar_evento(cursor, session_id, "form_submit", None, int(event_time.timestamp()))
             
             # Evento: questionnaire_start (90% de los que envían form)
             if random.random() < 0.90:
                 event_time += timedelta(seconds=random.randint(5, 30))
-                cursor.execute('''
-                    INSERT INTO events (session_id, event_type, event_data, created_at)
-                    VALUES (?, ?, ?, ?)
-                ''', (session_id, "questionnaire_start", None, event_time.isoformat()))
+                insertar_evento(cursor, session_id, "questionnaire_start", None, int(event_time.timestamp()))
                 
                 # Eventos de preguntas
                 num_questions = random.randint(5, 20) if is_converted else random.randint(1, 15)
@@ -169,28 +181,19 @@ def main():
                     event_time += timedelta(seconds=random.randint(3, 15))
                     
                     # question_viewed
-                    cursor.execute('''
-                        INSERT INTO events (session_id, event_type, event_data, created_at)
-                        VALUES (?, ?, ?, ?)
-                    ''', (session_id, f"question_viewed_{q_id}", None, event_time.isoformat()))
+                    insertar_evento(cursor, session_id, f"question_viewed_{q_id}", None, int(event_time.timestamp()))
                     
                     # question_answered (algunos abandonan en ciertas preguntas)
                     # Pregunta 7 y 12 son las "killer questions"
                     abandon_rate = 0.15 if q_id in ["q7", "q12"] else 0.05
                     if random.random() > abandon_rate or is_converted:
                         event_time += timedelta(seconds=random.randint(2, 10))
-                        cursor.execute('''
-                            INSERT INTO events (session_id, event_type, event_data, created_at)
-                            VALUES (?, ?, ?, ?)
-                        ''', (session_id, f"question_answered_{q_id}", None, event_time.isoformat()))
+                        insertar_evento(cursor, session_id, f"question_answered_{q_id}", None, int(event_time.timestamp()))
                 
                 # Evento: confirmation_page_viewed (solo convertidos)
                 if is_converted:
                     event_time += timedelta(seconds=random.randint(5, 20))
-                    cursor.execute('''
-                        INSERT INTO events (session_id, event_type, event_data, created_at)
-                        VALUES (?, ?, ?, ?)
-                    ''', (session_id, "confirmation_page_viewed", None, event_time.isoformat()))
+                    insertar_evento(cursor, session_id, "confirmation_page_viewed", None, int(event_time.timestamp()))
         
         sessions_created += 1
         if sessions_created % 25 == 0:
@@ -214,7 +217,7 @@ def main():
         cursor.execute('''
             INSERT INTO system_logs (timestamp, level, message, module)
             VALUES (?, ?, ?, ?)
-        ''', (log_time.isoformat(), level, message, module))
+        ''', (log_time.astimezone(timezone.utc).strftime("%Y-%m-%d %H:%M:%S"), level, message, module))
     
     # Errores RECIENTES (últimas 24 horas) para activar WARNING/CRITICAL
     # NOTA: Comentado para que el dashboard muestre HEALTHY por defecto
@@ -236,12 +239,14 @@ def main():
         cursor.execute('''
             INSERT INTO system_logs (timestamp, level, message, module)
             VALUES (?, ?, ?, ?)
-        ''', (log_time.isoformat(), level, message, module))
+        ''', (log_time.astimezone(timezone.utc).strftime("%Y-%m-%d %H:%M:%S"), level, message, module))
     
     print(f"   ✓ {len(historical_logs)} logs históricos + {len(recent_errors)} errores recientes")
     """
     print(f"   ✓ {len(historical_logs)} logs históricos (sin errores de prueba)")
     
+    # errors_24h y sessions_today de /health salen de contadores, no de COUNT(*)
+    recalcular_contadores_salud(conn)
     conn.commit()
     conn.close()
     
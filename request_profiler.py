@@ -0,0 +1,184 @@
+# request_profiler.py
+"""Perfilado de requests bajo demanda, activable en caliente.
+
+ProfilingMiddleware envuelve la app con cProfile para una fracción muestreada
+de los requests (PROFILING_SAMPLE_RATE) o cuando el cliente envía
+X-Profile: <PROFILING_TOKEN>. Está inactivo salvo PROFILING_ENABLED=true o
+hasta que se active desde el endpoint de administración; inactivo, su costo
+es una comparación por request.
+
+Cada perfil cubre desde que llega el request hasta el último byte de la
+respuesta (las BackgroundTasks, como el envío a Make.com, quedan fuera) y se
+guarda en memoria: solo se conservan los últimos PROFILING_MAX_PROFILES por
+worker. La respuesta perfilada lleva X-Profile-Id para descargarlo como .prof
+(pstats, compatible con snakeviz) o como resumen de texto.
+
+Limitaciones de cProfile: mide el hilo del event loop, así que durante el
+request también registra lo que hagan otras corrutinas del mismo worker, y no
+ve el trabajo de los hilos de analytics_db (aparece como espera en
+run_in_executor). Por eso se perfila un solo request a la vez por worker.
+"""
+import cProfile
+import io
+import itertools
+import marshal
+import os
+import pstats
+import random
+import secrets
+import threading
+import time
+from collections import deque
+from typing import List, NamedTuple, Optional
+
+from log_pipeline import request_id
+
+PROFILING_ENABLED = os.environ.get("PROFILING_ENABLED", "false").lower() in ("1", "true", "yes")
+PROFILING_SAMPLE_RATE = float(os.environ.get("PROFILING_SAMPLE_RATE", "0"))
+PROFILING_TOKEN = os.environ.get("PROFILING_TOKEN", "")
+PROFILING_MAX_PROFILES = int(os.environ.get("PROFILING_MAX_PROFILES", "20"))
+# Rutas que nunca se perfilan: streams largos (SSE del dashboard) y la propia administración
+PROFILING_EXCLUDE = tuple(
+    r.strip() for r in os.environ.get("PROFILING_EXCLUDE", "/api/analytics/live,/api/admin/profiling").split(",") if r.strip()
+)
+
+PROFILE_HEADER = "x-profile"
+PROFILE_ID_HEADER = "x-profile-id"
+ORDENES = ("cumulative", "tottime", "calls")
+
+
+class PerfilRequest(NamedTuple):
+    id: int
+    creado: float
+    metodo: str
+    ruta: str
+    status: Optional[int]
+    duracion_ms: float
+    request_id: Optional[str]
+    motivo: str
+    perfil: cProfile.Profile
+
+    def resumen(self) -> dict:
+        datos = self._asdict()
+        del datos["perfil"]
+        datos["pid"] = os.getpid()
+        return datos
+
+    def prof(self) -> bytes:
+        """Mismo contenido que Profile.dump_stats() (pstats / snakeviz)."""
+        self.perfil.create_stats()
+        return marshal.dumps(self.perfil.stats)
+
+    def texto(self, orden: str = "cumulative", limite: int = 40) -> str:
+        salida = io.StringIO()
+        estadisticas = pstats.Stats(self.perfil, stream=salida)
+        estadisticas.strip_dirs().sort_stats(orden).print_stats(limite)
+        return salida.getvalue()
+
+
+class RequestProfiler:
+    """Decide qué requests perfilar y guarda los últimos perfiles."""
+
+    def __init__(
+        self,
+        activo: bool = PROFILING_ENABLED,
+        tasa: float = PROFILING_SAMPLE_RATE,
+        token: str = PROFILING_TOKEN,
+        capacidad: int = PROFILING_MAX_PROFILES,
+    ):
+        self.activo = activo
+        self.tasa = tasa
+        self.token = token
+        self._perfiles: deque = deque(maxlen=capacidad)
+        self._ids = itertools.count(1)
+        # Un solo perfil a la vez: cProfile es uno por hilo
+        self._en_curso = threading.Lock()
+
+    def configurar(self, activo: Optional[bool] = None, tasa: Optional[float] = None) -> dict:
+        if activo is not None:
+            self.activo = activo
+        if tasa is not None:
+            self.tasa = min(max(tasa, 0.0), 1.0)
+        return self.estado()
+
+    def estado(self) -> dict:
+        return {
+            "enabled": self.activo,
+            "sample_rate": self.tasa,
+            "header_enabled": bool(self.token),
+            "max_profiles": self._perfiles.maxlen,
+            "stored": len(self._perfiles),
+            "pid": os.getpid(),
+        }
+
+    def motivo(self, scope) -> Optional[str]:
+        """'header' / 'muestreo' si hay que perfilar este request, si no None."""
+        if self.token:
+            recibido = next((v for k, v in scope["headers"] if k == PROFILE_HEADER.encode()), None)
+            if recibido is not None and secrets.compare_digest(recibido, self.token.encode()):
+                return "header"
+        if self.tasa > 0 and random.random() < self.tasa:
+            return "muestreo"
+        return None
+
+    def guardar(self, perfil: PerfilRequest):
+        self._perfiles.append(perfil)
+
+    def listar(self) -> List[dict]:
+        return [p.resumen() for p in reversed(self._perfiles)]
+
+    def obtener(self, perfil_id: int) -> Optional[PerfilRequest]:
+        return next((p for p in self._perfiles if p.id == perfil_id), None)
+
+
+class ProfilingMiddleware:
+    """Middleware ASGI que perfila con cProfile los requests elegidos por RequestProfiler."""
+
+    def __init__(self, app, perfilador: RequestProfiler):
+        self.app = app
+        self.perfilador = perfilador
+
+    async def __call__(self, scope, receive, send):
+        perfilador = self.perfilador
+        if scope["type"] != "http" or not perfilador.activo:
+            await self.app(scope, receive, send)
+            return
+        motivo = None if scope["path"].startswith(PROFILING_EXCLUDE) else perfilador.motivo(scope)
+        if motivo is None or not perfilador._en_curso.acquire(blocking=False):
+            await self.app(scope, receive, send)
+            return
+
+        perfil_id = next(perfilador._ids)
+        perfil = cProfile.Profile()
+        estado = {"status": None, "fin": None}
+
+        creado = time.time()
+        inicio = time.perf_counter()
+
+        def terminar():
+            if estado["fin"] is not None:
+                return
+            perfil.disable()
+            estado["fin"] = time.perf_counter()
+            perfilador._en_curso.release()
+            perfilador.guardar(PerfilRequest(
+                perfil_id, creado, scope["method"], scope["path"], estado["status"],
+                round((estado["fin"] - inicio) * 1000, 2), request_id.get(), motivo, perfil,
+            ))
+
+        async def enviar(message):
+            if message["type"] == "http.response.start":
+                estado["status"] = message["status"]
+                message["headers"] = list(message.get("headers", [])) + [
+                    (PROFILE_ID_HEADER.encode(), str(perfil_id).encode())
+                ]
+            elif message["type"] == "http.response.body" and not message.get("more_body", False):
+                # Respuesta completa: lo que sigue (BackgroundTasks) no es latencia del request
+                terminar()
+            await send(message)
+
+        try:
+            perfil.enable()
+            await self.app(scope, receive, enviar)
+        finally:
+            terminar()
@@ -158,6 +158,10 @@ interface AnalyticsResponse {
     question_dropoff: QuestionDropoff;
     step_dropoff: Record<string, number>;
     daily_traffic: DailyTrafficItem[];
+    // Solo con fields=geo,devices,channels
+    geo?: GeoResponse;
+    devices?: DevicesResponse;
+    channels?: ChannelsResponse;
     generated_at: string;
 }
 
@@ -290,12 +294,10 @@ export default function Dashboard() {
             // Construir query params de fecha
             const dateParams = `start_date=${startDate}&end_date=${endDate}`;
 
-            // Fetch Dashboard Completo (Unificado)
-            const [dashboardResponse, geoResponse, devicesResponse, channelsResponse, logsResponse, criticalLogsResponse, healthResponse] = await Promise.all([
-                fetch(`${API_URL}/api/analytics/dashboard?${dateParams}`, { headers }),
-                fetch(`${API_URL}/api/analytics/geo?${dateParams}`, { headers }).catch(() => null),
-                fetch(`${API_URL}/api/analytics/devices?${dateParams}`, { headers }).catch(() => null),
-                fetch(`${API_URL}/api/analytics/channels?${dateParams}`, { headers }).catch(() => null),
+            // Fetch Dashboard Completo (Unificado): todos los paneles por fecha en una sola pasada
+            const fields = 'kpis,funnel,traffic,geo,devices,channels';
+            const [dashboardResponse, logsResponse, criticalLogsResponse, healthResponse] = await Promise.all([
+                fetch(`${API_URL}/api/analytics/dashboard?${dateParams}&fields=${fields}`, { headers }),
                 fetch(`${API_URL}/api/analytics/logs?limit=50`, { headers }).catch(() => null),
                 fetch(`${API_URL}/api/analytics/logs?level=ERROR&limit=20`, { headers }).catch(() => null),
                 fetch(`${API_URL}/api/analytics/health`, { headers }).catch(() => null)
@@ -307,21 +309,9 @@ export default function Dashboard() {
             const dashboardJson = await dashboardResponse.json();
             // Asignar respuesta completa (KPIs + Funnel + Traffic)
             setData(dashboardJson);
-
-            if (geoResponse && geoResponse.ok) {
-                const geoJson = await geoResponse.json();
-                setGeoData(geoJson);
-            }
-
-            if (devicesResponse && devicesResponse.ok) {
-                const devicesJson = await devicesResponse.json();
-                setDevicesData(devicesJson);
-            }
-
-            if (channelsResponse && channelsResponse.ok) {
-                const channelsJson = await channelsResponse.json();
-                setChannelsData(channelsJson);
-            }
+            setGeoData(dashboardJson.geo ?? null);
+            setDevicesData(dashboardJson.devices ?? null);
+            setChannelsData(dashboardJson.channels ?? null);
 
             if (logsResponse && logsResponse.ok) {
                 const logsJson = await logsResponse.json();
@@ -352,6 +342,43 @@ export default function Dashboard() {
         return () => clearInterval(interval);
     }, [startDate, endDate]);
 
+    // Usuarios activos en vivo (SSE): el backend empuja el conteo cuando cambia.
+    // Se usa fetch en lugar de EventSource para poder enviar el header Authorization.
+    useEffect(() => {
+        const controller = new AbortController();
+
+        const subscribeLive = async () => {
+            const headers: HeadersInit = {};
+            if (DASHBOARD_USER && DASHBOARD_PASSWORD) {
+                headers['Authorization'] = `Basic ${btoa(`${DASHBOARD_USER}:${DASHBOARD_PASSWORD}`)}`;
+            }
+            const response = await fetch(`${API_URL}/api/analytics/live`, { headers, signal: controller.signal });
+            if (!response.ok || !response.body) return;
+
+            const reader = response.body.pipeThrough(new TextDecoderStream()).getReader();
+            let buffer = '';
+            while (true) {
+                const { value, done } = await reader.read();
+                if (done) break;
+                buffer += value;
+                const messages = buffer.split('\n\n');
+                buffer = messages.pop() ?? '';
+                for (const message of messages) {
+                    if (!message.startsWith('data: ')) continue;
+                    const live: { active_users: number; active_by_country: Record<string, number> } =
+                        JSON.parse(message.slice(6));
+                    setData(prev => prev ? { ...prev, kpis: { ...prev.kpis, active_users: live.active_users } } : prev);
+                    setGeoData(prev => prev ? { ...prev, active_by_country: live.active_by_country } : prev);
+                }
+            }
+        };
+
+        subscribeLive().catch(() => {
+            // Sin SSE (proxy que no lo soporta, etc.) el polling de fetchData sigue actualizando
+        });
+        return () => controller.abort();
+    }, []);
+
     const formatCurrency = (value: number) =>
         new Intl.NumberFormat('es-PE', { style: 'currency', currency: 'PEN', minimumFractionDigits: 0 }).format(value);
 
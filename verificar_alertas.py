@@ -0,0 +1,86 @@
+"""
+Verificación del motor de alertas (alert_engine.py) con un sink local.
+
+Simula una caída de Make.com sobre una base temporal con dos "workers" (dos
+AlertEngine con la misma analytics.db y un SinkMemoria cada uno):
+  1. Miles de fallas repartidas en pocas claves durante varias ventanas deben
+     producir como mucho una alerta por clave y cooldown entre ambos workers.
+  2. Ninguna ocurrencia se pierde: al vencer el cooldown y apagar, la suma de
+     ocurrencias de las alertas emitidas coincide con las reportadas.
+
+Uso:
+    python verificar_alertas.py        # sale con código 1 ante cualquier diferencia
+"""
+import asyncio
+import logging
+import os
+import sys
+import tempfile
+import time
+
+from alert_engine import AlertEngine, SinkMemoria
+from analytics_db import AnalyticsDB
+from mi_backend_python.init_db import init_db
+
+CLAVES = ["make.down", "make.timeout", "make.red"]
+FALLAS_POR_VENTANA = 2000
+VENTANAS = 5
+VENTANA_S = 0.2
+COOLDOWN_S = 0.5
+
+
+async def simular(db_path):
+    db = AnalyticsDB(db_path).open()
+    sinks = [SinkMemoria(), SinkMemoria()]
+    workers = [AlertEngine(db, sink, ventana=VENTANA_S, cooldown=COOLDOWN_S) for sink in sinks]
+    reportadas = {clave: 0 for clave in CLAVES}
+    inicio = time.time()
+    try:
+        for worker in workers:
+            worker.start()
+        for ventana in range(VENTANAS):
+            for i in range(FALLAS_POR_VENTANA):
+                clave = CLAVES[i % len(CLAVES)]
+                workers[i % 2].reportar(clave, f"Falla simulada {clave}", f"Empresa {i % 17}")
+                reportadas[clave] += 1
+            await asyncio.sleep(VENTANA_S)
+        duracion = time.time() - inicio
+        # Dejar vencer los cooldowns (incluido uno reclamado justo ahora) para que el apagado emita lo acumulado
+        await asyncio.sleep(2 * COOLDOWN_S)
+    finally:
+        for worker in workers:
+            await worker.stop()
+        db.close()
+    return [a for sink in sinks for a in sink.alertas], reportadas, duracion
+
+
+def main():
+    logging.basicConfig(level=logging.WARNING)
+    errores = 0
+    with tempfile.TemporaryDirectory() as directorio:
+        db_path = os.path.join(directorio, "analytics.db")
+        init_db(db_path)
+        alertas, reportadas, duracion = asyncio.run(simular(db_path))
+
+    total = sum(reportadas.values())
+    print(f"{total} fallas reportadas en {duracion:.1f}s -> {len(alertas)} alertas emitidas")
+    for clave in CLAVES:
+        emitidas = sorted((a for a in alertas if a.clave == clave), key=lambda a: a.primera)
+        ocurrencias = sum(a.ocurrencias for a in emitidas)
+        # Por clave: la primera alerta, una por cooldown durante la caída y la del apagado
+        maximo = int(duracion / COOLDOWN_S) + 2
+        ok = ocurrencias == reportadas[clave] and len(emitidas) <= maximo
+        errores += not ok
+        print(f"  [{'ok' if ok else 'FALLO'}] {clave}: {len(emitidas)} alertas (máx. {maximo}), "
+              f"{ocurrencias}/{reportadas[clave]} ocurrencias")
+        for alerta in emitidas:
+            print(f"        {alerta.resumen()}")
+
+    if errores:
+        print(f"\n❌ {errores} claves con alertas de más o con ocurrencias perdidas")
+        sys.exit(1)
+    print("\n✅ Fallas agrupadas sin pérdidas y con cooldown entre workers")
+
+
+if __name__ == "__main__":
+    main()
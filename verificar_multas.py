@@ -0,0 +1,93 @@
+"""
+Verificación de equivalencia del motor compilado de multas.
+
+Recorre cada tipo de empresa y cada número de trabajadores de 0 a 2000 y
+compara las multas del motor compilado (fine_engine.py) con las obtenidas
+de las tablas pandas originales de constants.py. Termina con código 1 si
+encuentra alguna diferencia.
+
+Uso:
+    python verificar_multas.py [max_trabajadores]
+"""
+import sys
+
+from constants import TABLA_MULTAS_GENERAL, TABLA_MULTAS_MICRO, TABLA_MULTAS_PEQUENA
+from fine_engine import multas_unitarias
+
+TIPOS_EMPRESA = ['micro', 'pequena', 'no_mype']
+
+# Combinaciones de hallazgos (leves, graves, muy graves) para el monto acumulado
+COMBINACIONES_HALLAZGOS = [(1, 0, 0), (0, 1, 0), (0, 0, 1), (3, 7, 2), (5, 30, 4)]
+
+
+def multas_unitarias_dataframe(tipo_empresa, numero_trabajadores):
+    """Implementación de referencia: bandas if/elif + DataFrame.loc."""
+    if tipo_empresa == 'micro':
+        if numero_trabajadores <= 9: columna = str(numero_trabajadores)
+        else: columna = '10 y más'
+        tabla, filas = TABLA_MULTAS_MICRO, ['Leves', 'Grave', 'Muy Grave']
+        return tuple(tabla.loc[fila, columna] for fila in filas)
+    elif tipo_empresa == 'pequena':
+        if numero_trabajadores <= 5: columna = '1 a 5'
+        elif numero_trabajadores <= 10: columna = '6 a 10'
+        elif numero_trabajadores <= 20: columna = '11 a 20'
+        elif numero_trabajadores <= 30: columna = '21 a 30'
+        elif numero_trabajadores <= 40: columna = '31 a 40'
+        elif numero_trabajadores <= 50: columna = '41 a 50'
+        elif numero_trabajadores <= 60: columna = '51 a 60'
+        elif numero_trabajadores <= 70: columna = '61 a 70'
+        elif numero_trabajadores <= 99: columna = '71 a 99'
+        else: columna = '100 y más'
+        tabla, filas = TABLA_MULTAS_PEQUENA, ['Leves', 'Grave', 'Muy Grave']
+        return tuple(tabla.loc[fila, columna] for fila in filas)
+    else:
+        if numero_trabajadores <= 10: rango = '1-10'
+        elif numero_trabajadores <= 25: rango = '11-25'
+        elif numero_trabajadores <= 50: rango = '26-50'
+        elif numero_trabajadores <= 100: rango = '51-100'
+        elif numero_trabajadores <= 200: rango = '101-200'
+        elif numero_trabajadores <= 300: rango = '201-300'
+        elif numero_trabajadores <= 400: rango = '301-400'
+        elif numero_trabajadores <= 500: rango = '401-500'
+        elif numero_trabajadores <= 600: rango = '501-600'
+        elif numero_trabajadores <= 700: rango = '601-700'
+        elif numero_trabajadores <= 800: rango = '701-800'
+        elif numero_trabajadores <= 900: rango = '801-900'
+        else: rango = '901-a-mas'
+        return tuple(TABLA_MULTAS_GENERAL.loc[rango, col] for col in ['Leve', 'Grave', 'Muy Grave'])
+
+
+def monto_acumulado(multas, hallazgos, numero_trabajadores):
+    """Monto acumulado tal como lo calcula calcular_multa_sunafil."""
+    if numero_trabajadores <= 0:
+        return 0.0
+    return float(sum(cantidad * multa for cantidad, multa in zip(hallazgos, multas())))
+
+
+def verificar(max_trabajadores=2000):
+    diferencias = []
+    for tipo_empresa in TIPOS_EMPRESA:
+        for numero_trabajadores in range(0, max_trabajadores + 1):
+            for hallazgos in COMBINACIONES_HALLAZGOS:
+                esperado = monto_acumulado(
+                    lambda: multas_unitarias_dataframe(tipo_empresa, numero_trabajadores),
+                    hallazgos, numero_trabajadores,
+                )
+                obtenido = monto_acumulado(
+                    lambda: multas_unitarias(tipo_empresa, numero_trabajadores),
+                    hallazgos, numero_trabajadores,
+                )
+                if esperado != obtenido:
+                    diferencias.append((tipo_empresa, numero_trabajadores, hallazgos, esperado, obtenido))
+    return diferencias
+
+
+if __name__ == "__main__":
+    maximo = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    diferencias = verificar(maximo)
+    for diferencia in diferencias[:20]:
+        print("❌ Diferencia:", diferencia)
+    if diferencias:
+        print(f"❌ {len(diferencias)} diferencias encontradas")
+        sys.exit(1)
+    print(f"✅ Motor compilado equivalente a las tablas pandas ({len(TIPOS_EMPRESA)} tipos × 0..{maximo} trabajadores)")
@@ -0,0 +1,278 @@
+"""
+Verificación del outbox de Make.com (webhook_outbox.py) contra un webhook simulado.
+
+Sobre un make_outbox.db temporal, con httpx.MockTransport en lugar de Make.com:
+  1. Reintentos: 500 -> 429 con Retry-After -> 200 termina entregado, en tres
+     intentos y respetando la espera del Retry-After. Los ganchos de métricas
+     reciben cada intento y la entrega.
+  2. Dead-letter: un webhook que siempre responde 500 se intenta exactamente
+     max_intentos veces, el registro queda en 'dead' y se reporta la alerta.
+  3. Reinicio: un registro reclamado por un worker que murió a mitad del envío
+     no se reenvía mientras dura su lease y se entrega al vencer.
+  4. Apagado: stop() con un envío colgado lo cancela al vencer su timeout, el
+     outbox se cierra sin errores y el registro queda pendiente para el
+     próximo arranque.
+  5. Limitador: si la espera del rate limiter supera el lease y otro worker
+     reclama y entrega el registro, el primero no lo reenvía.
+
+Uso:
+    python verificar_outbox.py        # sale con código 1 ante cualquier diferencia
+"""
+import asyncio
+import gc
+import logging
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+import httpx
+
+from webhook_outbox import ESTADO_ENTREGADO, ESTADO_MUERTO, ESTADO_PENDIENTE, OutboxDispatcher, WebhookOutbox
+
+URL = "https://hook.make.test/webhook"
+POLL_S = 0.05
+LEASE_S = 0.5
+RETRY_AFTER_S = 1
+
+
+class Ganchos:
+    """Anota lo que el despachador reporta a los ganchos de métricas y alertas."""
+
+    def __init__(self):
+        self.intentos = []
+        self.entregas = []
+        self.agotados = []
+
+    def opciones(self):
+        return {
+            "al_intentar": lambda resultado, _: self.intentos.append(resultado),
+            "al_terminar": lambda resultado, _: self.entregas.append(resultado),
+            "al_agotar": lambda resultado, error, etiqueta: self.agotados.append((resultado, error, etiqueta)),
+        }
+
+
+class LimitadorLento:
+    """Limitador de prueba: cada token tarda `espera` segundos."""
+
+    def __init__(self, espera: float):
+        self.espera = espera
+
+    async def acquire(self):
+        await asyncio.sleep(self.espera)
+
+
+class WebhookSimulado:
+    """Responde con la secuencia de status indicada (el último se repite) y anota cada POST."""
+
+    def __init__(self, respuestas, demora: float = 0.0):
+        self.respuestas = list(respuestas)
+        self.demora = demora
+        self.llamadas = []
+
+    async def __call__(self, request: httpx.Request) -> httpx.Response:
+        self.llamadas.append(time.monotonic())
+        if self.demora:
+            await asyncio.sleep(self.demora)
+        status = self.respuestas[min(len(self.llamadas), len(self.respuestas)) - 1]
+        headers = {"Retry-After": str(RETRY_AFTER_S)} if status == 429 else {}
+        return httpx.Response(status, headers=headers)
+
+
+def registro(db_path, outbox_id):
+    conn = sqlite3.connect(db_path)
+    try:
+        return conn.execute(
+            "SELECT status, attempts, last_error FROM webhook_outbox WHERE id = ?", (outbox_id,)
+        ).fetchone()
+    finally:
+        conn.close()
+
+
+async def esperar_estado(db_path, outbox_id, estado, limite: float = 5.0) -> bool:
+    fin = time.monotonic() + limite
+    while time.monotonic() < fin:
+        if registro(db_path, outbox_id)[0] == estado:
+            return True
+        await asyncio.sleep(POLL_S)
+    return False
+
+
+async def con_despachador(db_path, webhook, lease=60.0, **opciones):
+    """Arranca outbox + despachador con el webhook simulado; devuelve lo necesario para detenerlos."""
+    outbox = WebhookOutbox(db_path, lease_segundos=lease).open()
+    cliente = httpx.AsyncClient(transport=httpx.MockTransport(webhook))
+    despachador = OutboxDispatcher(outbox, cliente, URL, poll_interval=POLL_S, base_delay=0.05, **opciones)
+    despachador.start()
+    return outbox, cliente, despachador
+
+
+async def detener(outbox, cliente, despachador, timeout=10.0):
+    await despachador.stop(timeout=timeout)
+    outbox.close()
+    await cliente.aclose()
+
+
+async def caso_reintentos(directorio):
+    db_path = os.path.join(directorio, "reintentos.db")
+    webhook = WebhookSimulado([500, 429, 200])
+    ganchos = Ganchos()
+    outbox, cliente, despachador = await con_despachador(db_path, webhook, **ganchos.opciones())
+    try:
+        outbox_id = outbox.enqueue({"empresa": "Reintentos"}, "Reintentos")
+        despachador.notify()
+        entregado = await esperar_estado(db_path, outbox_id, ESTADO_ENTREGADO)
+    finally:
+        await detener(outbox, cliente, despachador)
+    fallos = []
+    estado, intentos, _ = registro(db_path, outbox_id)
+    if not entregado or estado != ESTADO_ENTREGADO:
+        fallos.append(f"estado final {estado!r}")
+    if intentos != 3 or len(webhook.llamadas) != 3:
+        fallos.append(f"{intentos} intentos / {len(webhook.llamadas)} POST (esperados 3)")
+    elif webhook.llamadas[2] - webhook.llamadas[1] < RETRY_AFTER_S * 0.9:
+        fallos.append(f"reintento a los {webhook.llamadas[2] - webhook.llamadas[1]:.2f}s pese a Retry-After")
+    if ganchos.intentos != ["http_5xx", "http_429", "ok"] or ganchos.entregas != ["entregado"]:
+        fallos.append(f"ganchos: intentos {ganchos.intentos}, entregas {ganchos.entregas}")
+    return fallos
+
+
+async def caso_dead_letter(directorio):
+    db_path = os.path.join(directorio, "dead.db")
+    webhook = WebhookSimulado([500])
+    ganchos = Ganchos()
+    outbox, cliente, despachador = await con_despachador(db_path, webhook, max_intentos=3, **ganchos.opciones())
+    try:
+        outbox_id = outbox.enqueue({"empresa": "Caída"}, "Caída")
+        despachador.notify()
+        muerto = await esperar_estado(db_path, outbox_id, ESTADO_MUERTO)
+        # Ya en dead-letter no debe volver a intentarse
+        await asyncio.sleep(10 * POLL_S)
+    finally:
+        await detener(outbox, cliente, despachador)
+    fallos = []
+    estado, intentos, error = registro(db_path, outbox_id)
+    if not muerto or estado != ESTADO_MUERTO or error != "HTTP 500":
+        fallos.append(f"estado final {estado!r} ({error})")
+    if intentos != 3 or len(webhook.llamadas) != 3:
+        fallos.append(f"{intentos} intentos / {len(webhook.llamadas)} POST (esperados 3)")
+    if ganchos.entregas != ["fallido"] or ganchos.agotados != [("http_5xx", "HTTP 500", "Caída")]:
+        fallos.append(f"ganchos: entregas {ganchos.entregas}, dead-letter {ganchos.agotados}")
+    return fallos
+
+
+async def caso_reinicio(directorio):
+    db_path = os.path.join(directorio, "reinicio.db")
+    # Worker anterior: reclama el registro y muere antes de confirmarlo
+    anterior = WebhookOutbox(db_path, lease_segundos=LEASE_S).open()
+    outbox_id = anterior.enqueue({"empresa": "Reinicio"}, "Reinicio")
+    anterior.claim(1)
+    anterior.close()
+    reclamado = time.monotonic()
+
+    webhook = WebhookSimulado([200])
+    outbox, cliente, despachador = await con_despachador(db_path, webhook, lease=LEASE_S)
+    try:
+        await asyncio.sleep(LEASE_S / 2)
+        durante_lease = len(webhook.llamadas)
+        entregado = await esperar_estado(db_path, outbox_id, ESTADO_ENTREGADO)
+    finally:
+        await detener(outbox, cliente, despachador)
+    fallos = []
+    estado, intentos, _ = registro(db_path, outbox_id)
+    if durante_lease:
+        fallos.append("reenviado con el lease vigente")
+    if not entregado or estado != ESTADO_ENTREGADO or len(webhook.llamadas) != 1:
+        fallos.append(f"estado final {estado!r} con {len(webhook.llamadas)} POST (esperado 1)")
+    elif webhook.llamadas[0] - reclamado < LEASE_S * 0.9:
+        fallos.append(f"reenviado a los {webhook.llamadas[0] - reclamado:.2f}s (lease {LEASE_S}s)")
+    if intentos != 2:
+        fallos.append(f"{intentos} intentos (esperados 2)")
+    return fallos
+
+
+async def caso_apagado(directorio):
+    db_path = os.path.join(directorio, "apagado.db")
+    webhook = WebhookSimulado([200], demora=1.0)
+    outbox, cliente, despachador = await con_despachador(db_path, webhook, lease=LEASE_S)
+    outbox_id = outbox.enqueue({"empresa": "Apagado"}, "Apagado")
+    despachador.notify()
+    while not webhook.llamadas:
+        await asyncio.sleep(POLL_S)
+    inicio = time.monotonic()
+    await detener(outbox, cliente, despachador, timeout=0.2)
+    duracion = time.monotonic() - inicio
+    # Dar lugar a que un envío no cancelado termine y choque con el outbox cerrado
+    await asyncio.sleep(webhook.demora)
+    gc.collect()
+
+    fallos = []
+    if duracion > 2:
+        fallos.append(f"stop() tardó {duracion:.1f}s")
+    estado, intentos, _ = registro(db_path, outbox_id)
+    if estado != ESTADO_PENDIENTE or intentos != 1:
+        fallos.append(f"registro {estado!r} con {intentos} intentos (esperado pendiente, 1)")
+    siguiente = WebhookOutbox(db_path, lease_segundos=LEASE_S).open()
+    try:
+        if [fila["id"] for fila in siguiente.claim(1)] != [outbox_id]:
+            fallos.append("no se puede reclamar tras vencer el lease")
+    finally:
+        siguiente.close()
+    return fallos
+
+
+async def caso_limitador(directorio):
+    db_path = os.path.join(directorio, "limitador.db")
+    webhook = WebhookSimulado([200])
+    # Worker lento: reclama el registro y espera su token más allá del lease
+    lento = await con_despachador(db_path, webhook, lease=LEASE_S, limitador=LimitadorLento(3 * LEASE_S))
+    outbox_id = lento[0].enqueue({"empresa": "Limitador"}, "Limitador")
+    lento[2].notify()
+    while registro(db_path, outbox_id)[1] == 0:
+        await asyncio.sleep(POLL_S)
+    # Otro worker lo reclama al vencer el lease y lo entrega
+    rapido = await con_despachador(db_path, webhook, lease=LEASE_S)
+    try:
+        entregado = await esperar_estado(db_path, outbox_id, ESTADO_ENTREGADO)
+        # El worker lento recibe su token después
+        await asyncio.sleep(3 * LEASE_S)
+    finally:
+        await detener(*rapido)
+        await detener(*lento)
+    fallos = []
+    estado, intentos, _ = registro(db_path, outbox_id)
+    if not entregado or estado != ESTADO_ENTREGADO:
+        fallos.append(f"estado final {estado!r}")
+    if len(webhook.llamadas) != 1:
+        fallos.append(f"{len(webhook.llamadas)} POST (esperado 1): entregado dos veces")
+    return fallos
+
+
+def main():
+    logging.basicConfig(level=logging.CRITICAL)
+    errores = 0
+    with tempfile.TemporaryDirectory() as directorio:
+        for caso in (caso_reintentos, caso_dead_letter, caso_reinicio, caso_apagado, caso_limitador):
+            excepciones = []
+
+            async def correr():
+                # Excepciones de tareas que nadie espera (p. ej. un envío que sobrevive al cierre)
+                asyncio.get_running_loop().set_exception_handler(lambda _, contexto: excepciones.append(contexto))
+                return await caso(directorio)
+
+            fallos = asyncio.run(correr())
+            fallos.extend(f"excepción no manejada: {c.get('exception') or c['message']}" for c in excepciones)
+            errores += len(fallos)
+            print(f"  {caso.__name__}: {'ok' if not fallos else 'FALLO'}")
+            for fallo in fallos:
+                print(f"    - {fallo}")
+
+    if errores:
+        print(f"\n❌ {errores} fallos en el outbox")
+        sys.exit(1)
+    print("\n✅ Outbox: reintentos, dead-letter, reinicio, apagado y limitador correctos")
+
+
+if __name__ == "__main__":
+    main()
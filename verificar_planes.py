@@ -0,0 +1,105 @@
+"""
+Verificación de planes de consulta del dashboard de analytics.
+
+Crea una base temporal con init_db (esquema + migraciones), ejecuta las
+funciones de consulta reales de analytics.py capturando cada SELECT con
+set_trace_callback, y corre EXPLAIN QUERY PLAN sobre cada uno. Falla si alguna
+consulta recorre una tabla completa (SCAN) en lugar de buscar por índice.
+
+Uso:
+    python verificar_planes.py        # sale con código 1 si hay algún SCAN
+"""
+import os
+import re
+import sqlite3
+import sys
+import tempfile
+
+import analytics
+from analytics_db import configurar_conexion, epoch_ahora, epoch_de_dia
+from analytics_export import COLUMNAS as COLUMNAS_EXPORT, consultas_export, rango_epoch
+from analytics_logs import consultar_logs, leer_salud
+from analytics_partitions import insertar_eventos
+from analytics_presence import contar_activos
+from mi_backend_python.init_db import init_db
+
+START_DATE, END_DATE = "2025-01-01", "2025-01-31"
+
+
+def poblar(conn):
+    ahora = epoch_ahora()
+    conn.executemany(
+        "INSERT INTO sessions (session_id, created_at, last_activity, country_code, device_type, utm_source, "
+        "is_converted, conversion_amount) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+        [(f"s{i}", epoch_de_dia(f"2025-01-{i % 28 + 1:02d}") + 36000, ahora, "PE", "desktop", "direct", i % 2, 100.0 * i)
+         for i in range(200)],
+    )
+    insertar_eventos(conn, [
+        (f"s{i % 200}", tipo, None, epoch_de_dia(f"2025-01-{i % 28 + 1:02d}") + 36000)
+        for i, tipo in enumerate(analytics.EVENTOS_DASHBOARD * 20)
+    ])
+    conn.commit()
+
+
+def consultas_del_dashboard(conn):
+    """SELECTs que ejecutan realmente los endpoints del dashboard (parámetros expandidos)."""
+    capturadas = []
+    conn.set_trace_callback(capturadas.append)
+    try:
+        # Activos desde las cubetas compartidas, como los lee responder_cacheado
+        activos = contar_activos(conn)
+        analytics.consultar_kpis(conn, START_DATE, END_DATE, activos)
+        analytics.consultar_geo(conn, START_DATE, END_DATE, activos)
+        analytics.consultar_devices(conn, START_DATE, END_DATE)
+        analytics.consultar_channels(conn, START_DATE, END_DATE)
+        analytics.consultar_dashboard(conn, START_DATE, END_DATE, activos)
+        # Logs (keyset con y sin filtros) y salud del sistema
+        consultar_logs(conn, 50)
+        consultar_logs(conn, 20, "ERROR", before_id=1000)
+        consultar_logs(conn, 50, module="webhook.make")
+        leer_salud(conn, epoch_ahora())
+        # Export columnar para BI (analytics_export.py)
+        for tabla, columnas in COLUMNAS_EXPORT.items():
+            for sql, params in consultas_export(conn, tabla, *rango_epoch(START_DATE, END_DATE), tuple(columnas)):
+                conn.execute(sql, params).fetchall()
+    finally:
+        conn.set_trace_callback(None)
+    vistas = set()
+    for sql in capturadas:
+        sql = " ".join(sql.split())
+        # Misma consulta con distintos literales (p. ej. la hora actual) se revisa una vez
+        forma = re.sub(r"'[^']*'", "?", sql)
+        if sql.upper().startswith(("SELECT", "WITH")) and forma not in vistas:
+            vistas.add(forma)
+            yield sql
+
+
+def main():
+    fallos = 0
+    with tempfile.TemporaryDirectory() as directorio:
+        db_path = os.path.join(directorio, "analytics.db")
+        init_db(db_path)
+        conn = configurar_conexion(sqlite3.connect(db_path))
+        poblar(conn)
+        conn.execute("ANALYZE")
+        tablas = {r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+
+        for sql in consultas_del_dashboard(conn):
+            plan = [r["detail"] for r in conn.execute(f"EXPLAIN QUERY PLAN {sql}")]
+            # SCAN de una tabla real; recorrer un CTE o subconsulta ya acotada no cuenta
+            scans = [paso for paso in plan if paso.startswith("SCAN ") and paso.split()[1] in tablas]
+            estado = "FALLO" if scans else "ok"
+            fallos += bool(scans)
+            print(f"[{estado}] {sql[:110]}{'...' if len(sql) > 110 else ''}")
+            for paso in plan:
+                print(f"        {paso}")
+        conn.close()
+
+    if fallos:
+        print(f"\n❌ {fallos} consultas recorren tablas completas")
+        sys.exit(1)
+    print("\n✅ Todas las consultas del dashboard usan índices")
+
+
+if __name__ == "__main__":
+    main()
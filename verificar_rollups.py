@@ -0,0 +1,269 @@
+"""
+Verificación de consistencia entre los rollups diarios y los datos crudos.
+
+Sobre una base temporal con datos sintéticos de ~60 días:
+  1. Compacta (backfill inicial) y compara cada fila de los rollups con el
+     agregado crudo del mismo día.
+  2. Compara las respuestas de kpis/geo/devices/channels/dashboard leyendo
+     rollups (días anteriores al corte) contra las mismas funciones leyendo
+     solo tablas crudas (sin corte).
+  3. Compara las sesiones distintas del funnel de cada rango contra un
+     COUNT(DISTINCT session_id) directo sobre los eventos crudos; parte de las
+     sesiones vuelve a recorrer el funnel otro día y debe contar una sola vez.
+  4. Ingresa datos nuevos (sesiones de días pasados, conversiones tardías),
+     compacta de forma incremental y repite las tres comparaciones.
+  5. Escritores concurrentes: varios hilos, cada uno con su conexión (como
+     los workers de gunicorn), insertan lotes que cruzan meses; los event_id
+     deben quedar únicos y consecutivos entre todas las particiones.
+
+Uso:
+    python verificar_rollups.py        # sale con código 1 ante cualquier diferencia
+"""
+import math
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import threading
+from datetime import date, datetime, timedelta
+
+import analytics
+from analytics_db import configurar_conexion, epoch_de_dia, hoy_utc
+from analytics_ingest import persistir_eventos
+from analytics_partitions import insertar_eventos, particiones
+from analytics_rollup import (
+    _SQL_SESIONES_CRUDAS, cerrar_compactacion, dia_siguiente, dias_sucios, eventos_crudos, funnel_crudo,
+    recalcular_dias,
+)
+from mi_backend_python.init_db import init_db
+
+DIAS = 60
+ESCRITORES = 4
+LOTES_POR_ESCRITOR = 150
+PAISES = ["PE", "CL", "MX", None]
+DISPOSITIVOS = ["desktop", "mobile", "tablet"]
+FUENTES = ["direct", "google", "facebook", None]
+
+
+def generar_sesiones(conn, cantidad, prefijo):
+    hoy = datetime.combine(date.today(), datetime.min.time())
+    for i in range(cantidad):
+        session_id = f"{prefijo}{i}"
+        inicio = hoy - timedelta(days=random.randrange(DIAS), seconds=-random.randrange(0, 80000))
+        conn.execute(
+            "INSERT INTO sessions (session_id, created_at, last_activity, country, country_code, device_type, "
+            "utm_source) VALUES (?, ?, ?, 'Unknown', ?, ?, ?)",
+            (session_id, int(inicio.timestamp()), int(inicio.timestamp()), random.choice(PAISES),
+             random.choice(DISPOSITIVOS), random.choice(FUENTES)),
+        )
+        eventos = [("session_start", None)] + [(paso, None) for paso in analytics.PASOS_FUNNEL[:3]]
+        for qid in analytics.PREGUNTAS_ORDENADAS[:random.randrange(1, 42)]:
+            eventos.append((f"question_viewed_{qid}", None))
+            if random.random() < 0.9:
+                eventos.append((f"question_answered_{qid}", None))
+        insertar_eventos(conn, [
+            (session_id, tipo, datos, int(inicio.timestamp()) + n) for n, (tipo, datos) in enumerate(eventos)
+        ])
+        # Sesión de varios días: vuelve a iniciar el formulario uno a tres días después
+        regreso = inicio + timedelta(days=random.randrange(1, 4))
+        if random.random() < 0.25 and regreso < datetime.now():
+            insertar_eventos(conn, [
+                (session_id, paso, None, int(regreso.timestamp()) + n)
+                for n, paso in enumerate(analytics.PASOS_FUNNEL[:2])
+            ])
+        if random.random() < 0.3:
+            convertir(conn, session_id, inicio + timedelta(seconds=len(eventos)))
+
+
+def convertir(conn, session_id, cuando):
+    monto = round(random.uniform(500, 90000), 2)
+    insertar_eventos(conn, [(session_id, "confirmation_page_viewed", f'{{"amount": {monto}}}', int(cuando.timestamp()))])
+    conn.execute("UPDATE sessions SET is_converted = 1, conversion_amount = ? WHERE session_id = ?", (monto, session_id))
+
+
+def compactar(conn):
+    dias, hasta = dias_sucios(conn)
+    with conn:
+        recalcular_dias(conn, dias)
+        cerrar_compactacion(conn, hasta, hoy_utc())
+    return len(dias)
+
+
+def normalizar(filas):
+    return sorted((tuple(r) for r in filas), key=repr)
+
+
+def iguales(a, b):
+    if isinstance(a, float) or isinstance(b, float):
+        return isinstance(a, (int, float)) and isinstance(b, (int, float)) and math.isclose(a, b, rel_tol=1e-9, abs_tol=1e-6)
+    if isinstance(a, dict) and isinstance(b, dict):
+        return a.keys() == b.keys() and all(iguales(a[k], b[k]) for k in a)
+    if isinstance(a, (list, tuple)) and isinstance(b, (list, tuple)):
+        return len(a) == len(b) and all(iguales(x, y) for x, y in zip(a, b))
+    return a == b
+
+
+def comparar_filas(conn):
+    """Cada día de los rollups contra el agregado crudo de ese día."""
+    errores = 0
+    dias = [r[0] for r in conn.execute(
+        "SELECT day FROM rollup_sesiones_diarias UNION SELECT day FROM rollup_eventos_diarios")]
+    for dia in dias:
+        rango = (epoch_de_dia(dia), epoch_de_dia(dia_siguiente(dia)))
+        pares = [
+            ("SELECT * FROM rollup_sesiones_diarias WHERE day = ?", (_SQL_SESIONES_CRUDAS, rango)),
+            ("SELECT * FROM rollup_eventos_diarios WHERE day = ?", eventos_crudos(conn, *rango)),
+            ("SELECT * FROM rollup_funnel_sesiones WHERE day = ?", funnel_crudo(conn, *rango)),
+        ]
+        for sql_rollup, (sql_crudo, params) in pares:
+            if not iguales(normalizar(conn.execute(sql_rollup, (dia,))), normalizar(conn.execute(sql_crudo, params))):
+                print(f"  ❌ {dia}: rollup distinto del crudo ({sql_rollup.split()[3]})")
+                errores += 1
+    return errores, len(dias)
+
+
+def rangos():
+    hoy = date.fromisoformat(hoy_utc())
+    inicio = (hoy - timedelta(days=DIAS + 2)).isoformat()
+    fin = hoy.isoformat()
+    medio = (hoy - timedelta(days=DIAS // 2)).isoformat()
+    return [(inicio, fin), (inicio, medio), (medio, fin), (fin, fin)]
+
+
+def respuestas(conn):
+    activos = analytics.ConteoActivos(0, {})
+    salida = {}
+    for start_date, end_date in rangos():
+        for nombre, fn in [("kpis", analytics.consultar_kpis), ("geo", analytics.consultar_geo),
+                           ("dashboard", analytics.consultar_dashboard)]:
+            resultado = fn(conn, start_date, end_date, activos)
+            resultado.pop("generated_at", None)
+            if nombre == "geo":
+                resultado["countries"].sort(key=lambda c: c["country_code"])
+            salida[(nombre, start_date, end_date)] = resultado
+        for nombre, fn in [("devices", analytics.consultar_devices), ("channels", analytics.consultar_channels)]:
+            salida[(nombre, start_date, end_date)] = fn(conn, start_date, end_date)
+    return salida
+
+
+def comparar_respuestas(conn):
+    """Endpoints leyendo rollups contra los mismos endpoints leyendo solo datos crudos."""
+    con_rollups = respuestas(conn)
+    corte = conn.execute("SELECT valor FROM rollup_estado WHERE clave = 'corte'").fetchone()[0]
+    with conn:
+        conn.execute("DELETE FROM rollup_estado WHERE clave = 'corte'")
+    crudas = respuestas(conn)
+    with conn:
+        conn.execute("INSERT INTO rollup_estado (clave, valor) VALUES ('corte', ?)", (corte,))
+    errores = 0
+    for clave, esperado in crudas.items():
+        if not iguales(con_rollups[clave], esperado):
+            print(f"  ❌ {clave}: respuesta con rollups distinta de la cruda")
+            errores += 1
+    return errores, len(crudas)
+
+
+def comparar_funnel(conn):
+    """Sesiones distintas por paso del funnel contra COUNT(DISTINCT) sobre todo el rango crudo."""
+    errores = 0
+    marcadores = ",".join("?" * len(analytics.PASOS_FUNNEL))
+    for start_date, end_date in rangos():
+        desde, hasta = epoch_de_dia(start_date), epoch_de_dia(dia_siguiente(end_date))
+        union = " UNION ALL ".join(f"SELECT event_type, session_id, created_at FROM events_{mes}" for mes in particiones(conn))
+        esperado = dict(conn.execute(f"""
+            SELECT event_type, COUNT(DISTINCT session_id) FROM ({union})
+            WHERE created_at >= ? AND created_at < ? AND event_type IN ({marcadores})
+            GROUP BY event_type
+        """, (desde, hasta) + analytics.PASOS_FUNNEL))
+        conteos = analytics.contar_eventos_dashboard(conn, start_date, end_date)
+        obtenido = {paso: conteos[paso][1] for paso in analytics.PASOS_FUNNEL if paso in conteos}
+        if obtenido != esperado:
+            print(f"  ❌ funnel {start_date}..{end_date}: {obtenido} != {esperado}")
+            errores += 1
+    return errores, len(rangos())
+
+
+def escribir_lotes(db_path, n, fallos):
+    conn = configurar_conexion(sqlite3.connect(db_path))
+    ahora = int(datetime.now().timestamp())
+    try:
+        for lote in range(LOTES_POR_ESCRITOR):
+            session_id = f"c{n}_{lote}"
+            # Un evento de hace ~40 días y otros de hoy: el lote toca dos particiones
+            eventos = [(session_id, "session_start", None, ahora - 40 * 86400)] + [
+                (session_id, paso, None, ahora + i) for i, paso in enumerate(analytics.PASOS_FUNNEL[:3])
+            ]
+            with conn:
+                persistir_eventos(conn, eventos)
+    except sqlite3.Error as e:
+        fallos.append(f"escritor {n}: {e}")
+    finally:
+        conn.close()
+
+
+def escritores_concurrentes(directorio):
+    db_path = os.path.join(directorio, "concurrente.db")
+    init_db(db_path)
+    fallos = []
+    hilos = [threading.Thread(target=escribir_lotes, args=(db_path, n, fallos)) for n in range(ESCRITORES)]
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join()
+
+    conn = configurar_conexion(sqlite3.connect(db_path))
+    ids = []
+    for mes in particiones(conn):
+        ids.extend(r[0] for r in conn.execute(f"SELECT event_id FROM events_{mes}"))
+    conn.close()
+    esperados = ESCRITORES * LOTES_POR_ESCRITOR * 4
+    for fallo in fallos:
+        print(f"  FALLO {fallo}")
+    if len(ids) != esperados or len(set(ids)) != len(ids) or sorted(ids) != list(range(1, len(ids) + 1)):
+        fallos.append("ids")
+        print(f"  FALLO event_id: {len(ids)} eventos, {len(set(ids))} distintos (esperados {esperados})")
+    print(f"  escritores_concurrentes: {ESCRITORES} escritores x {LOTES_POR_ESCRITOR} lotes, "
+          f"{len(set(ids))}/{esperados} event_id únicos")
+    return len(fallos)
+
+
+def main():
+    random.seed(11)
+    errores = 0
+    with tempfile.TemporaryDirectory() as directorio:
+        db_path = os.path.join(directorio, "analytics.db")
+        init_db(db_path)
+        conn = configurar_conexion(sqlite3.connect(db_path))
+
+        with conn:
+            generar_sesiones(conn, 3000, "s")
+        print(f"Backfill: {compactar(conn)} días compactados")
+        for paso in (comparar_filas, comparar_respuestas, comparar_funnel):
+            fallos, total = paso(conn)
+            errores += fallos
+            print(f"  {paso.__name__}: {total - fallos}/{total} ok")
+
+        with conn:
+            generar_sesiones(conn, 500, "n")
+            for (session_id, creada) in conn.execute(
+                    "SELECT session_id, created_at FROM sessions WHERE is_converted = 0 LIMIT 200").fetchall():
+                convertir(conn, session_id, datetime.now())
+        print(f"Incremental: {compactar(conn)} días recompactados")
+        for paso in (comparar_filas, comparar_respuestas, comparar_funnel):
+            fallos, total = paso(conn)
+            errores += fallos
+            print(f"  {paso.__name__}: {total - fallos}/{total} ok")
+        conn.close()
+
+        print("Escritura concurrente:")
+        errores += escritores_concurrentes(directorio)
+
+    if errores:
+        print(f"\n❌ {errores} diferencias entre rollups y datos crudos")
+        sys.exit(1)
+    print("\n✅ Rollups consistentes con los datos crudos")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+# webhook_delivery.py
+"""Control de caudal para las entregas a Make.com.
+
+- TokenBucket: limitador compartido por todas las entregas del proceso
+  (BackgroundTasks, lotes y outbox) para mantenerse bajo la cuota de Make en
+  lugar de reaccionar a los 429.
+- TokenBucketCompartido: el mismo bucket guardado en SQLite, para que la
+  cuota sea una sola entre todos los workers de gunicorn.
+- MakeBatcher: agrupa diagnósticos durante una ventana de tiempo/tamaño y los
+  envía como un único POST con un arreglo JSON.
+"""
+import asyncio
+import logging
+import sqlite3
+import threading
+import time
+from typing import Awaitable, Callable, List, Optional
+
+
+class TokenBucket:
+    """Token bucket asíncrono: `tasa` tokens por segundo, ráfagas de hasta `capacidad`."""
+
+    def __init__(self, tasa: float, capacidad: Optional[float] = None):
+        if tasa <= 0:
+            raise ValueError("La tasa del limitador debe ser positiva")
+        self.tasa = tasa
+        self.capacidad = capacidad if capacidad is not None else max(1.0, tasa)
+        self._tokens = self.capacidad
+        self._ultimo = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _rellenar(self):
+        ahora = time.monotonic()
+        self._tokens = min(self.capacidad, self._tokens + (ahora - self._ultimo) * self.tasa)
+        self._ultimo = ahora
+
+    async def acquire(self):
+        """Espera hasta disponer de un token (orden FIFO entre los que esperan)."""
+        async with self._lock:
+            self._rellenar()
+            while self._tokens < 1:
+                await asyncio.sleep((1 - self._tokens) / self.tasa)
+                self._rellenar()
+            self._tokens -= 1
+
+
+class TokenBucketCompartido(TokenBucket):
+    """TokenBucket cuyo estado vive en una fila de SQLite compartida entre procesos.
+
+    Cada acquire() reserva un token en una transacción (BEGIN IMMEDIATE): el
+    saldo puede quedar negativo y quien reserva espera a que se reponga su
+    parte. Así los workers se reparten una única tasa en orden de llegada en
+    vez de tener cada uno la suya. Usa el reloj de pared (time.time), que es
+    común a todos los procesos.
+    """
+
+    def __init__(self, db_path: str, tasa: float, capacidad: Optional[float] = None, nombre: str = "make"):
+        super().__init__(tasa, capacidad)
+        self.db_path = db_path
+        self.nombre = nombre
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock_conn = threading.Lock()
+
+    def _conexion(self) -> sqlite3.Connection:
+        if self._conn is None:
+            conn = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA busy_timeout=5000")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS rate_limit_buckets (
+                    nombre TEXT PRIMARY KEY,
+                    tokens REAL NOT NULL,
+                    actualizado REAL NOT NULL
+                )
+            """)
+            self._conn = conn
+        return self._conn
+
+    def reservar(self) -> float:
+        """Toma un token del bucket compartido; devuelve cuántos segundos esperar para usarlo."""
+        with self._lock_conn:
+            conn = self._conexion()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                ahora = time.time()
+                fila = conn.execute(
+                    "SELECT tokens, actualizado FROM rate_limit_buckets WHERE nombre = ?", (self.nombre,)
+                ).fetchone()
+                tokens = self.capacidad
+                if fila is not None:
+                    tokens = min(self.capacidad, fila[0] + max(0.0, ahora - fila[1]) * self.tasa)
+                tokens -= 1
+                conn.execute(
+                    "INSERT OR REPLACE INTO rate_limit_buckets (nombre, tokens, actualizado) VALUES (?, ?, ?)",
+                    (self.nombre, tokens, ahora),
+                )
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        return max(0.0, -tokens / self.tasa)
+
+    async def acquire(self):
+        try:
+            espera = await asyncio.to_thread(self.reservar)
+        except sqlite3.Error as e:
+            # Sin acceso al estado compartido se sigue limitando dentro del proceso
+            logging.error(f"❌ [RateLimit] Bucket compartido no disponible: {e}")
+            await super().acquire()
+            return
+        if espera > 0:
+            await asyncio.sleep(espera)
+
+    def close(self):
+        with self._lock_conn:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+EnviarLote = Callable[[List[dict], str], Awaitable[None]]
+
+
+class MakeBatcher:
+    """Agrupa payloads y los entrega en lotes por ventana de tiempo o tamaño.
+
+    Un lote se envía cuando alcanza `tamano_max` elementos o cuando pasan
+    `ventana` segundos desde que llegó su primer elemento, lo que ocurra antes.
+    """
+
+    def __init__(self, enviar: EnviarLote, ventana: float = 2.0, tamano_max: int = 50):
+        self.enviar = enviar
+        self.ventana = ventana
+        self.tamano_max = tamano_max
+        self._pendientes: List[dict] = []
+        self._temporizador: Optional[asyncio.Task] = None
+        self._en_vuelo: set = set()
+
+    def add(self, payload):
+        """Agrega un diagnóstico (dict) o varios (lista) al lote en curso."""
+        if isinstance(payload, list):
+            self._pendientes.extend(payload)
+        else:
+            self._pendientes.append(payload)
+
+        while len(self._pendientes) >= self.tamano_max:
+            self._despachar(self._pendientes[:self.tamano_max])
+            self._pendientes = self._pendientes[self.tamano_max:]
+
+        if not self._pendientes:
+            self._cancelar_temporizador()
+        elif self._temporizador is None:
+            self._temporizador = asyncio.create_task(self._vencer_ventana())
+
+    async def _vencer_ventana(self):
+        await asyncio.sleep(self.ventana)
+        self._temporizador = None
+        self.flush()
+
+    def _cancelar_temporizador(self):
+        if self._temporizador is not None:
+            self._temporizador.cancel()
+            self._temporizador = None
+
+    def flush(self):
+        """Envía de inmediato lo acumulado."""
+        self._cancelar_temporizador()
+        if self._pendientes:
+            self._despachar(self._pendientes)
+            self._pendientes = []
+
+    def _despachar(self, lote: List[dict]):
+        etiqueta = f"lote de {len(lote)} diagnósticos"
+        logging.info(f"📦 [Batch] Enviando {etiqueta} a Make")
+        tarea = asyncio.create_task(self.enviar(lote, etiqueta))
+        self._en_vuelo.add(tarea)
+        tarea.add_done_callback(self._en_vuelo.discard)
+
+    async def close(self, timeout: float = 30.0):
+        """Vacía el lote en curso y espera los envíos pendientes hasta `timeout`."""
+        self.flush()
+        if self._en_vuelo:
+            await asyncio.wait(self._en_vuelo, timeout=timeout)
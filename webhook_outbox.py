@@ -0,0 +1,388 @@
+# webhook_outbox.py
+"""Outbox persistente (SQLite) para las entregas a Make.com.
+
+Cada diagnóstico se guarda en la tabla `webhook_outbox` dentro del request y
+un despachador asíncrono dedicado la drena en segundo plano:
+
+- Concurrencia acotada (semáforo) y backoff exponencial con jitter.
+- Respeta el encabezado Retry-After de los 429/503.
+- Tras `max_intentos` fallidos el registro pasa a estado 'dead' (dead-letter).
+- Sobrevive a reinicios: los registros pendientes siguen en disco y un envío
+  interrumpido a mitad de camino se reintenta cuando vence su lease.
+- Reporta cada intento y cada entrega (entregada o en dead-letter) a los
+  mismos ganchos de métricas y alertas que el envío por BackgroundTasks.
+
+El reclamo de registros es un único UPDATE ... RETURNING, por lo que varios
+workers de gunicorn pueden compartir el mismo archivo sin entregar dos veces
+el mismo registro mientras su lease esté vigente.
+"""
+import asyncio
+import json
+import logging
+import random
+import sqlite3
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from typing import Callable, Dict, List, Optional, Sequence
+
+import httpx
+
+from webhook_delivery import TokenBucket
+
+OUTBOX_DB = "make_outbox.db"
+
+ESTADO_PENDIENTE = "pending"
+ESTADO_ENTREGADO = "delivered"
+ESTADO_MUERTO = "dead"
+
+
+class WebhookOutbox:
+    """Cola persistente de payloads pendientes de enviar a Make.com."""
+
+    def __init__(self, db_path: str = OUTBOX_DB, lease_segundos: float = 60.0):
+        self.db_path = db_path
+        # Tiempo durante el cual un registro reclamado no puede volver a reclamarse.
+        # Debe superar el timeout del cliente HTTP.
+        self.lease_segundos = lease_segundos
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+
+    def open(self):
+        conn = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA busy_timeout=5000")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS webhook_outbox (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                payload TEXT NOT NULL,
+                empresa TEXT,
+                status TEXT NOT NULL DEFAULT 'pending',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_attempt_at REAL NOT NULL,
+                last_error TEXT,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_outbox_pending ON webhook_outbox(status, next_attempt_at)")
+        self._conn = conn
+        return self
+
+    def close(self):
+        # Bajo el lock: una actualización que aún corre en un hilo termina antes
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def _execute(self, sql: str, params=()):
+        with self._lock:
+            if self._conn is None:
+                raise sqlite3.ProgrammingError("El outbox está cerrado")
+            return self._conn.execute(sql, params).fetchall()
+
+    def enqueue(self, payload, empresa: str) -> int:
+        """Guarda un payload (dict o lista) para su entrega. Devuelve el id."""
+        ahora = time.time()
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT INTO webhook_outbox (payload, empresa, status, next_attempt_at, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (json.dumps(payload, ensure_ascii=False), empresa, ESTADO_PENDIENTE, ahora, ahora, ahora),
+            )
+            return cursor.lastrowid
+
+    def claim(self, limite: int) -> List[sqlite3.Row]:
+        """Reclama hasta `limite` registros vencidos y les asigna un lease."""
+        ahora = time.time()
+        return self._execute(
+            """
+            UPDATE webhook_outbox
+            SET attempts = attempts + 1, next_attempt_at = ?, updated_at = ?
+            WHERE id IN (
+                SELECT id FROM webhook_outbox
+                WHERE status = ? AND next_attempt_at <= ?
+                ORDER BY id LIMIT ?
+            )
+            RETURNING id, payload, empresa, attempts, next_attempt_at, created_at
+            """,
+            (ahora + self.lease_segundos, ahora, ESTADO_PENDIENTE, ahora, limite),
+        )
+
+    def renew_lease(self, filas: Sequence[sqlite3.Row]) -> List[int]:
+        """Extiende el lease de registros reclamados; devuelve los ids que siguen siendo propios.
+
+        El next_attempt_at que devolvió claim() identifica el lease: si venció y
+        otro worker volvió a reclamar el registro, ya no coincide y queda fuera.
+        """
+        ahora = time.time()
+        propios = []
+        for fila in filas:
+            propios.extend(
+                r[0]
+                for r in self._execute(
+                    "UPDATE webhook_outbox SET next_attempt_at = ?, updated_at = ? "
+                    "WHERE id = ? AND status = ? AND next_attempt_at = ? RETURNING id",
+                    (ahora + self.lease_segundos, ahora, fila["id"], ESTADO_PENDIENTE, fila["next_attempt_at"]),
+                )
+            )
+        return propios
+
+    def _actualizar(self, ids: Sequence[int], asignaciones: str, params=()):
+        marcadores = ",".join("?" * len(ids))
+        self._execute(
+            f"UPDATE webhook_outbox SET {asignaciones}, updated_at = ? WHERE id IN ({marcadores})",
+            (*params, time.time(), *ids),
+        )
+
+    def mark_delivered(self, ids: Sequence[int]):
+        self._actualizar(ids, "status = ?, last_error = NULL", (ESTADO_ENTREGADO,))
+
+    def schedule_retry(self, ids: Sequence[int], delay: float, error: str):
+        self._actualizar(ids, "next_attempt_at = ?, last_error = ?", (time.time() + delay, error))
+
+    def mark_dead(self, ids: Sequence[int], error: str):
+        self._actualizar(ids, "status = ?, last_error = ?", (ESTADO_MUERTO, error))
+
+    def purge_delivered(self, antiguedad_segundos: float) -> int:
+        """Elimina entregas confirmadas más antiguas que la retención indicada."""
+        filas = self._execute(
+            "DELETE FROM webhook_outbox WHERE status = ? AND updated_at < ? RETURNING id",
+            (ESTADO_ENTREGADO, time.time() - antiguedad_segundos),
+        )
+        return len(filas)
+
+    def stats(self) -> Dict[str, int]:
+        filas = self._execute("SELECT status, COUNT(*) FROM webhook_outbox GROUP BY status")
+        return {estado: total for estado, total in filas}
+
+
+def parse_retry_after(valor: Optional[str]) -> Optional[float]:
+    """Interpreta Retry-After en segundos o como fecha HTTP."""
+    if not valor:
+        return None
+    try:
+        return max(0.0, float(valor))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(valor).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class OutboxDispatcher:
+    """Worker asíncrono que drena el outbox hacia el webhook de Make.com.
+
+    Con `tamano_lote` > 1 los registros acumulados durante `ventana_lote`
+    segundos se envían juntos como un arreglo JSON en un solo POST.
+
+    Ganchos opcionales (los mismos que usa enviar_a_make_background en main.py):
+    - al_intentar(resultado, inicio): cada POST, con resultado "ok", "http_5xx",
+      "http_429", "http_4xx", "timeout" o "red" e inicio en time.perf_counter().
+    - al_terminar(resultado, inicio): cada entrega, "entregado" o "fallido"
+      (dead-letter); el inicio es el encolado del registro más antiguo.
+    - al_agotar(resultado, error, etiqueta): registros movidos a dead-letter,
+      con el resultado de su último intento.
+    """
+
+    def __init__(
+        self,
+        outbox: WebhookOutbox,
+        http_client: httpx.AsyncClient,
+        url: str,
+        headers_factory: Callable[[], Dict[str, str]] = dict,
+        concurrencia: int = 4,
+        max_intentos: int = 8,
+        base_delay: float = 2.0,
+        max_delay: float = 600.0,
+        poll_interval: float = 1.0,
+        retencion_entregados: float = 7 * 24 * 3600,
+        limitador: Optional[TokenBucket] = None,
+        tamano_lote: int = 1,
+        ventana_lote: float = 2.0,
+        al_intentar: Optional[Callable[[str, float], None]] = None,
+        al_terminar: Optional[Callable[[str, float], None]] = None,
+        al_agotar: Optional[Callable[[str, str, str], None]] = None,
+    ):
+        self.outbox = outbox
+        self.http_client = http_client
+        self.url = url
+        self.headers_factory = headers_factory
+        self.concurrencia = concurrencia
+        self.max_intentos = max_intentos
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.retencion_entregados = retencion_entregados
+        self.limitador = limitador
+        self.tamano_lote = max(1, tamano_lote)
+        # En modo lote el poll ES la ventana de agrupación
+        self.poll_interval = ventana_lote if self.tamano_lote > 1 else poll_interval
+        self.al_intentar = al_intentar
+        self.al_terminar = al_terminar
+        self.al_agotar = al_agotar
+        self._semaforo = asyncio.Semaphore(concurrencia)
+        self._despertar = asyncio.Event()
+        self._en_vuelo: set = set()
+        self._task: Optional[asyncio.Task] = None
+        self._detenido = False
+
+    def start(self):
+        self._task = asyncio.create_task(self._run(), name="make-outbox-dispatcher")
+        logging.info(
+            f"📬 [Outbox] Despachador iniciado (concurrencia={self.concurrencia}, lote={self.tamano_lote})"
+        )
+
+    def notify(self):
+        """Despierta al despachador tras encolar (evita esperar al próximo poll).
+
+        En modo lote no se despierta: se deja que la ventana acumule registros.
+        """
+        if self.tamano_lote == 1:
+            self._despertar.set()
+
+    async def stop(self, timeout: float = 10.0):
+        """Detiene el bucle y espera a los envíos en curso hasta `timeout`.
+
+        Los que siguen en curso se cancelan (después se cierra el outbox): sus
+        registros quedan pendientes y se reintentan cuando vence el lease.
+        """
+        self._detenido = True
+        self._despertar.set()
+        if self._task is not None:
+            await self._task
+        if self._en_vuelo:
+            _, pendientes = await asyncio.wait(self._en_vuelo, timeout=timeout)
+            if pendientes:
+                logging.warning(
+                    f"⚠️ [Outbox] {len(pendientes)} envíos cancelados al detener; "
+                    f"se reintentarán al vencer su lease ({self.outbox.lease_segundos:.0f}s)"
+                )
+                for tarea in pendientes:
+                    tarea.cancel()
+                await asyncio.gather(*pendientes, return_exceptions=True)
+        logging.info("📪 [Outbox] Despachador detenido")
+
+    def backoff(self, intento: int) -> float:
+        delay = min(self.max_delay, self.base_delay * (2 ** (intento - 1)))
+        return delay * random.uniform(0.8, 1.2)
+
+    async def _run(self):
+        ultimo_purgado = 0.0
+        while not self._detenido:
+            self._despertar.clear()
+            libres = self.concurrencia - len(self._en_vuelo)
+            pedidas = max(libres, 0) * self.tamano_lote
+            filas = []
+            if pedidas > 0:
+                try:
+                    filas = await asyncio.to_thread(self.outbox.claim, pedidas)
+                except sqlite3.Error as e:
+                    logging.error(f"❌ [Outbox] Error al reclamar registros: {e}")
+
+            for inicio in range(0, len(filas), self.tamano_lote):
+                tarea = asyncio.create_task(self._entregar(filas[inicio:inicio + self.tamano_lote]))
+                self._en_vuelo.add(tarea)
+                tarea.add_done_callback(self._en_vuelo.discard)
+                tarea.add_done_callback(lambda _: self.notify())
+
+            if time.time() - ultimo_purgado > 3600:
+                ultimo_purgado = time.time()
+                await asyncio.to_thread(self.outbox.purge_delivered, self.retencion_entregados)
+
+            # Solo se vuelve a reclamar de inmediato si el reclamo vino completo (hay más
+            # pendientes). Sin cupo (todos los envíos en vuelo, p. ej. Make caído) o con
+            # menos filas de las pedidas se espera al fin de un envío, a notify() o al poll.
+            if pedidas == 0 or len(filas) < pedidas:
+                try:
+                    await asyncio.wait_for(self._despertar.wait(), timeout=self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+            else:
+                await asyncio.sleep(0)
+
+    def _cuerpo(self, filas) -> bytes:
+        if self.tamano_lote == 1:
+            return filas[0]["payload"].encode("utf-8")
+        # Modo lote: siempre un arreglo plano de diagnósticos
+        elementos = []
+        for fila in filas:
+            payload = json.loads(fila["payload"])
+            elementos.extend(payload if isinstance(payload, list) else [payload])
+        return json.dumps(elementos, ensure_ascii=False).encode("utf-8")
+
+    def _inicio_entrega(self, filas) -> float:
+        # Desde el encolado (reintentos y reinicios incluidos), en la escala de time.perf_counter()
+        return time.perf_counter() - (time.time() - min(fila["created_at"] for fila in filas))
+
+    async def _entregar(self, filas):
+        async with self._semaforo:
+            if self.limitador is not None:
+                await self.limitador.acquire()
+                # La espera del limitador puede superar el lease: sin renovarlo, otro
+                # worker reclamaría los mismos registros y Make los recibiría dos veces
+                propios = set(await asyncio.to_thread(self.outbox.renew_lease, filas))
+                filas = [fila for fila in filas if fila["id"] in propios]
+                if not filas:
+                    return
+            ids = [fila["id"] for fila in filas]
+            etiqueta = filas[0]["empresa"] if len(filas) == 1 else f"lote de {len(filas)} registros"
+            referencia = ", ".join(f"#{outbox_id}" for outbox_id in ids)
+            retry_after = None
+            inicio_intento = time.perf_counter()
+            try:
+                response = await self.http_client.post(
+                    self.url,
+                    content=self._cuerpo(filas),
+                    headers={"Content-Type": "application/json", **self.headers_factory()},
+                )
+                response.raise_for_status()
+            except httpx.HTTPStatusError as e:
+                status_code = e.response.status_code
+                if status_code in (429, 503):
+                    retry_after = parse_retry_after(e.response.headers.get("Retry-After"))
+                error = f"HTTP {status_code}"
+                resultado = "http_5xx" if status_code >= 500 else "http_429" if status_code == 429 else "http_4xx"
+            except httpx.TimeoutException as e:
+                error = f"Timeout: {e}"
+                resultado = "timeout"
+            except httpx.HTTPError as e:
+                error = f"Error de red: {e}"
+                resultado = "red"
+            else:
+                if self.al_intentar is not None:
+                    self.al_intentar("ok", inicio_intento)
+                await asyncio.to_thread(self.outbox.mark_delivered, ids)
+                if self.al_terminar is not None:
+                    self.al_terminar("entregado", self._inicio_entrega(filas))
+                logging.info(f"✅ [Outbox] {referencia} enviado a Make para: {etiqueta}")
+                return
+            if self.al_intentar is not None:
+                self.al_intentar(resultado, inicio_intento)
+
+        # Cada registro conserva su propio contador de intentos
+        agotados = [fila for fila in filas if fila["attempts"] >= self.max_intentos]
+        reintentar = [fila for fila in filas if fila["attempts"] < self.max_intentos]
+
+        if agotados:
+            await asyncio.to_thread(self.outbox.mark_dead, [fila["id"] for fila in agotados], error)
+            if self.al_terminar is not None:
+                self.al_terminar("fallido", self._inicio_entrega(agotados))
+            if self.al_agotar is not None:
+                self.al_agotar(resultado, error, etiqueta)
+            muertos = ", ".join(f"#{fila['id']}" for fila in agotados)
+            logging.error(
+                f"💀 [Outbox] {muertos} ({etiqueta}) movido a dead-letter "
+                f"tras {self.max_intentos} intentos: {error}"
+            )
+        if reintentar:
+            intento = max(fila["attempts"] for fila in reintentar)
+            delay = min(retry_after, self.max_delay) if retry_after is not None else self.backoff(intento)
+            await asyncio.to_thread(self.outbox.schedule_retry, [fila["id"] for fila in reintentar], delay, error)
+            logging.warning(
+                f"⏳ [Outbox] {error} para {etiqueta} ({referencia}, intento {intento}/{self.max_intentos}). "
+                f"Reintento en {delay:.0f}s"
+            )